@@ -1,7 +1,9 @@
-from pymongo import MongoClient
-from mongodb_base import connection_string
+from mongodb_base.client import get_client, pool_waits
 
 if __name__ == "__main__":
 
-    # Client connects to MongoDB Server
-    client = MongoClient(connection_string)
+    # Shared, pooled client for the MongoDB Server
+    client = get_client()
+
+    # Report how long checkouts queued for a pooled connection
+    print(pool_waits.summary())
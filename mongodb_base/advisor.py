@@ -0,0 +1,253 @@
+"""
+Explain-based index advisor for the project's queries and pipelines.
+
+Every entry of QUERY_CATALOGUE is explained with the "executionStats" verbosity.
+Entries whose winning plan contains a collection scan (COLLSCAN) or an in-memory
+SORT get a proposed compound index, ordered by the ESR rule: Equality fields
+first, then Sort fields, then Range fields.
+
+The agg_pipelines entries are the compiled pipelines the reports run (see
+mongodb_base.pipelines), bound to CATALOGUE_PARAMETERS.
+"""
+import re
+from collections import OrderedDict, namedtuple
+
+from bson import Regex
+
+from mongodb_base.pipelines import COMPILED_PIPELINES, compiled
+
+# `distinct` is the key of a distinct() call, explained with `filter` as its query
+QuerySpec = namedtuple("QuerySpec", ["name", "collection", "filter", "sort", "pipeline", "distinct"])
+QuerySpec.__new__.__defaults__ = (None, None, None, None)
+
+# Values of the compiled pipelines' parameters: the categories awarded in 1901, and
+# the limit aggregation_pipeline runs with
+CATALOGUE_PARAMETERS = {
+    "categories": ["chemistry", "literature", "medicine", "peace", "physics"],
+    "limit": 3,
+}
+
+
+def _pipeline_specs():
+    specs = []
+    for name in COMPILED_PIPELINES:
+        pipeline = compiled(name)
+        values = {parameter: CATALOGUE_PARAMETERS[parameter] for parameter in pipeline.parameters}
+        specs.append(QuerySpec(name, pipeline.collection, pipeline=pipeline.bind(**values)))
+    return specs
+
+
+_ELEM_MATCH_NOT_PHYSICS = {"$nin": ["physics", "chemistry", "medicine"]}
+
+QUERY_CATALOGUE = [
+    # query_db
+    QuerySpec("filter_non_operator.died_usa", "laureates", {"diedCountry": "USA"}),
+    QuerySpec("filter_non_operator.died_usa_born_germany", "laureates",
+              {"diedCountry": "USA", "bornCountry": "Germany"}),
+    QuerySpec("filter_non_operator.albert", "laureates",
+              {"bornCountry": "Germany", "diedCountry": "USA", "firstname": "Albert"}),
+    QuerySpec("filter_operators.austria_elsewhere", "laureates",
+              {"bornCountry": "Austria", "prizes.affiliations.country": {"$ne": "Austria"}}),
+    QuerySpec("filter_operators.died_usa_born_elsewhere", "laureates",
+              {"diedCountry": "USA", "bornCountry": {"$ne": "USA"}}),
+    QuerySpec("filter_operators.north_america", "laureates",
+              {"bornCountry": {"$in": ["USA", "Canada", "Mexico"]}}),
+    QuerySpec("filter_operators.born_before_1900", "laureates", {"born": {"$lt": "1900"}}),
+    QuerySpec("distinct_assertion.prizes", "prizes", distinct="category"),
+    QuerySpec("distinct_assertion.laureates", "laureates", distinct="prizes.category"),
+    QuerySpec("distinct_set_operation.died", "laureates", distinct="diedCountry"),
+    QuerySpec("distinct_set_operation.born", "laureates", distinct="bornCountry"),
+    QuerySpec("distinct_count", "laureates", distinct="prizes.affiliations.country"),
+    QuerySpec("distinct_filter.usa_born", "laureates", {"bornCountry": "USA"},
+              distinct="prizes.affiliations.country"),
+    QuerySpec("distinct_filter_set.triple_play", "prizes", {"laureates.2": {"$exists": True}}, distinct="category"),
+    QuerySpec("element_match.physics_shared", "laureates", {"prizes": {"$elemMatch": {
+        "category": "physics", "share": {"$ne": "1"}, "year": {"$gte": "1945"}}}}),
+    QuerySpec("element_match_ratio.unshared", "laureates", {"prizes": {"$elemMatch": {
+        "category": _ELEM_MATCH_NOT_PHYSICS, "share": "1", "year": {"$gte": "1945"}}}}),
+    QuerySpec("element_match_ratio.shared", "laureates", {"prizes": {"$elemMatch": {
+        "category": _ELEM_MATCH_NOT_PHYSICS, "share": {"$ne": "1"}, "year": {"$gte": "1945"}}}}),
+    QuerySpec("comparision_operator.before", "laureates",
+              {"gender": "org", "prizes.year": {"$lt": "1945"}}),
+    QuerySpec("comparision_operator.in_or_after", "laureates",
+              {"gender": "org", "prizes.year": {"$gte": "1945"}}),
+    QuerySpec("mongodb_regex.g_s", "laureates", {"firstname": Regex("^G"), "surname": Regex("^S")}),
+    QuerySpec("mongodb_regex.germany", "laureates", {"bornCountry": Regex("Germany")}, distinct="bornCountry"),
+    QuerySpec("mongodb_regex.germany_prefix", "laureates", {"bornCountry": Regex("^Germany")},
+              distinct="bornCountry"),
+    QuerySpec("mongodb_sorting", "laureates",
+              {"born": {"$gte": "1900"}, "prizes.year": {"$gte": "1954"}},
+              sort=[("prizes.year", 1), ("born", -1)]),
+    QuerySpec("sort_projection", "prizes", {"category": "physics"}, sort=[("year", 1)]),
+    QuerySpec("gap_years", "prizes", {}, sort=[("year", -1), ("category", 1)]),
+    QuerySpec("gap_years.original_categories", "prizes", {"year": "1901"}, distinct="category"),
+    QuerySpec("filter_projection_sort_limit", "prizes", {"laureates.share": "4"}, sort=[("year", 1)]),
+    QuerySpec("get_particle_laureates", "laureates", {"prizes.motivation": {"$regex": "particle"}},
+              sort=[("prizes.year", 1), ("surname", 1)]),
+] + _pipeline_specs()  # agg_pipelines
+
+_EQUALITY_OPERATORS = {"$eq", "$in"}
+_RANGE_OPERATORS = {"$gt", "$gte", "$lt", "$lte", "$ne", "$nin"}
+
+
+def explain(db, spec):
+    """
+    Run explain("executionStats") for a catalogue entry.
+    """
+    if spec.pipeline is not None:
+        command = {"aggregate": spec.collection, "pipeline": spec.pipeline, "cursor": {}}
+    elif spec.distinct is not None:
+        command = {"distinct": spec.collection, "key": spec.distinct, "query": spec.filter or {}}
+    else:
+        command = {"find": spec.collection, "filter": spec.filter or {}}
+        if spec.sort:
+            command["sort"] = OrderedDict(spec.sort)
+    return db.command("explain", command, verbosity="executionStats")
+
+
+def _find_key(node, key):
+    # Yield every value stored under `key` anywhere in a nested explain document
+    if isinstance(node, dict):
+        for name, value in node.items():
+            if name == key:
+                yield value
+            else:
+                yield from _find_key(value, key)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _find_key(item, key)
+
+
+def winning_plan_stages(explain_output):
+    """
+    Return the names of all stages of the winning plan(s), leaves last.
+    """
+    return [stage for plan in _find_key(explain_output, "winningPlan")
+            for stage in _find_key(plan, "stage")]
+
+
+def execution_summary(explain_output):
+    """
+    Documents examined, keys examined and documents returned, summed over the
+    executionStats sections of an explain output.
+    """
+    summary = {"docs_examined": 0, "keys_examined": 0, "n_returned": 0}
+    for stats in _find_key(explain_output, "executionStats"):
+        summary["docs_examined"] += stats.get("totalDocsExamined", 0)
+        summary["keys_examined"] += stats.get("totalKeysExamined", 0)
+        summary["n_returned"] += stats.get("nReturned", 0)
+    summary["examined_per_returned"] = summary["docs_examined"] / max(summary["n_returned"], 1)
+    return summary
+
+
+def _regex_prefix(pattern):
+    # Only case-sensitive regexes anchored with "^" and starting with a literal can use index bounds
+    match = re.match(r"\^([\w ]+)", pattern)
+    return match.group(1) if match else None
+
+
+def _classify(path, condition, equality, ranges):
+    if isinstance(condition, (Regex, re.Pattern)):
+        if _regex_prefix(condition.pattern) and not condition.flags:
+            ranges.append(path)
+        return
+    if not isinstance(condition, dict) or not any(key.startswith("$") for key in condition):
+        equality.append(path)
+        return
+    if "$elemMatch" in condition:
+        for sub_path, sub_condition in condition["$elemMatch"].items():
+            if not sub_path.startswith("$"):
+                _classify(path + "." + sub_path, sub_condition, equality, ranges)
+        return
+    if "$regex" in condition:
+        if _regex_prefix(condition["$regex"]) and not condition.get("$options"):
+            ranges.append(path)
+        return
+    operators = set(condition)
+    if operators & _EQUALITY_OPERATORS and not operators & _RANGE_OPERATORS:
+        equality.append(path)
+    elif operators & _RANGE_OPERATORS:
+        ranges.append(path)
+
+
+def filter_fields(criteria):
+    """
+    Split the field paths of a filter into (equality fields, range fields).
+    $or/$nor branches and $exists tests are ignored; they do not make good index prefixes.
+    """
+    equality, ranges = [], []
+    for path, condition in (criteria or {}).items():
+        if path == "$and":
+            for clause in condition:
+                clause_equality, clause_ranges = filter_fields(clause)
+                equality += clause_equality
+                ranges += clause_ranges
+        elif not path.startswith("$"):
+            _classify(path, condition, equality, ranges)
+    return equality, ranges
+
+
+def propose_index(spec, max_fields=4):
+    """
+    Propose an ESR-ordered index (list of (field, direction)) for a catalogue entry,
+    or None when nothing in it can use one.
+    """
+    criteria, sort = spec.filter, spec.sort or []
+    if spec.pipeline is not None:
+        criteria = spec.pipeline[0].get("$match") if spec.pipeline else None
+        if len(spec.pipeline) > 1 and "$sort" in spec.pipeline[1]:
+            sort = list(spec.pipeline[1]["$sort"].items())
+
+    if spec.distinct is not None:
+        # The distinct key plays the part of a sort field: the index yields its values in order
+        sort = [(spec.distinct, 1)]
+
+    equality, ranges = filter_fields(criteria)
+    keys = OrderedDict((field, 1) for field in equality)
+    for field, direction in sort:
+        keys.setdefault(field, direction)
+    for field in ranges:
+        keys.setdefault(field, 1)
+    return list(keys.items())[:max_fields] or None
+
+
+def advise(mongo_client, catalogue=None, build=False):
+    """
+    Explain every catalogue entry, flag collection scans and in-memory sorts and
+    propose an index for each flagged entry. With build=True, the proposed indexes are
+    created and the entries explained again to report the docs-examined ratio before
+    and after.
+    """
+    db = mongo_client["nobel"]
+
+    report = []
+    for spec in catalogue or QUERY_CATALOGUE:
+        output = explain(db, spec)
+        stages = winning_plan_stages(output)
+        flags = sorted({stage for stage in stages if stage in ("COLLSCAN", "SORT")})
+        entry = {"name": spec.name, "collection": spec.collection, "flags": flags,
+                 "before": execution_summary(output), "index": None}
+        if flags:
+            entry["index"] = propose_index(spec)
+        report.append(entry)
+
+    if build:
+        built = set()
+        for entry in report:
+            if entry["index"] and (entry["collection"], tuple(entry["index"])) not in built:
+                db[entry["collection"]].create_index(entry["index"])
+                built.add((entry["collection"], tuple(entry["index"])))
+        for spec, entry in zip(catalogue or QUERY_CATALOGUE, report):
+            if entry["index"]:
+                entry["after"] = execution_summary(explain(db, spec))
+
+    for entry in report:
+        line = "{name}: {flags} examined/returned {ratio:.1f}".format(
+            name=entry["name"], flags=",".join(entry["flags"]) or "ok",
+            ratio=entry["before"]["examined_per_returned"])
+        if entry["index"]:
+            line += " -> index {}".format(entry["index"])
+        if "after" in entry:
+            line += " ({:.1f} after)".format(entry["after"]["examined_per_returned"])
+        print(line)
+    return report
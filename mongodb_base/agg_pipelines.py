@@ -1,6 +1,8 @@
 from itertools import groupby
 from operator import itemgetter
-from collections import OrderedDict
+
+from mongodb_base.domains import domain_values
+from mongodb_base.pipelines import compiled
 
 
 def aggregation_pipeline(mongo_client):
@@ -9,13 +11,7 @@ def aggregation_pipeline(mongo_client):
     db = mongo_client["nobel"]
 
     # Translate cursor to aggregation pipeline
-    pipeline = [
-        {"$match": {"gender": {"$ne": "org"}}},
-        {"$project": {"bornCountry": 1, "prizes.affiliations.country": 1}},
-        {"$limit": 3}
-    ]
-
-    for doc in db.laureates.aggregate(pipeline):
+    for doc in compiled("aggregation_pipeline").aggregate(db, limit=3):
         print("{bornCountry}: {prizes}".format(**doc))
 
 
@@ -24,15 +20,11 @@ def aggregation_pipeline2(mongo_client):
     """
     db = mongo_client["nobel"]
 
-    original_categories = set(db.prizes.distinct("category", {"year": "1901"}))
+    # Categories awarded in 1901, from the in-process value-domain cache
+    original_categories = set(domain_values(db, "original_categories"))
 
-    # Save an pipeline to collect original-category prizes
-    pipeline = [
-        {"$match": {"category": {"$in": list(original_categories)}}},
-        {"$project": {"category": 1, "year": 1}},
-        {"$sort": OrderedDict([("year", -1)])}
-    ]
-    cursor = db.prizes.aggregate(pipeline)
+    # Collect original-category prizes, newest first
+    cursor = compiled("aggregation_pipeline2").aggregate(db, categories=sorted(original_categories))
     for key, group in groupby(cursor, key=itemgetter("year")):
         missing = original_categories - {doc["category"] for doc in group}
         if missing:
@@ -45,13 +37,7 @@ def aggregation_pipeline3(mongo_client):
     db = mongo_client["nobel"]
 
     # Count prizes awarded (at least partly) to organizations as a sum over sizes of "prizes" arrays.
-    pipeline = [
-        {"$match": {"gender": "org"}},
-        {"$project": {"n_prizes": {"$size": "$prizes"}}},
-        {"$group": {"_id": None, "n_prizes_total": {"$sum": "$n_prizes"}}}
-    ]
-
-    print(list(db.laureates.aggregate(pipeline)))
+    print(list(compiled("aggregation_pipeline3").aggregate(db)))
 
 
 def gap_years_aggregated(mongo_client):
@@ -68,27 +54,9 @@ def gap_years_aggregated(mongo_client):
         in expressions.
     """
     db = mongo_client["nobel"]
+    original_categories = domain_values(db, "original_categories")
 
-    original_categories = sorted(set(db.prizes.distinct("category", {"year": "1901"})))
-
-    pipeline = [
-        {"$match": {"category": {"$in": original_categories}}},
-        {"$project": {"category": 1, "year": 1}},
-
-        # Collect the set of category values for each prize year.
-        {"$group": {"_id": "$year", "categories": {"$addToSet": "$category"}}},
-
-        # Project categories *not* awarded (i.e., that are missing this year).
-        {"$project": {"missing": {"$setDifference": [original_categories, "$categories"]}}},
-
-        # Only include years with at least one missing category
-        {"$match": {"missing.0": {"$exists": True}}},
-
-        # Sort in reverse chronological order. Note that "_id" is a distinct year at this stage.
-        {"$sort": OrderedDict([("_id", -1)])},
-    ]
-
-    for doc in db.prizes.aggregate(pipeline):
+    for doc in compiled("gap_years_aggregated").aggregate(db, categories=original_categories):
         print("{year}: {missing}".format(year=doc["_id"], missing=", ".join(sorted(doc["missing"]))))
 
 
@@ -102,25 +70,7 @@ def aggregation_pipeline4(mongo_client):
     """
     db = mongo_client["nobel"]
 
-    key_ac = "prizes.affiliations.country"
-    key_bc = "bornCountry"
-    pipeline = [
-        {"$project": {key_bc: 1, key_ac: 1}},
-
-        # Ensure a single prize affiliation country per pipeline document
-        {"$unwind": "$prizes"},
-        {"$unwind": "$prizes.affiliations"},
-
-        # Ensure values in the list of distinct values (so not empty)
-        {"$match": {key_ac: {"$in": db.laureates.distinct(key_ac)}}},
-        {"$project": {"affilCountrySameAsBorn": {
-            "$gte": [{"$indexOfBytes": ["$" + key_ac, "$" + key_bc]}, 0]}}},
-
-        # Count by "$affilCountrySameAsBorn" value (True or False)
-        {"$group": {"_id": "$affilCountrySameAsBorn",
-                    "count": {"$sum": 1}}},
-    ]
-    for doc in db.laureates.aggregate(pipeline): print(doc)
+    for doc in compiled("aggregation_pipeline4").aggregate(db): print(doc)
 
 
 def aggregation_pipeline5(mongo_client):
@@ -131,28 +81,7 @@ def aggregation_pipeline5(mongo_client):
     """
     db = mongo_client["nobel"]
 
-    pipeline = [
-        # Unwind the laureates array
-        {"$unwind": "$laureates"},
-        {"$lookup": {
-            "from": "laureates", "foreignField": "id",
-            "localField": "laureates.id", "as": "laureate_bios"}},
-
-        # Unwind the new laureate_bios array
-        {"$unwind": "$laureate_bios"},
-        {"$project": {"category": 1,
-                      "bornCountry": "$laureate_bios.bornCountry"}},
-
-        # Collect bornCountry values associated with each prize category
-        {"$group": {"_id": "$category",
-                    "bornCountries": {"$addToSet": "$bornCountry"}}},
-
-        # Project out the size of each category's (set of) bornCountries
-        {"$project": {"category": 1,
-                      "nBornCountries": {"$size": "$bornCountries"}}},
-        {"$sort": {"nBornCountries": -1}},
-    ]
-    for doc in db.prizes.aggregate(pipeline): print(doc)
+    for doc in compiled("aggregation_pipeline5").aggregate(db): print(doc)
 
 
 def aggregation_pipeline6(mongo_client):
@@ -162,19 +91,7 @@ def aggregation_pipeline6(mongo_client):
     """
     db = mongo_client["nobel"]
 
-    pipeline = [
-        # Limit results to people; project needed fields; unwind prizes
-        {"$match": {"gender": {"$ne": "org"}}},
-        {"$project": {"bornCountry": 1, "prizes.affiliations.country": 1}},
-        {"$unwind": "$prizes"},
-
-        # Count prizes with no country-of-birth affiliation
-        {"$addFields": {"bornCountryInAffiliations": {"$in": ["$bornCountry", "$prizes.affiliations.country"]}}},
-        {"$match": {"bornCountryInAffiliations": False}},
-        {"$count": "awardedElsewhere"},
-    ]
-
-    print(list(db.laureates.aggregate(pipeline)))
+    print(list(compiled("aggregation_pipeline6").aggregate(db)))
 
 
 def aggregation_pipeline7(mongo_client):
@@ -184,22 +101,7 @@ def aggregation_pipeline7(mongo_client):
     """
     db = mongo_client["nobel"]
 
-    pipeline = [
-        {"$match": {"gender": {"$ne": "org"}}},
-        {"$project": {"bornCountry": 1, "prizes.affiliations.country": 1}},
-        {"$unwind": "$prizes"},
-        {"$addFields": {"bornCountryInAffiliations": {"$in": ["$bornCountry", "$prizes.affiliations.country"]}}},
-        {"$match": {"bornCountryInAffiliations": False}},
-        {"$count": "awardedElsewhere"},
-    ]
-
-    # Construct the additional filter stage
-    added_stage = {
-        "$match": {"prizes.affiliations.country": {"$in": db.laureates.distinct("prizes.affiliations.country")}}}
-
-    # Insert this stage into the pipeline
-    pipeline.insert(3, added_stage)
-    print(list(db.laureates.aggregate(pipeline)))
+    print(list(compiled("aggregation_pipeline7").aggregate(db)))
 
 """
 Field paths in operator expressions are prepended by "$" to distinguish them from literal 
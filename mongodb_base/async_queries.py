@@ -0,0 +1,151 @@
+"""
+Asyncio counterparts of the query_db functions that issue several independent
+queries. The queries of a report are gathered concurrently under a bounded
+semaphore, so its latency approaches that of the slowest query rather than the
+sum of all of them.
+
+Uses PyMongo's AsyncMongoClient (PyMongo 4.9+), or Motor with older PyMongo.
+"""
+import asyncio
+
+from mongodb_base import config
+from mongodb_base.client import client_options
+
+try:
+    from pymongo import AsyncMongoClient
+except ImportError:
+    from motor.motor_asyncio import AsyncIOMotorClient as AsyncMongoClient
+
+# Maximum number of queries of one report in flight at once
+DEFAULT_CONCURRENCY = 8
+
+
+def get_async_client():
+    """
+    New asynchronous client configured like client.get_client(). Async clients are
+    bound to the event loop they are first used in, so create one per loop.
+    """
+    return AsyncMongoClient(config.connection_string, **client_options())
+
+
+async def gather_bounded(awaitables, limit=DEFAULT_CONCURRENCY):
+    """
+    Await all `awaitables` concurrently, at most `limit` at a time, and return their
+    results in order.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(awaitable):
+        async with semaphore:
+            return await awaitable
+
+    return await asyncio.gather(*(bounded(awaitable) for awaitable in awaitables))
+
+
+async def count_all(collection, criteria_list, limit=DEFAULT_CONCURRENCY):
+    return await gather_bounded([collection.count_documents(criteria) for criteria in criteria_list], limit)
+
+
+async def filter_non_operator_async(mongo_client, limit=DEFAULT_CONCURRENCY):
+    db = mongo_client["nobel"]
+
+    counts = await count_all(db.laureates, [
+        # Laureates who died in the USA
+        {"diedCountry": "USA"},
+        # ... but were born in Germany
+        {"diedCountry": "USA", "bornCountry": "Germany"},
+        # ... and with the first name "Albert"
+        {"bornCountry": "Germany", "diedCountry": "USA", "firstname": "Albert"},
+    ], limit)
+    for count in counts:
+        print(count)
+    return counts
+
+
+async def filter_operators_async(mongo_client, limit=DEFAULT_CONCURRENCY):
+    db = mongo_client["nobel"]
+
+    results = await gather_bounded([
+        # One laureate with at least three prizes
+        db.laureates.find_one({"prizes.2": {"$exists": True}}),
+        # Documents without a "born" field
+        db.laureates.count_documents({"born": {"$exists": False}}),
+        # Laureates born in Austria with non-Austria prize affiliation
+        db.laureates.count_documents({"bornCountry": "Austria",
+                                      "prizes.affiliations.country": {"$ne": "Austria"}}),
+        # Laureates who died in the USA and were not born there
+        db.laureates.count_documents({"diedCountry": "USA", "bornCountry": {"$ne": "USA"}}),
+        # Laureates born in the USA, Canada, or Mexico
+        db.laureates.count_documents({"bornCountry": {"$in": ["USA", "Canada", "Mexico"]}}),
+        # Laureates with recorded dates of birth earlier than the year 1900
+        db.laureates.count_documents({"born": {"$lt": "1900"}}),
+    ], limit)
+    for result in results:
+        print(result)
+    return results
+
+
+async def distinct_assertion_async(mongo_client, limit=DEFAULT_CONCURRENCY):
+    db = mongo_client["nobel"]
+
+    prize_categories, laureate_categories = await gather_bounded([
+        db.prizes.distinct("category"),
+        db.laureates.distinct("prizes.category"),
+    ], limit)
+    print(prize_categories)
+    print(laureate_categories)
+    assert set(prize_categories) == set(laureate_categories)
+
+
+async def distinct_set_operation_async(mongo_client, limit=DEFAULT_CONCURRENCY):
+    db = mongo_client["nobel"]
+
+    died, born = await gather_bounded([
+        db.laureates.distinct("diedCountry"),
+        db.laureates.distinct("bornCountry"),
+    ], limit)
+    # Countries recorded as countries of death but not as countries of birth
+    countries = set(died) - set(born)
+    print(countries)
+    return countries
+
+
+async def element_match_ratio_async(mongo_client, limit=DEFAULT_CONCURRENCY):
+    db = mongo_client["nobel"]
+
+    def prizes_after_1945(share):
+        return {"prizes": {"$elemMatch": {
+            "category": {"$nin": ["physics", "chemistry", "medicine"]},
+            "share": share,
+            "year": {"$gte": "1945"},
+        }}}
+
+    n_unshared, n_shared = await count_all(
+        db.laureates, [prizes_after_1945("1"), prizes_after_1945({"$ne": "1"})], limit)
+    ratio = n_unshared / n_shared
+    print(ratio)
+    return ratio
+
+
+async def comparision_operator_async(mongo_client, limit=DEFAULT_CONCURRENCY):
+    db = mongo_client["nobel"]
+
+    # Organization laureates with prizes won before / in or after 1945
+    n_before, n_in_or_after = await count_all(db.laureates, [
+        {"gender": "org", "prizes.year": {"$lt": "1945"}},
+        {"gender": "org", "prizes.year": {"$gte": "1945"}},
+    ], limit)
+    ratio = n_in_or_after / (n_in_or_after + n_before)
+    print(ratio)
+    return ratio
+
+
+# Async counterparts by the name of the query_db function they mirror
+ASYNC_COUNTERPARTS = {
+    "filter_non_operator": filter_non_operator_async,
+    "filter_operators": filter_operators_async,
+    "distinct_assertion": distinct_assertion_async,
+    "distinct_set_operation": distinct_set_operation_async,
+    "element_match_ratio": element_match_ratio_async,
+    "comparision_operator": comparision_operator_async,
+}
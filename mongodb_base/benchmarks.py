@@ -0,0 +1,483 @@
+"""
+Benchmarks comparing the optimised query paths against the original ones.
+
+Benchmarks that load synthetic data run against the scratch database
+config.bench_db_name through a synthetic.ScratchClient; the nobel database is
+never written to.
+"""
+import asyncio
+import contextlib
+import inspect
+import io
+import json
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+import bson
+from bson.raw_bson import DEFAULT_RAW_BSON_OPTIONS
+from pymongo import MongoClient, monitoring
+
+from mongodb_base import agg_pipelines, async_queries, config, indexing, joins, model, query_db
+from mongodb_base.client import client_options
+from mongodb_base.columnar import ColumnarEngine, LocalClient
+from mongodb_base.indexing import born_affiliated_counts
+from mongodb_base.lazy import LazyDocument, lazy_collection
+from mongodb_base.pipelines import compiled
+from mongodb_base.synthetic import ScratchClient, load_synthetic
+
+# Modules whose mongo_client functions make up the benchmark suite
+BENCHMARKED_MODULES = [query_db, agg_pipelines, indexing]
+
+
+def timed(func, *args, repeat=5, **kwargs):
+    """
+    Call func `repeat` times and return (last result, best wall time in seconds).
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def born_affiliated_loop(db, top_n=5):
+    # Original implementation: one distinct plus one count_documents per country
+    countries = db.laureates.distinct("bornCountry")
+    n_born_and_affiliated = {
+        country: db.laureates.count_documents({
+            "bornCountry": country,
+            "prizes.affiliations.country": country
+        })
+        for country in countries
+    }
+    return Counter(n_born_and_affiliated).most_common(top_n), 1 + len(countries)
+
+
+def compare_born_affiliated(mongo_client, repeat=5):
+    """
+    Compare round trips and best wall time of the per-country count loop against the
+    single grouped-count aggregation.
+    """
+    db = mongo_client["nobel"]
+
+    (loop_result, loop_round_trips), loop_time = timed(born_affiliated_loop, db, repeat=repeat)
+    grouped_result, grouped_time = timed(born_affiliated_counts, db, top_n=5, repeat=repeat)
+
+    report = {
+        "loop": {"round_trips": loop_round_trips, "seconds": loop_time, "result": loop_result},
+        "grouped": {"round_trips": 1, "seconds": grouped_time, "result": grouped_result},
+        "speedup": loop_time / grouped_time if grouped_time else None,
+    }
+    print("loop: {round_trips} round trips, {seconds:.4f}s".format(**report["loop"]))
+    print("grouped: {round_trips} round trip, {seconds:.4f}s".format(**report["grouped"]))
+    return report
+
+
+class ReplyRecorder(monitoring.CommandListener):
+    """
+    Count commands and the bytes of their replies.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.commands = 0
+        self.reply_bytes = 0
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        size = len(bson.encode(event.reply))
+        with self._lock:
+            self.commands += 1
+            self.reply_bytes += size
+
+    def failed(self, event):
+        with self._lock:
+            self.commands += 1
+
+    def snapshot(self):
+        with self._lock:
+            return self.commands, self.reply_bytes
+
+
+def suite_functions(modules=None):
+    """
+    Return (qualified name, function) for every function taking a mongo_client as its
+    first argument in the benchmarked modules.
+    """
+    functions = []
+    for module in modules or BENCHMARKED_MODULES:
+        for name, func in inspect.getmembers(module, inspect.isfunction):
+            if func.__module__ != module.__name__:
+                continue
+            parameters = list(inspect.signature(func).parameters)
+            if parameters[:1] == ["mongo_client"]:
+                functions.append(("{}.{}".format(module.__name__.split(".")[-1], name), func))
+    return functions
+
+
+def percentile(values, q):
+    # Nearest-rank percentile of a non-empty list
+    ordered = sorted(values)
+    rank = max(1, int(round(q / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def documents_examined(mongo_client):
+    """
+    Server-wide count of documents scanned by queries, or None if unavailable
+    (e.g. for an in-process stand-in).
+    """
+    try:
+        status = mongo_client.admin.command("serverStatus")
+        return status["metrics"]["queryExecutor"]["scannedObjects"]
+    except Exception:
+        return None
+
+
+@contextlib.contextmanager
+def benchmark_client(stand_in=False):
+    """
+    Client for a benchmark run, closed on exit: a local mongod reached through the
+    configured connection string (recording reply sizes), or an in-process mongomock
+    stand-in. Yields (client, reply recorder or None).
+    """
+    if stand_in:
+        import mongomock
+        mongo_client, recorder = mongomock.MongoClient(), None
+    else:
+        recorder = ReplyRecorder()
+        options = client_options()
+        options["event_listeners"] = options["event_listeners"] + [recorder]
+        mongo_client = MongoClient(config.connection_string, **options)
+    try:
+        yield mongo_client, recorder
+    finally:
+        mongo_client.close()
+
+
+def run_benchmarks(scale=1, repeat=5, stand_in=False, seed=0, load=True, functions=None):
+    """
+    Load synthetic data at `scale` and time every suite function `repeat` times.
+
+    Returns a dictionary, per function, of latency percentiles (seconds), documents
+    examined and bytes returned per call, or the error it raised.
+    """
+    with benchmark_client(stand_in) as (mongo_client, recorder):
+        mongo_client = ScratchClient(mongo_client)
+        if load:
+            load_synthetic(mongo_client, scale=scale, seed=seed)
+
+        results = {}
+        for name, func in functions or suite_functions():
+            latencies = []
+            examined_before = documents_examined(mongo_client)
+            commands_before = recorder.snapshot() if recorder else None
+            try:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        func(mongo_client)
+                    latencies.append(time.perf_counter() - start)
+            except Exception as error:
+                results[name] = {"error": repr(error)}
+                continue
+
+            examined_after = documents_examined(mongo_client)
+            result = {
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "mean": sum(latencies) / len(latencies),
+                "docs_examined": None,
+                "bytes_returned": None,
+            }
+            if examined_before is not None and examined_after is not None:
+                result["docs_examined"] = (examined_after - examined_before) / repeat
+            if recorder:
+                result["bytes_returned"] = (recorder.snapshot()[1] - commands_before[1]) / repeat
+            results[name] = result
+
+        return {"scale": scale, "repeat": repeat, "stand_in": stand_in, "results": results}
+
+
+def save_baseline(run, path):
+    with open(path, "w") as fp:
+        json.dump(run, fp, indent=2, sort_keys=True)
+
+
+def compare_to_baseline(run, path, tolerance=0.2):
+    """
+    Compare a run against the baseline stored at `path` and return the regressions:
+    functions whose p50 latency or documents examined grew by more than `tolerance`
+    (a fraction), or that now fail.
+    """
+    with open(path) as fp:
+        baseline = json.load(fp)["results"]
+
+    regressions = {}
+    for name, result in run["results"].items():
+        before = baseline.get(name)
+        if before is None or "error" in before:
+            continue
+        if "error" in result:
+            regressions[name] = {"error": result["error"]}
+            continue
+        for metric in ("p50", "docs_examined"):
+            old, new = before.get(metric), result.get(metric)
+            if old and new is not None and new > old * (1 + tolerance):
+                regressions.setdefault(name, {})[metric] = {"baseline": old, "current": new,
+                                                            "change": new / old - 1}
+    for name, regression in sorted(regressions.items()):
+        print("REGRESSION {}: {}".format(name, regression))
+    return regressions
+
+
+def compare_sequential_concurrent(mongo_client, repeat=5, limit=async_queries.DEFAULT_CONCURRENCY):
+    """
+    Compare each query_db report run sequentially with the synchronous client against
+    its async counterpart with the queries gathered concurrently.
+    """
+    async def run_async(func):
+        async_client = async_queries.get_async_client()
+        try:
+            latencies = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    await func(async_client, limit=limit)
+                latencies.append(time.perf_counter() - start)
+            return min(latencies)
+        finally:
+            closing = async_client.close()
+            if asyncio.iscoroutine(closing):
+                await closing
+
+    report = {}
+    for name, async_func in async_queries.ASYNC_COUNTERPARTS.items():
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, sequential = timed(getattr(query_db, name), mongo_client, repeat=repeat)
+        concurrent = asyncio.run(run_async(async_func))
+        report[name] = {"sequential": sequential, "concurrent": concurrent,
+                        "speedup": sequential / concurrent if concurrent else None}
+        print("{}: sequential {:.4f}s, concurrent {:.4f}s".format(name, sequential, concurrent))
+    return report
+
+
+def _run_quietly(func, mongo_client, repeat):
+    # Best wall time over `repeat` calls and the printed output of the last call
+    best, output = float("inf"), None
+    for _ in range(repeat):
+        buffer = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(buffer):
+            result = func(mongo_client)
+        best = min(best, time.perf_counter() - start)
+        output = buffer.getvalue() + repr(result)
+    return best, output
+
+
+def compare_local_engine(mongo_client, scale=100, repeat=3, load=True, seed=0, functions=None):
+    """
+    Time every suite function against MongoDB and against the in-process columnar
+    engine (loaded once from the same data), and check both print the same output.
+    Functions using stages the engine does not support are reported with their error.
+    """
+    mongo_client = ScratchClient(mongo_client)
+    if load:
+        load_synthetic(mongo_client, scale=scale, seed=seed)
+    start = time.perf_counter()
+    local_client = LocalClient(ColumnarEngine.load(mongo_client))
+    print("columnar load: {:.2f}s".format(time.perf_counter() - start))
+
+    report = {}
+    for name, func in functions or suite_functions():
+        try:
+            mongo_time, mongo_output = _run_quietly(func, mongo_client, repeat)
+            local_time, local_output = _run_quietly(func, local_client, repeat)
+        except Exception as error:
+            report[name] = {"error": repr(error)}
+            print("{}: {!r}".format(name, error))
+            continue
+        report[name] = {"mongodb": mongo_time, "local": local_time,
+                        "speedup": mongo_time / local_time if local_time else None,
+                        "same_output": mongo_output == local_output}
+        print("{}: mongodb {:.4f}s, local {:.4f}s, same output: {}".format(
+            name, mongo_time, local_time, report[name]["same_output"]))
+    return report
+
+
+def compare_join_strategies(mongo_client, scales=(1, 4, 16), repeat=3, seed=0):
+    """
+    Time the prizes -> laureates join of aggregation_pipeline5 at several synthetic
+    scales: the original $lookup without an index, the indexed projecting $lookup, and
+    the client-side hash join with a cold and a warm bio cache.
+    """
+    mongo_client = ScratchClient(mongo_client)
+    db = mongo_client["nobel"]
+
+    report = {}
+    for scale in scales:
+        # Freshly loaded, so the original $lookup runs without an index on laureates.id
+        load_synthetic(mongo_client, scale=scale, seed=seed)
+        indexes_before = set(db.laureates.index_information())
+        original, original_time = timed(
+            lambda: list(compiled("aggregation_pipeline5").aggregate(db)), repeat=repeat)
+
+        cache = joins.BioCache()
+        cold, cold_time = timed(lambda: (cache.clear(), joins.born_countries(mongo_client, "hash", cache))[1],
+                                repeat=repeat)
+        warm, warm_time = timed(joins.born_countries, mongo_client, "hash", cache, repeat=repeat)
+        lookup, lookup_time = timed(joins.born_countries, mongo_client, "lookup", repeat=repeat)
+        for name in set(db.laureates.index_information()) - indexes_before:
+            # Only the index the lookup strategy built
+            db.laureates.drop_index(name)
+
+        def counts(docs):
+            return sorted((doc["_id"], doc["nBornCountries"]) for doc in docs)
+
+        report[scale] = {
+            "laureates": db.laureates.estimated_document_count(),
+            "original": original_time, "lookup": lookup_time,
+            "hash_cold": cold_time, "hash_warm": warm_time,
+            "chosen": joins.choose_strategy(db),
+            "same_result": counts(original) == counts(lookup) == counts(cold) == counts(warm),
+        }
+        print("scale {}: {laureates} laureates, original {original:.4f}s, lookup {lookup:.4f}s, "
+              "hash cold {hash_cold:.4f}s, hash warm {hash_warm:.4f}s, chosen {chosen}, "
+              "same result: {same_result}".format(scale, **report[scale]))
+    return report
+
+
+def _prize_surnames(docs):
+    # What all_laureates_sorted reads: the year and the laureates' surnames
+    return [(doc["year"], query_db.all_laureates(doc)) for doc in docs if "laureates" in doc]
+
+
+def _laureate_names(docs):
+    # Two top-level fields of each (wide) laureate document
+    return [(doc.get("firstname"), doc.get("surname")) for doc in docs]
+
+
+# name -> (collection, filter, fields read from each document)
+DECODE_WORKLOADS = {
+    "physics_prize_surnames": ("prizes", {"category": "physics"}, _prize_surnames),
+    "laureate_names": ("laureates", {}, _laureate_names),
+}
+
+
+def _decode_cost(raws, decode, read, repeat):
+    # Best CPU seconds and peak traced bytes to decode `raws` and read their fields
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.process_time()
+        read([decode(raw) for raw in raws])
+        best = min(best, time.process_time() - start)
+    tracemalloc.start()
+    docs = [decode(raw) for raw in raws]
+    read(docs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def compare_decode_modes(mongo_client, scale=16, repeat=3, seed=0, load=True):
+    """
+    Decode CPU and memory per document, regular dicts against lazy records, for
+    each of DECODE_WORKLOADS. The raw BSON is fetched once, so decoding is measured
+    without the server; end-to-end cursor times are reported alongside.
+    """
+    mongo_client = ScratchClient(mongo_client)
+    db = mongo_client["nobel"]
+    if load:
+        load_synthetic(mongo_client, scale=scale, seed=seed)
+
+    report = {}
+    for name, (collection_name, criteria, read) in DECODE_WORKLOADS.items():
+        raw_collection = db.get_collection(collection_name, codec_options=DEFAULT_RAW_BSON_OPTIONS)
+        raws = [bytes(doc.raw) for doc in raw_collection.find(criteria)]
+        n_docs = len(raws) or 1
+
+        dict_cpu, dict_peak = _decode_cost(raws, bson.decode, read, repeat)
+        lazy_cpu, lazy_peak = _decode_cost(raws, LazyDocument, read, repeat)
+        dict_result, dict_time = timed(lambda: read(db[collection_name].find(criteria)), repeat=repeat)
+        lazy_result, lazy_time = timed(lambda: read(lazy_collection(db, collection_name).find(criteria)),
+                                       repeat=repeat)
+
+        report[name] = {
+            "documents": len(raws),
+            "bson_bytes_per_doc": sum(len(raw) for raw in raws) / n_docs,
+            "dict_cpu_us_per_doc": 1e6 * dict_cpu / n_docs,
+            "lazy_cpu_us_per_doc": 1e6 * lazy_cpu / n_docs,
+            "dict_bytes_per_doc": dict_peak / n_docs,
+            "lazy_bytes_per_doc": lazy_peak / n_docs,
+            "dict_cursor": dict_time,
+            "lazy_cursor": lazy_time,
+            "same_result": dict_result == lazy_result,
+        }
+        print("{}: {documents} documents ({bson_bytes_per_doc:.0f} BSON bytes each), decode "
+              "dict {dict_cpu_us_per_doc:.1f}us/{dict_bytes_per_doc:.0f}B, "
+              "lazy {lazy_cpu_us_per_doc:.1f}us/{lazy_bytes_per_doc:.0f}B per document; "
+              "cursor dict {dict_cursor:.4f}s, lazy {lazy_cursor:.4f}s, "
+              "same result: {same_result}".format(name, **report[name]))
+    return report
+
+
+def _printed(func, *args):
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        func(*args)
+    return buffer.getvalue()
+
+
+def _retained_bytes(build):
+    # Bytes still allocated once build() has returned, held through its result
+    tracemalloc.start()
+    result = build()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, retained
+
+
+def compare_model_memory(mongo_client, scale=16, seed=0, load=True):
+    """
+    Memory retained per document by the prizes and laureates held as decoded
+    dicts, as model records and in a model RecordTable, and whether
+    all_laureates_sorted prints the same on all three.
+    """
+    mongo_client = ScratchClient(mongo_client)
+    db = mongo_client["nobel"]
+    if load:
+        load_synthetic(mongo_client, scale=scale, seed=seed)
+
+    report = {}
+    for collection_name, record_class in (("prizes", model.Prize), ("laureates", model.Laureate)):
+        raw_collection = db.get_collection(collection_name, codec_options=DEFAULT_RAW_BSON_OPTIONS)
+        raws = [bytes(doc.raw) for doc in raw_collection.find({}, model.projection(record_class))]
+        n_docs = len(raws) or 1
+
+        dicts, dict_bytes = _retained_bytes(lambda: [bson.decode(raw) for raw in raws])
+        records, record_bytes = _retained_bytes(
+            lambda: [record_class.from_document(bson.decode(raw)) for raw in raws])
+        table, table_bytes = _retained_bytes(
+            lambda: model.RecordTable(record_class).extend(bson.decode(raw) for raw in raws))
+
+        report[collection_name] = {
+            "documents": len(raws),
+            "dict_bytes_per_doc": dict_bytes / n_docs,
+            "record_bytes_per_doc": record_bytes / n_docs,
+            "table_bytes_per_doc": table_bytes / n_docs,
+        }
+        if collection_name == "prizes":
+            printed = [_printed(query_db.all_laureates_sorted,
+                                [doc for doc in docs if doc["category"] == "physics"])
+                       for docs in (dicts, records, table)]
+            report[collection_name]["same_result"] = printed[0] == printed[1] == printed[2]
+        print("{}: {documents} documents, dicts {dict_bytes_per_doc:.0f}B, records {record_bytes_per_doc:.0f}B, "
+              "table {table_bytes_per_doc:.0f}B per document".format(collection_name, **report[collection_name]))
+    return report
@@ -0,0 +1,276 @@
+"""
+Result cache for count_documents, distinct, find_one and aggregate calls.
+
+Entries are keyed by a hash of the canonicalised call (collection, operation,
+filter, projection, pipeline, ...) together with the data version of the
+collection and of every collection an aggregation reads through $lookup,
+$unionWith or $graphLookup, so a reload through create_db_collections
+invalidates them. Aggregations ending in $out or $merge write, and are never
+cached. Data versions themselves are always read from the server. The in-memory
+tier is an LRU bounded by size and TTL; an optional shelve file, bounded the same
+way, keeps results across process restarts.
+
+Existing query functions can use the cache unchanged by passing them a
+CachedClient instead of a MongoClient:
+
+    filter_non_operator(CachedClient(client, ResultCache(path="results.cache")))
+"""
+import copy
+import hashlib
+import shelve
+import threading
+import time
+from collections import OrderedDict
+
+from bson import json_util
+
+from mongodb_base.versioning import VERSIONS_COLLECTION, data_version
+
+# Keys whose values are order-sensitive documents (sort specifications)
+_ORDERED_KEYS = {"$sort", "sort"}
+
+
+def canonicalise(value, ordered=False):
+    """
+    Return a JSON-friendly form of `value` in which equivalent filters, projections
+    and pipelines compare equal: dictionary keys are sorted except inside sort
+    specifications, where field order is meaningful.
+    """
+    if isinstance(value, dict):
+        items = [(key, canonicalise(item, key in _ORDERED_KEYS)) for key, item in value.items()]
+        return items if ordered else sorted(items, key=lambda pair: pair[0])
+    if isinstance(value, (list, tuple)):
+        return [canonicalise(item, ordered) for item in value]
+    return value
+
+
+def pipeline_sources(pipeline):
+    """
+    Names of the other collections a pipeline reads, sub-pipelines included.
+    """
+    sources = set()
+    for stage in pipeline:
+        for operator, spec in stage.items():
+            if operator in ("$lookup", "$graphLookup"):
+                if "from" in spec:
+                    sources.add(spec["from"])
+                sources |= pipeline_sources(spec.get("pipeline", []))
+            elif operator == "$unionWith":
+                if isinstance(spec, str):
+                    sources.add(spec)
+                else:
+                    sources.add(spec["coll"])
+                    sources |= pipeline_sources(spec.get("pipeline", []))
+            elif operator == "$facet":
+                for sub_pipeline in spec.values():
+                    sources |= pipeline_sources(sub_pipeline)
+    return sources
+
+
+def writes_output(pipeline):
+    return bool(pipeline) and any(operator in ("$out", "$merge") for operator in pipeline[-1])
+
+
+def cache_key(*parts):
+    text = json_util.dumps(canonicalise(list(parts)))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    LRU + TTL cache of query results with hit/miss counters.
+
+    `version_check_interval` bounds how often (in seconds) the data version of a
+    collection is re-read from the server. The disk tier holds at most
+    `disk_maxsize` entries (by default `maxsize`).
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, path=None, version_check_interval=1.0, disk_maxsize=None):
+        self.maxsize = maxsize
+        self.disk_maxsize = disk_maxsize or maxsize
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.RLock()
+        self._disk = shelve.open(path) if path else None
+        # Disk keys, least recently used first, ordered by expiry when the file is opened
+        self._disk_order = OrderedDict()
+        if self._disk is not None:
+            expiries = {key: self._disk[key][0] for key in self._disk}
+            for key in sorted(expiries, key=expiries.get):
+                self._disk_order[key] = expiries[key]
+            self._trim_disk()
+
+    def get(self, key):
+        """
+        Return (True, value) for a live entry and (False, None) otherwise.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+
+            if self._disk is not None and key in self._disk_order:
+                entry = self._disk[key]
+                if entry[0] > now:
+                    self._disk_order.move_to_end(key)
+                    self._remember(key, entry)
+                    self.disk_hits += 1
+                    return True, entry[1]
+                del self._disk[key]
+                del self._disk_order[key]
+
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        entry = (time.time() + self.ttl, value)
+        with self._lock:
+            self._remember(key, entry)
+            if self._disk is not None:
+                self._disk[key] = entry
+                self._disk_order[key] = entry[0]
+                self._disk_order.move_to_end(key)
+                self._trim_disk()
+
+    def _trim_disk(self):
+        while len(self._disk_order) > self.disk_maxsize:
+            key, _ = self._disk_order.popitem(last=False)
+            del self._disk[key]
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def version(self, collection):
+        """
+        Data version of a collection, re-read at most every version_check_interval.
+        """
+        name = collection.full_name
+        now = time.monotonic()
+        with self._lock:
+            cached = self._versions.get(name)
+            if cached is not None and now - cached[0] < self.version_check_interval:
+                return cached[1]
+        version = data_version(collection.database, collection.name)
+        with self._lock:
+            self._versions[name] = (now, version)
+        return version
+
+    def invalidate(self, collection=None):
+        """
+        Drop every in-memory entry and forget known versions (of one collection, or all).
+        Entries of older versions on disk are never served again and can be left alone.
+        """
+        with self._lock:
+            self._entries.clear()
+            if collection is None:
+                self._versions.clear()
+            else:
+                self._versions.pop(collection.full_name, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "size": len(self._entries),
+            }
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+            self._disk_order.clear()
+
+
+class CachedCollection:
+    """
+    Collection wrapper answering read calls from a ResultCache. Any other attribute
+    is taken from the wrapped pymongo Collection.
+    """
+
+    def __init__(self, collection, cache):
+        self._collection = collection
+        self._cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def _cached(self, operation, compute, *args, sources=()):
+        # Versions of the collection and of the other collections read (`sources`)
+        versions = [self._cache.version(self._collection)]
+        versions += [self._cache.version(self._collection.database[name]) for name in sorted(sources)]
+        key = cache_key(self._collection.full_name, versions, operation, *args)
+        found, value = self._cache.get(key)
+        if not found:
+            value = compute()
+            self._cache.put(key, value)
+        # Callers may mutate what they get back
+        return copy.deepcopy(value)
+
+    def count_documents(self, filter, **kwargs):
+        return self._cached("count_documents", lambda: self._collection.count_documents(filter, **kwargs),
+                            filter, kwargs)
+
+    def distinct(self, key, filter=None, **kwargs):
+        return self._cached("distinct", lambda: self._collection.distinct(key, filter, **kwargs),
+                            key, filter, kwargs)
+
+    def find_one(self, filter=None, *args, **kwargs):
+        return self._cached("find_one", lambda: self._collection.find_one(filter, *args, **kwargs),
+                            filter, args, kwargs)
+
+    def aggregate(self, pipeline, **kwargs):
+        if writes_output(pipeline):
+            return self._collection.aggregate(pipeline, **kwargs)
+        # Materialised when cached; an iterator over the documents stands in for the cursor
+        return iter(self._cached("aggregate", lambda: list(self._collection.aggregate(pipeline, **kwargs)),
+                                 pipeline, kwargs, sources=pipeline_sources(pipeline)))
+
+
+class CachedDatabase:
+    def __init__(self, database, cache):
+        self._database = database
+        self._cache = cache
+
+    def __getitem__(self, name):
+        # The data versions invalidate the cache, so they are never answered from it
+        if name == VERSIONS_COLLECTION:
+            return self._database[name]
+        return CachedCollection(self._database[name], self._cache)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._database, name)
+        # Attribute access on a database returns a collection of that name
+        if hasattr(attribute, "count_documents") and name != VERSIONS_COLLECTION:
+            return CachedCollection(attribute, self._cache)
+        return attribute
+
+
+class CachedClient:
+    """
+    MongoClient stand-in whose databases answer reads through `cache`.
+    """
+
+    def __init__(self, mongo_client, cache=None):
+        self._client = mongo_client
+        self.cache = cache or ResultCache()
+
+    def __getitem__(self, name):
+        return CachedDatabase(self._client[name], self.cache)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
@@ -0,0 +1,124 @@
+"""
+Process-wide MongoClient factory built from mongodb_base.config.
+
+The client is created lazily on first use and shared by every caller, so
+concurrent jobs draw on one connection pool instead of opening their own.
+"""
+import threading
+import time
+from collections import defaultdict
+
+from pymongo import MongoClient, monitoring
+
+from mongodb_base import config
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class PoolWaitListener(monitoring.ConnectionPoolListener):
+    """
+    Record how long each connection checkout waited for the pool, per server.
+    """
+
+    def __init__(self):
+        self._started = threading.local()
+        self._lock = threading.Lock()
+        self.waits = defaultdict(list)
+        self.failures = defaultdict(int)
+
+    def connection_check_out_started(self, event):
+        # Check-out events are published on the thread doing the check-out
+        self._started.time = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        wait = time.perf_counter() - getattr(self._started, "time", time.perf_counter())
+        with self._lock:
+            self.waits[event.address].append(wait)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.failures[event.address] += 1
+
+    def summary(self):
+        """
+        Return checkout count, total/max wait in milliseconds and failures per server.
+        """
+        with self._lock:
+            return {
+                "{}:{}".format(*address): {
+                    "checkouts": len(waits),
+                    "total_wait_ms": 1000 * sum(waits),
+                    "max_wait_ms": 1000 * max(waits),
+                    "failures": self.failures[address],
+                }
+                for address, waits in self.waits.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self.waits.clear()
+            self.failures.clear()
+
+    # The remaining pool events are not needed for wait accounting
+    def pool_created(self, event): pass
+
+    def pool_ready(self, event): pass
+
+    def pool_cleared(self, event): pass
+
+    def pool_closed(self, event): pass
+
+    def connection_created(self, event): pass
+
+    def connection_ready(self, event): pass
+
+    def connection_closed(self, event): pass
+
+    def connection_checked_in(self, event): pass
+
+
+pool_waits = PoolWaitListener()
+
+
+def client_options(**overrides):
+    """
+    Keyword arguments for MongoClient taken from the config module.
+    """
+    options = dict(
+        maxPoolSize=config.max_pool_size,
+        minPoolSize=config.min_pool_size,
+        waitQueueTimeoutMS=config.wait_queue_timeout_ms,
+        serverSelectionTimeoutMS=config.server_selection_timeout_ms,
+        compressors=config.compressors,
+        zlibCompressionLevel=config.zlib_compression_level,
+        event_listeners=[pool_waits],
+    )
+    options.update(overrides)
+    return options
+
+
+def get_client():
+    """
+    Return the shared client, creating it on first call.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(config.connection_string, **client_options())
+    return _client
+
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def find(collection, *args, **kwargs):
+    # Cursor with the configured default batch size unless one is given
+    kwargs.setdefault("batch_size", config.batch_size)
+    return collection.find(*args, **kwargs)
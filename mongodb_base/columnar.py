@@ -0,0 +1,1094 @@
+"""
+In-process, NumPy-backed query engine over a columnar copy of the collections.
+
+Each collection is loaded once into dictionary-encoded columns: every scalar is
+replaced by an integer code into a per-collection dictionary whose strings are
+sorted, so equality, $in and string range filters become integer comparisons.
+Nested arrays ("prizes", "prizes.affiliations", "laureates") are flattened into
+levels; each element of a level records the index of its parent element, and
+children are found through CSR-style offset arrays.
+
+Filters are evaluated element-wise on the level a field lives on and reduced to
+the documents (or unwound rows) with MongoDB's "any element matches" semantics.
+The supported aggregation stages are $match, $project, $addFields, $unwind,
+$group, $sort, $skip, $limit and $count; anything else raises NotImplementedError.
+
+LocalClient gives the engine the shape of a MongoClient so the existing query
+functions run on it unchanged:
+
+    engine = ColumnarEngine.load(client)
+    filter_operators(LocalClient(engine))
+"""
+import bisect
+import re
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+from bson import ObjectId, Regex
+
+ROOT = ""
+_MISSING = object()
+_RANGE_OPERATORS = ("$gt", "$gte", "$lt", "$lte")
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _value_key(value):
+    # Dictionary key under which MongoDB would consider two scalars equal
+    if isinstance(value, str):
+        return value
+    if _is_number(value):
+        return ("number", float(value))
+    return (type(value).__name__, value)
+
+
+def _sort_key(value):
+    """
+    Key ordering Python values like BSON types are ordered by MongoDB.
+    """
+    if value is None or value is _MISSING:
+        return (1, 0)
+    if _is_number(value):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    if isinstance(value, dict):
+        return (4, [(key, _sort_key(item)) for key, item in value.items()])
+    if isinstance(value, (list, tuple)):
+        return (5, [_sort_key(item) for item in value])
+    if isinstance(value, ObjectId):
+        return (7, value)
+    if isinstance(value, bool):
+        return (8, value)
+    if isinstance(value, datetime):
+        return (9, value)
+    return (10, str(value))
+
+
+def _hashable(value):
+    if isinstance(value, dict):
+        return ("dict", tuple((key, _hashable(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return ("list", tuple(_hashable(item) for item in value))
+    return _value_key(value)
+
+
+def _compile(pattern, options=""):
+    if isinstance(pattern, Regex):
+        return pattern.try_compile()
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    flags = 0
+    for option, flag in (("i", re.IGNORECASE), ("m", re.MULTILINE), ("s", re.DOTALL), ("x", re.VERBOSE)):
+        if option in (options or ""):
+            flags |= flag
+    return re.compile(pattern, flags)
+
+
+def _object_array(values):
+    array = np.empty(len(values), dtype=object)
+    for index, value in enumerate(values):
+        array[index] = value
+    return array
+
+
+class Level:
+    """
+    One array nesting level of a collection (the root level holds the documents).
+    """
+    __slots__ = ("path", "parent_path", "parent", "size", "present", "is_list", "offsets", "order")
+
+    def __init__(self, path, parent_path, parent, size, present=None, is_list=None):
+        self.path = path
+        self.parent_path = parent_path
+        self.parent = parent
+        self.size = size
+        # Parent elements holding the array field (even when empty)
+        self.present = present
+        # Elements that were themselves lists, like the [[]] of unaffiliated prizes
+        self.is_list = is_list
+        self.offsets = None
+        self.order = None
+
+    def index_children(self, n_parents):
+        # Elements grouped by parent: children of p are order[offsets[p]:offsets[p + 1]]
+        self.order = np.argsort(self.parent, kind="stable")
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(self.parent, minlength=n_parents))])
+
+    def children(self, parent_index):
+        return self.order[self.offsets[parent_index]:self.offsets[parent_index + 1]]
+
+
+class Column:
+    __slots__ = ("path", "level", "codes")
+
+    def __init__(self, path, level, codes):
+        self.path = path
+        self.level = level
+        self.codes = codes
+
+
+class Vec:
+    """
+    Row-aligned values: dictionary codes ("codes"), or plain arrays ("number",
+    "bool", "objects").
+    """
+    __slots__ = ("kind", "data")
+
+    def __init__(self, kind, data):
+        self.kind = kind
+        self.data = data
+
+
+class Frame:
+    """
+    Rows flowing through a pipeline: element indices at `level` (None once the rows
+    are computed documents, e.g. after $group), plus computed fields.
+    """
+
+    def __init__(self, level, rows, computed=None, visible=None):
+        self.level = level
+        self.rows = rows
+        self.computed = computed if computed is not None else OrderedDict()
+        self.visible = visible
+
+    def __len__(self):
+        return len(self.rows)
+
+    def take(self, selector):
+        computed = OrderedDict((name, Vec(vec.kind, vec.data[selector])) for name, vec in self.computed.items())
+        return Frame(self.level, self.rows[selector], computed, self.visible)
+
+
+class _Builder:
+    """
+    Two passes over the documents: find the paths holding arrays, then fill levels
+    and columns.
+    """
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.array_paths = set()
+        self.levels = {ROOT: {"parent_path": None, "parent": [], "present": [], "is_list": []}}
+        self.columns = {}
+        self.keys = {}
+        self.values = []
+        self.field_order = {}
+
+    def discover(self, value, prefix):
+        for key, item in value.items():
+            path = prefix + key
+            self.field_order.setdefault(path, len(self.field_order))
+            if isinstance(item, list):
+                self.array_paths.add(path)
+                for element in item:
+                    if isinstance(element, dict):
+                        self.discover(element, path + ".")
+            elif isinstance(item, dict):
+                self.discover(item, path + ".")
+
+    def code(self, value):
+        key = _value_key(value)
+        code = self.keys.get(key)
+        if code is None:
+            code = self.keys[key] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def set(self, path, level_path, element, value):
+        column = self.columns.get(path)
+        if column is None:
+            column = self.columns[path] = (level_path, [], [])
+        column[1].append(element)
+        column[2].append(self.code(value))
+
+    def add(self, value, prefix, level_path, element):
+        for key, item in value.items():
+            path = prefix + key
+            if path in self.array_paths:
+                level = self.levels.get(path)
+                if level is None:
+                    level = self.levels[path] = {"parent_path": level_path, "parent": [], "present": [],
+                                                 "is_list": []}
+                level["present"].append(element)
+                for child in (item if isinstance(item, list) else [item]):
+                    child_element = len(level["parent"])
+                    level["parent"].append(element)
+                    level["is_list"].append(isinstance(child, list))
+                    if isinstance(child, dict):
+                        self.add(child, path + ".", path, child_element)
+                    elif not isinstance(child, list):
+                        self.set(path, path, child_element, child)
+            elif isinstance(item, dict):
+                self.add(item, path + ".", level_path, element)
+            else:
+                self.set(path, level_path, element, item)
+
+    def build(self):
+        for document in self.documents:
+            self.discover(document, "")
+        for element, document in enumerate(self.documents):
+            self.add(document, "", ROOT, element)
+        return self
+
+
+class ColumnarCollection:
+    """
+    Columnar copy of one collection with count_documents, distinct, find and
+    aggregate evaluated by vectorised kernels.
+    """
+
+    def __init__(self, documents):
+        documents = list(documents)
+        built = _Builder(documents).build()
+
+        # Sorted strings first, so string order is code order; then every other value
+        strings = sorted(value for value in built.values if isinstance(value, str))
+        others = [value for value in built.values if not isinstance(value, str)]
+        self.n_strings = len(strings)
+        self.strings = strings
+        self.values = _object_array(strings + others)
+        self.code_of = {_value_key(value): code for code, value in enumerate(self.values)}
+        remap = np.array([self.code_of[_value_key(value)] for value in built.values], dtype=np.int64)
+        self.numbers = np.array([float(value) if _is_number(value) else np.nan for value in self.values])
+        self.null_code = self.code_of.get(_value_key(None), -2)
+
+        self.levels = {ROOT: Level(ROOT, None, None, len(documents))}
+        for path, level in built.levels.items():
+            if path == ROOT:
+                continue
+            parent_size = len(built.levels[level["parent_path"]]["parent"]) if level["parent_path"] else len(documents)
+            present = np.zeros(parent_size, dtype=bool)
+            present[np.array(level["present"], dtype=np.int64)] = True
+            self.levels[path] = Level(path, level["parent_path"], np.array(level["parent"], dtype=np.int64),
+                                      len(level["parent"]), present, np.array(level["is_list"], dtype=bool))
+        for level in self.levels.values():
+            if level.parent is not None:
+                level.index_children(self.levels[level.parent_path].size)
+
+        self.columns = OrderedDict()
+        for path, (level_path, elements, codes) in built.columns.items():
+            dense = np.full(self.levels[level_path].size, -1, dtype=np.int64)
+            dense[np.array(elements, dtype=np.int64)] = remap[np.array(codes, dtype=np.int64)]
+            self.columns[path] = Column(path, level_path, dense)
+
+        # Fields directly held by the elements of each level, in source document order,
+        # for rebuilding documents
+        self.level_fields = {}
+        for path in self.levels:
+            fields = [(column.path, column) for column in self.columns.values()
+                      if column.level == path and column.path != path]
+            fields += [(level.path, level) for level in self.levels.values() if level.parent_path == path]
+            fields.sort(key=lambda field: built.field_order[field[0]])
+            self.level_fields[path] = [(field_path[len(path) + 1 if path else 0:].split("."), field)
+                                       for field_path, field in fields]
+
+    # Level navigation
+
+    def _ancestors(self, level_path):
+        chain = [level_path]
+        while level_path != ROOT:
+            level_path = self.levels[level_path].parent_path
+            chain.append(level_path)
+        return chain
+
+    def _is_ancestor(self, ancestor, level_path):
+        return ancestor in self._ancestors(level_path)
+
+    def _common_ancestor(self, first, second):
+        ancestors = self._ancestors(second)
+        return next(level for level in self._ancestors(first) if level in ancestors)
+
+    def _up(self, elements, from_level, to_level):
+        while from_level != to_level:
+            level = self.levels[from_level]
+            elements = level.parent[elements]
+            from_level = level.parent_path
+        return elements
+
+    def _reduce_any(self, mask, from_level, to_level):
+        while from_level != to_level:
+            level = self.levels[from_level]
+            reduced = np.zeros(self.levels[level.parent_path].size, dtype=bool)
+            reduced[level.parent[mask]] = True
+            mask, from_level = reduced, level.parent_path
+        return mask
+
+    def _to_rows(self, mask, level_path, frame):
+        # Element mask on a level -> row mask ("any element matches" for nested arrays)
+        common = self._common_ancestor(level_path, frame.level)
+        return self._reduce_any(mask, level_path, common)[self._up(frame.rows, frame.level, common)]
+
+    # Values
+
+    def _decode(self, code):
+        return self.values[code] if code >= 0 else None
+
+    def _objects(self, vec):
+        if vec.kind == "codes":
+            objects = np.empty(len(vec.data), dtype=object)
+            valid = vec.data >= 0
+            objects[valid] = self.values[vec.data[valid]]
+            return objects
+        if vec.kind == "objects":
+            return vec.data
+        return vec.data.astype(object)
+
+    def _numbers(self, vec):
+        if vec.kind == "codes":
+            return np.where(vec.data >= 0, self.numbers[vec.data], np.nan)
+        if vec.kind in ("number", "bool"):
+            return vec.data.astype(float)
+        return np.array([float(value) if _is_number(value) else np.nan for value in vec.data])
+
+    def _visible(self, path, frame):
+        if frame.visible is None:
+            return True
+        return any(path == item or path.startswith(item + ".") or item.startswith(path + ".")
+                   for item in frame.visible)
+
+    def _computed_root(self, path, frame):
+        head = path.split(".", 1)[0]
+        return head if head in frame.computed else None
+
+    def _computed_values(self, path, frame):
+        head = self._computed_root(path, frame)
+        objects = self._objects(frame.computed[head])
+        if head == path:
+            return objects
+        parts = path.split(".")[1:]
+        return _object_array([_get_path(value, parts) for value in objects])
+
+    # Filters
+
+    def _codes_mask(self, codes, operator, value):
+        if operator == "$eq":
+            if value is None:
+                return (codes == -1) | (codes == self.null_code)
+            if isinstance(value, (Regex, re.Pattern)):
+                return self._regex_mask(codes, _compile(value))
+            if isinstance(value, (dict, list)):
+                raise NotImplementedError("Equality with documents or arrays is not supported")
+            code = self.code_of.get(_value_key(value))
+            return codes == code if code is not None else np.zeros(len(codes), dtype=bool)
+        if operator == "$in":
+            mask = np.zeros(len(codes), dtype=bool)
+            plain = [self.code_of.get(_value_key(item)) for item in value
+                     if item is not None and not isinstance(item, (Regex, re.Pattern))]
+            mask |= np.isin(codes, [code for code in plain if code is not None])
+            for item in value:
+                if item is None or isinstance(item, (Regex, re.Pattern)):
+                    mask |= self._codes_mask(codes, "$eq", item)
+            return mask
+        if operator in _RANGE_OPERATORS:
+            if isinstance(value, str):
+                left = bisect.bisect_left(self.strings, value)
+                right = bisect.bisect_right(self.strings, value)
+                is_string = (codes >= 0) & (codes < self.n_strings)
+                bound = {"$gt": codes >= right, "$gte": codes >= left,
+                         "$lt": codes < left, "$lte": codes < right}[operator]
+                return is_string & bound
+            if _is_number(value):
+                with np.errstate(invalid="ignore"):
+                    numbers = np.where(codes >= 0, self.numbers[codes], np.nan)
+                    return {"$gt": numbers > value, "$gte": numbers >= value,
+                            "$lt": numbers < value, "$lte": numbers <= value}[operator]
+            raise NotImplementedError("Range comparison with {!r} is not supported".format(value))
+        raise NotImplementedError("Query operator {} is not supported".format(operator))
+
+    def _regex_mask(self, codes, pattern):
+        # Run the regex once per distinct string of the column rather than once per value
+        candidates = np.unique(codes[(codes >= 0) & (codes < self.n_strings)])
+        matching = [code for code in candidates if pattern.search(self.strings[code])]
+        return np.isin(codes, matching)
+
+    def _positive(self, path, operator, value, frame):
+        if self._computed_root(path, frame):
+            values = self._computed_values(path, frame)
+            return np.array([_python_match(item, {operator: value}) for item in values], dtype=bool)
+
+        column = self.columns.get(path)
+        if column is None or not self._visible(path, frame):
+            missing_matches = (operator == "$eq" and value is None) or (operator == "$in" and None in value)
+            return np.full(len(frame), missing_matches, dtype=bool)
+        return self._to_rows(self._codes_mask(column.codes, operator, value), column.level, frame)
+
+    def _exists(self, path, frame):
+        if self._computed_root(path, frame):
+            return np.array([item is not _MISSING for item in self._computed_values(path, frame)], dtype=bool)
+        if not self._visible(path, frame):
+            return np.zeros(len(frame), dtype=bool)
+
+        parts = path.split(".")
+        for position, part in enumerate(parts):
+            if part.isdigit():
+                # "laureates.2" exists when the array has more than two elements
+                level = self.levels.get(".".join(parts[:position]))
+                if level is None or position != len(parts) - 1:
+                    raise NotImplementedError("Array index paths are only supported for $exists")
+                counts = np.bincount(level.parent, minlength=self.levels[level.parent_path].size)
+                return self._to_rows(counts > int(part), level.parent_path, frame)
+
+        if path in self.columns:
+            column = self.columns[path]
+            return self._to_rows(column.codes != -1, column.level, frame)
+        if path in self.levels:
+            level = self.levels[path]
+            return self._to_rows(level.present, level.parent_path, frame)
+        mask = np.zeros(len(frame), dtype=bool)
+        for column in self.columns.values():
+            if column.path.startswith(path + "."):
+                mask |= self._to_rows(column.codes != -1, column.level, frame)
+        return mask
+
+    def _elem_match(self, path, criteria, frame):
+        if path not in self.levels:
+            return np.zeros(len(frame), dtype=bool)
+        level = self.levels[path]
+        elements = Frame(path, np.arange(level.size))
+        if all(key.startswith("$") and key not in ("$and", "$or", "$nor") for key in criteria):
+            mask = self._field_mask(path, criteria, elements)
+        else:
+            mask = self._match(criteria, elements, prefix=path + ".")
+        return self._to_rows(mask, path, frame)
+
+    def _field_mask(self, path, condition, frame):
+        if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+            items = condition.items()
+        else:
+            items = [("$eq", condition)]
+
+        mask = np.ones(len(frame), dtype=bool)
+        for operator, value in items:
+            if operator == "$options":
+                continue
+            if operator == "$regex":
+                mask &= self._positive(path, "$eq", _compile(value, condition.get("$options")), frame)
+            elif operator == "$ne":
+                mask &= ~self._positive(path, "$eq", value, frame)
+            elif operator == "$nin":
+                mask &= ~self._positive(path, "$in", value, frame)
+            elif operator == "$not":
+                mask &= ~self._field_mask(path, value, frame)
+            elif operator == "$exists":
+                exists = self._exists(path, frame)
+                mask &= exists if value else ~exists
+            elif operator == "$elemMatch":
+                mask &= self._elem_match(path, value, frame)
+            else:
+                mask &= self._positive(path, operator, value, frame)
+        return mask
+
+    def _match(self, criteria, frame, prefix=""):
+        mask = np.ones(len(frame), dtype=bool)
+        for key, condition in criteria.items():
+            if key == "$and":
+                for clause in condition:
+                    mask &= self._match(clause, frame, prefix)
+            elif key in ("$or", "$nor"):
+                either = np.zeros(len(frame), dtype=bool)
+                for clause in condition:
+                    either |= self._match(clause, frame, prefix)
+                mask &= either if key == "$or" else ~either
+            elif key == "$expr":
+                mask &= self._truthy(self._expr(condition, frame))
+            else:
+                mask &= self._field_mask(prefix + key, condition, frame)
+        return mask
+
+    # Expressions
+
+    def _truthy(self, vec):
+        if vec.kind == "bool":
+            return vec.data
+        if vec.kind == "number":
+            return vec.data != 0
+        return np.array([value not in (None, False, 0, _MISSING) for value in self._objects(vec)], dtype=bool)
+
+    def _resolve(self, path, frame):
+        if self._computed_root(path, frame):
+            return Vec("objects", self._computed_values(path, frame))
+
+        column = self.columns.get(path)
+        if column is None or not self._visible(path, frame):
+            if path in self.levels and self._visible(path, frame):
+                return Vec("objects", _object_array([self._element_list(path, frame, row)
+                                                     for row in range(len(frame))]))
+            return Vec("codes", np.full(len(frame), -1, dtype=np.int64))
+        if frame.level is not None and self._is_ancestor(column.level, frame.level):
+            return Vec("codes", column.codes[self._up(frame.rows, frame.level, column.level)])
+        # Arrays of values below the current rows
+        return Vec("objects", _object_array([self._column_list(column, frame, row) for row in range(len(frame))]))
+
+    def _elements_under(self, level_path, frame, row):
+        # Elements of `level_path` belonging to one row of the frame
+        common = self._common_ancestor(level_path, frame.level)
+        anchor = self._up(frame.rows[row:row + 1], frame.level, common)[0]
+        elements = np.array([anchor])
+        for path in reversed(self._ancestors(level_path)[:self._ancestors(level_path).index(common)]):
+            level = self.levels[path]
+            elements = np.concatenate([level.children(element) for element in elements]) if len(elements) \
+                else elements
+        return elements
+
+    def _column_list(self, column, frame, row):
+        return [self._decode(code) for code in column.codes[self._elements_under(column.level, frame, row)]
+                if code >= 0]
+
+    def _element_list(self, level_path, frame, row):
+        visible = lambda path: self._visible(path, frame)
+        return [self._element_value(level_path, element, visible) for element in
+                self._elements_under(level_path, frame, row)]
+
+    def _nested_in(self, needle, haystack_path, frame):
+        # Vectorised {"$in": [<scalar field>, <array field below the rows>]}
+        column = self.columns[haystack_path]
+        common = self._common_ancestor(column.level, frame.level)
+        if common != frame.level:
+            return None
+        position = np.full(self.levels[frame.level].size, -1, dtype=np.int64)
+        position[frame.rows] = np.arange(len(frame))
+        rows = position[self._up(np.arange(len(column.codes)), column.level, frame.level)]
+        valid = (rows >= 0) & (column.codes >= 0)
+        hits = valid.copy()
+        hits[valid] = column.codes[valid] == needle.data[rows[valid]]
+        result = np.zeros(len(frame), dtype=bool)
+        result[rows[hits]] = True
+        return Vec("bool", result)
+
+    def _expr(self, expression, frame):
+        n_rows = len(frame)
+        if isinstance(expression, str) and expression.startswith("$$"):
+            raise NotImplementedError("Variables such as {} are not supported".format(expression))
+        if isinstance(expression, str) and expression.startswith("$"):
+            return self._resolve(expression[1:], frame)
+        if isinstance(expression, list):
+            parts = [self._objects(self._expr(item, frame)) for item in expression]
+            return Vec("objects", _object_array([[part[row] for part in parts] for row in range(n_rows)]))
+        if isinstance(expression, dict):
+            if len(expression) == 1 and next(iter(expression)).startswith("$"):
+                operator, arguments = next(iter(expression.items()))
+                return self._operator(operator, arguments, frame)
+            fields = {key: self._objects(self._expr(value, frame)) for key, value in expression.items()}
+            return Vec("objects", _object_array([
+                {key: values[row] for key, values in fields.items()} for row in range(n_rows)]))
+        if isinstance(expression, bool):
+            return Vec("bool", np.full(n_rows, expression))
+        if _is_number(expression):
+            return Vec("number", np.full(n_rows, expression))
+        return Vec("objects", _object_array([expression] * n_rows))
+
+    def _operator(self, operator, arguments, frame):
+        if operator == "$size":
+            path = arguments[1:] if isinstance(arguments, str) and arguments.startswith("$") else None
+            if path in self.levels and frame.level is not None and not self._computed_root(path, frame) \
+                    and self._is_ancestor(frame.level, self.levels[path].parent_path):
+                level = self.levels[path]
+                counts = np.bincount(self._up(np.arange(level.size), path, frame.level),
+                                     minlength=self.levels[frame.level].size)
+                return Vec("number", counts[frame.rows])
+        if operator == "$in" and isinstance(arguments[1], str) and arguments[1].startswith("$") \
+                and frame.level is not None:
+            needle = self._expr(arguments[0], frame)
+            path = arguments[1][1:]
+            if needle.kind == "codes" and path in self.columns and not self._computed_root(path, frame) \
+                    and self._visible(path, frame) and not self._is_ancestor(self.columns[path].level, frame.level):
+                result = self._nested_in(needle, path, frame)
+                if result is not None:
+                    return result
+        if operator in ("$eq", "$ne"):
+            left, right = (self._expr(argument, frame) for argument in arguments)
+            if left.kind == right.kind == "codes":
+                equal = (left.data == right.data) | ((left.data < 0) & (right.data < 0))
+                return Vec("bool", equal if operator == "$eq" else ~equal)
+
+        function = _EXPRESSION_OPERATORS.get(operator)
+        if function is None:
+            raise NotImplementedError("Expression operator {} is not supported".format(operator))
+        if not isinstance(arguments, list):
+            arguments = [arguments]
+        columns = [self._objects(self._expr(argument, frame)) for argument in arguments]
+        return Vec("objects", _object_array([function(*[column[row] for column in columns])
+                                             for row in range(len(frame))]))
+
+    # Grouping and sorting
+
+    def _factorize(self, vec):
+        """
+        Return (group codes, distinct values) with the distinct values in sort order.
+        """
+        if vec.kind == "codes":
+            unique, inverse = np.unique(vec.data, return_inverse=True)
+            values = [self._decode(code) for code in unique]
+        elif vec.kind in ("number", "bool"):
+            unique, inverse = np.unique(vec.data, return_inverse=True)
+            values = unique.tolist()
+        else:
+            index, values = {}, []
+            inverse = np.empty(len(vec.data), dtype=np.int64)
+            for row, value in enumerate(vec.data):
+                key = _hashable(None if value is _MISSING else value)
+                if key not in index:
+                    index[key] = len(values)
+                    values.append(None if value is _MISSING else value)
+                inverse[row] = index[key]
+            return self._sorted_groups(inverse, values)
+        return self._sorted_groups(inverse, values)
+
+    def _sorted_groups(self, inverse, values):
+        order = sorted(range(len(values)), key=lambda group: _sort_key(values[group]))
+        rank = np.empty(len(values), dtype=np.int64)
+        rank[np.array(order, dtype=np.int64)] = np.arange(len(values))
+        return rank[inverse] if len(values) else inverse, [values[group] for group in order]
+
+    def _group_keys(self, key, frame):
+        if isinstance(key, dict) and key and not any(name.startswith("$") for name in key):
+            parts = [self._expr(value, frame) for value in key.values()]
+            if all(part.kind == "codes" for part in parts):
+                # Compound keys of dictionary codes: one np.unique over the stacked codes
+                stacked = np.stack([part.data for part in parts], axis=1)
+                unique, inverse = np.unique(stacked, axis=0, return_inverse=True)
+                values = [dict(zip(key, (self._decode(code) for code in row))) for row in unique]
+                return self._sorted_groups(inverse.reshape(-1), values)
+        return self._factorize(self._expr(key, frame))
+
+    def _group(self, spec, frame):
+        groups, keys = self._group_keys(spec["_id"], frame)
+        n_groups = len(keys)
+        computed = OrderedDict([("_id", Vec("objects", _object_array(keys)))])
+
+        for name, accumulator in spec.items():
+            if name == "_id":
+                continue
+            operator, argument = next(iter(accumulator.items()))
+            if operator == "$count" or (operator == "$sum" and _is_number(argument)):
+                counts = np.bincount(groups, minlength=n_groups)
+                computed[name] = Vec("number", counts * (1 if operator == "$count" else argument))
+                continue
+
+            vec = self._expr(argument, frame)
+            if operator in ("$sum", "$avg"):
+                numbers = self._numbers(vec)
+                valid = ~np.isnan(numbers)
+                totals = np.bincount(groups[valid], weights=numbers[valid], minlength=n_groups)
+                if operator == "$avg":
+                    counts = np.bincount(groups[valid], minlength=n_groups)
+                    computed[name] = Vec("objects", _object_array(
+                        [total / count if count else None for total, count in zip(totals, counts)]))
+                else:
+                    integral = np.all(np.mod(numbers[valid], 1) == 0)
+                    computed[name] = Vec("number", totals.astype(np.int64) if integral else totals)
+            elif operator in ("$first", "$last"):
+                positions = np.arange(len(groups))
+                if operator == "$last":
+                    positions = positions[::-1]
+                _, first = np.unique(groups[positions], return_index=True)
+                computed[name] = Vec(vec.kind, vec.data[positions[first]])
+            elif operator == "$addToSet":
+                value_codes, values = self._factorize(vec)
+                pairs = np.unique(np.stack([groups, value_codes], axis=1), axis=0)
+                sets = [[] for _ in range(n_groups)]
+                for group, value in pairs:
+                    if values[value] is not None:
+                        sets[group].append(values[value])
+                computed[name] = Vec("objects", _object_array(sets))
+            elif operator in ("$push", "$min", "$max"):
+                members = [[] for _ in range(n_groups)]
+                for group, value in zip(groups, self._objects(vec)):
+                    members[group].append(value)
+                if operator == "$push":
+                    computed[name] = Vec("objects", _object_array(members))
+                else:
+                    pick = min if operator == "$min" else max
+                    computed[name] = Vec("objects", _object_array(
+                        [pick((value for value in values if value is not None), key=_sort_key, default=None)
+                         for values in members]))
+            else:
+                raise NotImplementedError("Accumulator {} is not supported".format(operator))
+
+        return Frame(None, np.arange(n_groups), computed)
+
+    def _sort_ranks(self, path, direction, frame):
+        column = self.columns.get(path)
+        if self._computed_root(path, frame) or column is None or frame.level is None \
+                or self._is_ancestor(column.level, frame.level):
+            ranks, _ = self._factorize(self._resolve(path, frame))
+            if column is not None and not self._computed_root(path, frame):
+                ranks = np.where(self._resolve(path, frame).data >= 0, ranks + 1, 0)
+            return ranks
+
+        # An array field sorts by its smallest element ascending, its largest descending
+        element_ranks, _ = self._factorize(Vec("codes", column.codes))
+        element_ranks = np.where(column.codes >= 0, element_ranks + 1, 0)
+        rows = self._up(np.arange(len(column.codes)), column.level, frame.level)
+        position = np.full(self.levels[frame.level].size, -1, dtype=np.int64)
+        position[frame.rows] = np.arange(len(frame))
+        rows = position[rows]
+        keep = (rows >= 0) & (column.codes >= 0)
+        if direction > 0:
+            ranks = np.full(len(frame), np.iinfo(np.int64).max)
+            np.minimum.at(ranks, rows[keep], element_ranks[keep])
+            ranks[ranks == np.iinfo(np.int64).max] = 0
+        else:
+            ranks = np.zeros(len(frame), dtype=np.int64)
+            np.maximum.at(ranks, rows[keep], element_ranks[keep])
+        return ranks
+
+    def _sort(self, spec, frame):
+        keys = []
+        for path, direction in spec.items():
+            ranks = self._sort_ranks(path, direction, frame)
+            keys.append(ranks if direction > 0 else -ranks)
+        if not keys or not len(frame):
+            return frame
+        return frame.take(np.lexsort(keys[::-1]))
+
+    # Stages
+
+    def _project(self, spec, frame):
+        computed, visible = OrderedDict(), set()
+        include_id = spec.get("_id", 1) not in (0, False)
+        for key, value in spec.items():
+            if key == "_id" and not include_id:
+                continue
+            if value is True or (_is_number(value) and value == 1):
+                if key in frame.computed:
+                    computed[key] = frame.computed[key]
+                elif self._visible(key, frame):
+                    visible.add(key)
+            elif value is False or (_is_number(value) and value == 0):
+                raise NotImplementedError("Exclusion projections are only supported for _id")
+            else:
+                computed[key] = self._expr(value, frame)
+        if include_id and "_id" not in spec:
+            if "_id" in frame.computed:
+                computed["_id"] = frame.computed["_id"]
+                computed.move_to_end("_id", last=False)
+            else:
+                visible.add("_id")
+        return Frame(frame.level, frame.rows, computed, visible)
+
+    def _unwind(self, spec, frame):
+        path = (spec["path"] if isinstance(spec, dict) else spec)[1:]
+        level = self.levels.get(path)
+        if level is None or frame.level is None or level.parent_path != frame.level \
+                or self._computed_root(path, frame):
+            raise NotImplementedError("Only arrays directly below the current rows can be unwound")
+        position = np.full(self.levels[frame.level].size, -1, dtype=np.int64)
+        position[frame.rows] = np.arange(len(frame))
+        owner = position[level.parent]
+        elements = np.nonzero(owner >= 0)[0]
+        elements = elements[np.lexsort([elements, owner[elements]])]
+        unwound = frame.take(owner[elements])
+        return Frame(path, elements, unwound.computed, frame.visible)
+
+    def run(self, pipeline, frame=None):
+        frame = frame or Frame(ROOT, np.arange(self.levels[ROOT].size))
+        for stage in pipeline:
+            (name, spec), = stage.items()
+            if name == "$match":
+                frame = frame.take(self._match(spec, frame))
+            elif name == "$project":
+                frame = self._project(spec, frame)
+            elif name == "$addFields":
+                for key, value in spec.items():
+                    frame.computed[key] = self._expr(value, frame)
+            elif name == "$unwind":
+                frame = self._unwind(spec, frame)
+            elif name == "$group":
+                frame = self._group(spec, frame)
+            elif name == "$sort":
+                frame = self._sort(spec, frame)
+            elif name == "$skip":
+                frame = frame.take(slice(spec, None))
+            elif name == "$limit":
+                frame = frame.take(slice(None, spec))
+            elif name == "$count":
+                computed = OrderedDict([(spec, Vec("number", np.array([len(frame)])))])
+                frame = Frame(None, np.arange(1 if len(frame) else 0), computed)
+            else:
+                raise NotImplementedError("Stage {} is not supported".format(name))
+        return frame
+
+    # Documents
+
+    def _element_value(self, level_path, element, visible, chain=None):
+        level = self.levels[level_path]
+        column = self.columns.get(level_path)
+        if column is not None and column.codes[element] >= 0:
+            return self.values[column.codes[element]]
+        if level.is_list[element]:
+            return []
+        return self._build(level_path, element, visible, chain or {})
+
+    def _build(self, level_path, element, visible, chain):
+        document = {}
+        for parts, field in self.level_fields[level_path]:
+            if not visible(field.path):
+                continue
+            if isinstance(field, Column):
+                code = field.codes[element]
+                if code < 0:
+                    continue
+                value = self.values[code]
+            else:
+                if not field.present[element]:
+                    continue
+                if field.path in chain:
+                    value = self._element_value(field.path, chain[field.path], visible, chain)
+                else:
+                    value = [self._element_value(field.path, child, visible)
+                             for child in field.children(element)]
+            _set_path(document, parts, value)
+        return document
+
+    def documents(self, frame):
+        """
+        Materialise the rows of a frame as documents.
+        """
+        computed = OrderedDict((name, self._objects(vec)) for name, vec in frame.computed.items())
+        visibility = {}
+
+        def visible(path):
+            if path not in visibility:
+                visibility[path] = self._visible(path, frame)
+            return visibility[path]
+
+        if frame.level is not None:
+            roots = self._up(frame.rows, frame.level, ROOT)
+            # Unwound arrays hold the single element of the row in place of the array
+            chains = {level_path: self._up(frame.rows, frame.level, level_path)
+                      for level_path in self._ancestors(frame.level)[:-1]}
+
+        documents = []
+        for row in range(len(frame)):
+            if frame.level is None:
+                document = {}
+            else:
+                chain = {level_path: elements[row] for level_path, elements in chains.items()}
+                document = self._build(ROOT, roots[row], visible, chain)
+            for name, values in computed.items():
+                if values[row] is not _MISSING:
+                    document[name] = values[row]
+            documents.append(document)
+        return documents
+
+    # Collection API
+
+    def count_documents(self, filter, **kwargs):
+        return int(self.run([{"$match": filter}]).rows.size)
+
+    def estimated_document_count(self, **kwargs):
+        return self.levels[ROOT].size
+
+    def distinct(self, key, filter=None, **kwargs):
+        roots = np.zeros(self.levels[ROOT].size, dtype=bool)
+        roots[self.run([{"$match": filter or {}}]).rows] = True
+        column = self.columns.get(key)
+        if column is None:
+            return []
+        selected = roots[self._up(np.arange(len(column.codes)), column.level, ROOT)] & (column.codes >= 0)
+        values = [self._decode(code) for code in np.unique(column.codes[selected])]
+        return sorted(values, key=_sort_key)
+
+    def aggregate(self, pipeline, **kwargs):
+        return iter(self.documents(self.run(pipeline)))
+
+    def find(self, filter=None, projection=None, sort=None, skip=0, limit=0, **kwargs):
+        return LocalCursor(self, filter, projection, sort, skip, limit)
+
+    def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        return next(iter(self.find(filter, projection, sort, limit=1)), None)
+
+    def create_index(self, keys, **kwargs):
+        # Nothing to build: every filter is a scan over dictionary codes
+        keys = [(keys, 1)] if isinstance(keys, str) else keys
+        return "_".join("{}_{}".format(field, direction) for field, direction in keys)
+
+
+class LocalCursor:
+    """
+    Lazily evaluated find() result supporting sort, skip and limit chaining.
+    """
+
+    def __init__(self, collection, filter=None, projection=None, sort=None, skip=0, limit=0):
+        self._collection = collection
+        self._filter = filter or {}
+        if isinstance(projection, (list, tuple)):
+            projection = OrderedDict((field, 1) for field in projection)
+        self._projection = projection
+        self._sort = list(sort or [])
+        self._skip = skip
+        self._limit = limit
+
+    def sort(self, key_or_list, direction=1):
+        self._sort = [(key_or_list, direction)] if isinstance(key_or_list, str) else list(key_or_list)
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def __iter__(self):
+        pipeline = [{"$match": self._filter}]
+        if self._sort:
+            pipeline.append({"$sort": OrderedDict(self._sort)})
+        if self._skip:
+            pipeline.append({"$skip": self._skip})
+        if self._limit:
+            pipeline.append({"$limit": self._limit})
+        if self._projection:
+            pipeline.append({"$project": self._projection})
+        return self._collection.aggregate(pipeline)
+
+
+def _get_path(value, parts):
+    for position, part in enumerate(parts):
+        if isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        elif isinstance(value, list):
+            if part.isdigit():
+                value = value[int(part)] if int(part) < len(value) else _MISSING
+            else:
+                values = [_get_path(item, parts[position:]) for item in value]
+                return [item for item in values if item is not _MISSING]
+        else:
+            return _MISSING
+    return value
+
+
+def _set_path(document, parts, value):
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def _python_match(value, condition):
+    """
+    Match one Python value against a filter condition, for computed fields.
+    """
+    (operator, argument), = condition.items()
+    candidates = value if isinstance(value, list) else [value]
+    if operator == "$exists":
+        return (value is not _MISSING) == bool(argument)
+    if operator == "$eq":
+        if isinstance(argument, (Regex, re.Pattern)):
+            pattern = _compile(argument)
+            return any(isinstance(item, str) and pattern.search(item) for item in candidates)
+        if argument is None:
+            return value is _MISSING or value is None
+        return value == argument or any(item == argument for item in candidates)
+    if operator == "$in":
+        return any(_python_match(value, {"$eq": item}) for item in argument)
+    if operator in _RANGE_OPERATORS:
+        compare = {"$gt": lambda a, b: a > b, "$gte": lambda a, b: a >= b,
+                   "$lt": lambda a, b: a < b, "$lte": lambda a, b: a <= b}[operator]
+        return any(item is not _MISSING and _sort_key(item)[0] == _sort_key(argument)[0]
+                   and compare(_sort_key(item), _sort_key(argument)) for item in candidates)
+    raise NotImplementedError("Query operator {} is not supported on computed fields".format(operator))
+
+
+def _compare(operator):
+    def compare(left, right):
+        left_key, right_key = _sort_key(left), _sort_key(right)
+        return {"$eq": left_key == right_key, "$ne": left_key != right_key,
+                "$gt": left_key > right_key, "$gte": left_key >= right_key,
+                "$lt": left_key < right_key, "$lte": left_key <= right_key,
+                "$cmp": (left_key > right_key) - (left_key < right_key)}[operator]
+    return compare
+
+
+def _index_of_bytes(string, substring, *bounds):
+    if string is None or string is _MISSING:
+        return None
+    return string.encode().find(substring.encode(), *bounds)
+
+
+def _set_difference(first, second):
+    if first is None or second is None:
+        return None
+    return [item for item in first if item not in second]
+
+
+_EXPRESSION_OPERATORS = {
+    "$eq": _compare("$eq"), "$ne": _compare("$ne"), "$gt": _compare("$gt"), "$gte": _compare("$gte"),
+    "$lt": _compare("$lt"), "$lte": _compare("$lte"), "$cmp": _compare("$cmp"),
+    "$in": lambda item, array: item in array,
+    "$size": lambda array: len(array),
+    "$setDifference": _set_difference,
+    "$indexOfBytes": _index_of_bytes,
+    "$and": lambda *items: all(items),
+    "$or": lambda *items: any(items),
+    "$not": lambda item: not item,
+    "$ifNull": lambda item, default: default if item is None or item is _MISSING else item,
+    "$toDouble": lambda item: None if item is None else float(item),
+    "$add": lambda *items: sum(items),
+    "$subtract": lambda first, second: first - second,
+    "$multiply": lambda *items: np.prod(items).item(),
+    "$divide": lambda first, second: first / second,
+    "$arrayElemAt": lambda array, index: array[index] if -len(array) <= index < len(array) else _MISSING,
+}
+
+
+class ColumnarEngine:
+    """
+    Columnar copies of the collections of one database.
+    """
+
+    def __init__(self, collections):
+        self.collections = collections
+
+    @classmethod
+    def from_documents(cls, documents_by_collection):
+        return cls({name: ColumnarCollection(documents) for name, documents in documents_by_collection.items()})
+
+    @classmethod
+    def load(cls, mongo_client, collection_names=("prizes", "laureates", "data_versions", "value_domains"),
+             db_name="nobel"):
+        """
+        Load collections from MongoDB, one cursor pass each. The small data_versions and
+        value_domains collections come along for reports that read value domains.
+        """
+        db = mongo_client[db_name]
+        return cls.from_documents({name: db[name].find() for name in collection_names})
+
+    def __getitem__(self, name):
+        return self.collections[name]
+
+
+class LocalDatabase:
+    def __init__(self, engine, name):
+        self._engine = engine
+        # Distinct from the server database the engine was loaded from, for caches
+        # keyed by database (domains.DomainCache, joins.BioCache)
+        self.name = name
+
+    def __getitem__(self, name):
+        return self._engine[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._engine[name]
+
+
+class LocalClient:
+    """
+    MongoClient stand-in answering queries from a ColumnarEngine.
+    """
+
+    def __init__(self, engine, db_name="nobel"):
+        self._engine = engine
+        self._db_name = db_name
+
+    def __getitem__(self, name):
+        if name != self._db_name:
+            raise KeyError(name)
+        return LocalDatabase(self._engine, "columnar:" + name)
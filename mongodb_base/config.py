@@ -0,0 +1,33 @@
+"""
+Connection settings for the MongoDB server. Every value can be overridden with
+the environment variable of the same name.
+"""
+import os
+
+__all__ = [
+    "connection_string", "max_pool_size", "min_pool_size", "wait_queue_timeout_ms",
+    "server_selection_timeout_ms", "compressors", "zlib_compression_level", "batch_size", "sync_cache_dir",
+    "bench_db_name",
+]
+
+connection_string = os.environ.get("MONGODB_CONNECTION_STRING", "mongodb://localhost:27017")
+
+# Connection pool
+max_pool_size = int(os.environ.get("MONGODB_MAX_POOL_SIZE", 50))
+min_pool_size = int(os.environ.get("MONGODB_MIN_POOL_SIZE", 0))
+wait_queue_timeout_ms = int(os.environ.get("MONGODB_WAIT_QUEUE_TIMEOUT_MS", 10000))
+server_selection_timeout_ms = int(os.environ.get("MONGODB_SERVER_SELECTION_TIMEOUT_MS", 30000))
+
+# Wire compression, in order of preference: any of "zstd", "snappy" and "zlib".
+# zstd and snappy need the zstandard and python-snappy packages respectively.
+compressors = os.environ.get("MONGODB_COMPRESSORS", "zlib")
+zlib_compression_level = int(os.environ.get("MONGODB_ZLIB_COMPRESSION_LEVEL", -1))
+
+# Default number of documents fetched per cursor batch
+batch_size = int(os.environ.get("MONGODB_BATCH_SIZE", 1000))
+
+# Directory of the gzip-compressed API response cache used by mongodb_base.sync
+sync_cache_dir = os.environ.get("MONGODB_SYNC_CACHE_DIR", ".nobel_cache")
+
+# Scratch database the benchmarks load synthetic data into
+bench_db_name = os.environ.get("MONGODB_BENCH_DB_NAME", "nobel_bench")
@@ -1,21 +1,60 @@
+import resource
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import ijson
 import requests
 
+from mongodb_base.domains import refresh_domains
+from mongodb_base.normalise import normalise_documents
+from mongodb_base.pagination import page_documents
+from mongodb_base.profiler import document_structure, profile
+from mongodb_base.search import search_documents
+from mongodb_base.versioning import bump_data_version
+
+API_URL = "http://api.nobelprize.org/v1/{}.json"
 
-def create_db_collections(mongo_client):
+
+def create_db_collections(mongo_client, normalise=False, search=False, views=None):
     # client is a dictionary of databases
     db = mongo_client["nobel"]
 
     for collection_name in ['prizes', 'laureates']:
         # collect the data from the API
-        response = requests.get("http://api.nobelprize.org/v1/{}.json".format(collection_name[:-1]))
+        response = requests.get(API_URL.format(collection_name[:-1]))
 
         # convert the data to json
         documents = response.json()[collection_name]
 
+        # optionally add typed year/share/date fields next to the API strings
+        if normalise:
+            documents = list(normalise_documents(collection_name, documents))
+
+        # optionally add the derived fields behind the prefix/substring search indexes
+        if search:
+            documents = list(search_documents(collection_name, documents))
+
+        # add the first prize year the particle laureate pages sort and seek on
+        documents = list(page_documents(collection_name, documents))
+
+        # let the materialized views know which partitions the new documents touch
+        if views is not None:
+            documents = list(views.track(collection_name, documents))
+
         # create collections on the fly
         # database is a dictionary of collections
         db[collection_name].insert_many(documents)
 
+        # let cached results know the collection changed
+        bump_data_version(db, collection_name)
+
+    # rebuild the value domains the reports filter on
+    refresh_domains(mongo_client)
+
+    if views is not None:
+        views.refresh_pending()
+
 
 def get_database_names(mongo_client):
     # save a list of names of the databases managed by client
@@ -30,30 +69,102 @@ def get_database_collections(mongo_client, db_name):
 
 
 def check_doc_structure(mongo_client):
-    # Connect to the "nobel" database
-    db = mongo_client["nobel"]
-
-    # Retrieve sample prize and laureate documents
-    prize = db.prizes.find_one()
-    laureate = db.laureates.find_one()
-
-    # Print the sample prize and laureate documents
-    print(prize)
-    print(laureate)
-    print(type(laureate))
+    # Print the structure of the prize and laureate documents, profiled from a
+    # sample of each collection rather than a single document
+    for collection_name in ["prizes", "laureates"]:
+        document_structure(mongo_client, collection_name)
 
 
 def get_document_fields(mongo_client):
-    # Connect to the "nobel" database
+    for collection_name in ["prizes", "laureates"]:
+        # Get the list of top-level fields present in a sample of each type of document
+        fields = profile(mongo_client, collection_name)["fields"]
+        print([field["path"] for field in fields if "." not in field["path"]])
+
+
+def stream_documents(collection_name, source=None):
+    """
+    Yield the documents of one collection from a Nobel API payload without loading
+    the whole payload into memory. `source` is a path to a local JSON dump or a URL;
+    it defaults to the live API.
+    """
+    source = source or API_URL.format(collection_name[:-1])
+
+    if source.startswith(("http://", "https://")):
+        with requests.get(source, stream=True) as response:
+            response.raise_for_status()
+            # let urllib3 undo any gzip/deflate transfer encoding for us
+            response.raw.decode_content = True
+            yield from ijson.items(response.raw, collection_name + ".item", use_float=True)
+    else:
+        with open(source, "rb") as fp:
+            yield from ijson.items(fp, collection_name + ".item", use_float=True)
+
+
+def insert_batches(collection, documents, batch_size=1000):
+    """
+    Write `documents` to `collection` in unordered bulk inserts of `batch_size`
+    documents and return the number of documents written.
+    """
+    documents = iter(documents)
+    n_inserted = 0
+    while True:
+        batch = list(islice(documents, batch_size))
+        if not batch:
+            return n_inserted
+        collection.insert_many(batch, ordered=False)
+        n_inserted += len(batch)
+
+
+def peak_rss_mb():
+    # Peak RSS of the whole process so far; ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def create_db_collections_streaming(mongo_client, sources=None, batch_size=1000, max_workers=2,
+                                    normalise=False, search=False, views=None):
+    """
+    Streaming variant of create_db_collections: each payload is parsed incrementally,
+    written in unordered batches, and both collections are loaded concurrently.
+
+    `sources` optionally maps a collection name to a local file or URL. With
+    `normalise`, typed fields are added to each document on the way in (see
+    mongodb_base.normalise); with `search`, the derived search fields are added
+    too (see mongodb_base.search). `views` is an optional views.ViewRegistry whose
+    views touched by the loaded documents are refreshed once loading completes.
+    Returns a dictionary of documents inserted per collection.
+    """
     db = mongo_client["nobel"]
-
-    # Retrieve sample prize and laureate documents
-    prize = db.prizes.find_one()
-    laureate = db.laureates.find_one()
-
-    # Get the list of fields present in each type of document
-    prize_fields = list(prize.keys())
-    laureate_fields = list(laureate.keys())
-
-    print(prize_fields)
-    print(laureate_fields)
+    sources = sources or {}
+
+    def load(collection_name):
+        documents = stream_documents(collection_name, sources.get(collection_name))
+        if normalise:
+            documents = normalise_documents(collection_name, documents)
+        if search:
+            documents = search_documents(collection_name, documents)
+        documents = page_documents(collection_name, documents)
+        if views is not None:
+            documents = views.track(collection_name, documents)
+        n_inserted = insert_batches(db[collection_name], documents, batch_size)
+        bump_data_version(db, collection_name)
+        return n_inserted
+
+    collection_names = ['prizes', 'laureates']
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        counts = dict(zip(collection_names, executor.map(load, collection_names)))
+    refresh_domains(mongo_client)
+    if views is not None:
+        views.refresh_pending()
+    elapsed = time.perf_counter() - start
+
+    n_total = sum(counts.values())
+    rss_after = peak_rss_mb()
+    # ru_maxrss only grows: the run's own footprint shows as the growth of the process peak
+    print("Inserted {counts} in {elapsed:.2f}s ({rate:.0f} docs/sec), process peak RSS {rss:.1f} MB "
+          "(+{growth:.1f} MB during this load)".format(
+              counts=counts, elapsed=elapsed, rate=n_total / elapsed if elapsed else 0, rss=rss_after,
+              growth=rss_after - rss_before))
+    return counts
@@ -0,0 +1,121 @@
+"""
+Value domains: the sets of distinct values some reports filter on, kept in the
+small "value_domains" collection instead of being re-computed with distinct()
+and shipped back to the server as $in literals on every call.
+
+    {"_id": "original_categories", "values": [...], "sourceVersion": 3, "refreshedAt": ...}
+
+Domains are rebuilt at ingest (refresh_domains) and cached in process by
+DomainCache, which re-reads a domain only once the data version of its source
+collection has moved past the domain's. Reads never write: a domain that is
+missing or older than its source is computed from the source collection
+instead, until the next refresh_domains() stores it.
+"""
+import threading
+import time
+from collections import namedtuple
+
+from mongodb_base.versioning import bump_data_version, data_version
+
+DOMAINS_COLLECTION = "value_domains"
+
+# `unwind` lists the array paths to flatten, as distinct() does, before collecting `field`
+Domain = namedtuple("Domain", ["name", "collection", "field", "filter", "unwind"])
+Domain.__new__.__defaults__ = (None, ())
+
+DOMAINS = {
+    "original_categories": Domain("original_categories", "prizes", "category", {"year": "1901"}),
+}
+
+
+def domain_pipeline(domain):
+    pipeline = [{"$match": domain.filter}] if domain.filter else []
+    pipeline += [{"$unwind": "$" + path} for path in domain.unwind]
+    pipeline += [{"$group": {"_id": None, "values": {"$addToSet": "$" + domain.field}}}]
+    return pipeline
+
+
+def compute_domain(db, domain):
+    """
+    Sorted distinct values of a domain, read from its source collection.
+    """
+    result = next(db[domain.collection].aggregate(domain_pipeline(domain)), {"values": []})
+    return sorted(value for value in result["values"] if value is not None)
+
+
+def refresh_domains(mongo_client, names=None):
+    """
+    Recompute the value domains (all, or those in `names`) from their source
+    collections and return their sizes. The data version of the domains collection
+    moves on whenever a domain's values change, so that views built on a domain go
+    stale with it.
+    """
+    db = mongo_client["nobel"]
+
+    sizes, changed = {}, False
+    for name in names or DOMAINS:
+        domain = DOMAINS[name]
+        version = data_version(db, domain.collection)
+        values = compute_domain(db, domain)
+        stored = db[DOMAINS_COLLECTION].find_one_and_replace(
+            {"_id": name},
+            {"values": values, "sourceVersion": version, "refreshedAt": time.time()},
+            upsert=True)
+        changed = changed or stored is None or stored["values"] != values
+        sizes[name] = len(values)
+    if changed:
+        bump_data_version(db, DOMAINS_COLLECTION)
+    return sizes
+
+
+class DomainCache:
+    """
+    In-process cache of value domains, per database, checked against the source
+    data version at most every `version_check_interval` seconds.
+    """
+
+    def __init__(self, version_check_interval=1.0):
+        self.version_check_interval = version_check_interval
+        self._lock = threading.Lock()
+        # (database name, domain name) -> (source version, values, monotonic time of
+        # the last version check)
+        self._entries = {}
+
+    def get(self, db, name):
+        domain = DOMAINS[name]
+        key = (db.name, name)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and now - entry[2] < self.version_check_interval:
+            return entry[1]
+
+        version = data_version(db, domain.collection)
+        if entry is not None and entry[0] == version:
+            with self._lock:
+                self._entries[key] = (version, entry[1], now)
+            return entry[1]
+
+        doc = db[DOMAINS_COLLECTION].find_one({"_id": name})
+        if doc is not None and doc["sourceVersion"] == version:
+            values = doc["values"]
+        else:
+            # Missing or older than its source: computed here, stored by the next refresh_domains()
+            values = compute_domain(db, domain)
+        with self._lock:
+            self._entries[key] = (version, values, now)
+        return values
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+domain_cache = DomainCache()
+
+
+def domain_values(db, name):
+    """
+    Values of a domain, from the in-process cache.
+    """
+    return domain_cache.get(db, name)
@@ -0,0 +1,254 @@
+"""
+Columnar snapshot export of the Nobel collections.
+
+Both collections are streamed through projected cursors and flattened into
+normalised tables, written as Parquet (or memory-mappable Arrow IPC) files in
+bounded row groups:
+
+    laureates        one row per laureate
+    laureate_prizes  one row per prize of a laureate (laureate_id, prize_index)
+    affiliations     one row per affiliation of a laureate's prize
+    prizes           one row per prize document
+    prize_laureates  one row per laureate listed on a prize document
+
+A full export replaces the files under <directory>/<table>/. An incremental run
+adds a new part file per table holding only the documents whose `changed_field`
+is beyond the largest value recorded in the manifest by the previous run; by
+default that is the sync timestamp mongodb_base.sync stamps on every document it
+inserts or updates. No part is written when nothing changed.
+
+Parts replace, rather than add to, the rows of earlier parts: read_table()
+keeps, for each natural key (the laureate id, or the prize year and category),
+only the rows of the newest part holding it. Documents deleted since the last
+full export, and reloads through create_db, which do not stamp the sync
+timestamp, need a full export.
+"""
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from bson import json_util
+
+from mongodb_base import config
+from mongodb_base.sync import SYNCED_AT_FIELD
+
+MANIFEST = "_manifest.json"
+
+
+def _schema(*columns):
+    return pa.schema([(name, pa.int32() if name.endswith("_index") or name.startswith("n_") else pa.string())
+                      for name in columns])
+
+
+LAUREATE_FIELDS = ["id", "firstname", "surname", "born", "died", "gender", "bornCountry",
+                   "bornCountryCode", "bornCity", "diedCountry", "diedCountryCode", "diedCity"]
+SCHEMAS = {
+    "laureates": _schema("_id", *LAUREATE_FIELDS),
+    "laureate_prizes": _schema("laureate_id", "prize_index", "year", "category", "share", "motivation"),
+    "affiliations": _schema("laureate_id", "prize_index", "affiliation_index", "name", "city", "country"),
+    "prizes": _schema("_id", "year", "category", "overallMotivation", "n_laureates"),
+    "prize_laureates": _schema("year", "category", "laureate_id", "firstname", "surname", "share",
+                               "motivation"),
+}
+# Per table: the table with one row per exported document, its natural key columns,
+# and the columns holding that key in the table's own rows
+TABLE_KEYS = {
+    "laureates": ("laureates", ("id",), ("id",)),
+    "laureate_prizes": ("laureates", ("id",), ("laureate_id",)),
+    "affiliations": ("laureates", ("id",), ("laureate_id",)),
+    "prizes": ("prizes", ("year", "category"), ("year", "category")),
+    "prize_laureates": ("prizes", ("year", "category"), ("year", "category")),
+}
+PROJECTIONS = {
+    "laureates": LAUREATE_FIELDS + ["prizes.year", "prizes.category", "prizes.share", "prizes.motivation",
+                                    "prizes.affiliations"],
+    "prizes": ["year", "category", "overallMotivation", "laureates"],
+}
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+class TableWriter:
+    """
+    Buffer rows of one table and write them out in row groups of `row_group_size` rows.
+    The file is created with the first row group, so a table without rows gets none.
+    """
+
+    def __init__(self, path, schema, fmt="parquet", row_group_size=64000):
+        if fmt not in ("parquet", "arrow"):
+            raise ValueError("Unknown format: {}".format(fmt))
+        self.path = path
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.rows_written = 0
+        self._columns = {name: [] for name in schema.names}
+        self._fmt = fmt
+        self._writer = None
+
+    def _open(self):
+        if self._fmt == "parquet":
+            self._writer = pq.ParquetWriter(self.path, self.schema, compression="zstd")
+        else:
+            self._sink = pa.OSFile(self.path, "wb")
+            self._writer = pa.ipc.new_file(self._sink, self.schema)
+
+    def append(self, row):
+        for name, column in self._columns.items():
+            column.append(row.get(name))
+        if len(self._columns[self.schema.names[0]]) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        n_rows = len(self._columns[self.schema.names[0]])
+        if not n_rows:
+            return
+        if self._writer is None:
+            self._open()
+        batch = pa.RecordBatch.from_pydict(self._columns, schema=self.schema)
+        if self._fmt == "parquet":
+            self._writer.write_table(pa.Table.from_batches([batch]), row_group_size=self.row_group_size)
+        else:
+            self._writer.write_batch(batch)
+        self.rows_written += n_rows
+        for column in self._columns.values():
+            column.clear()
+
+    def close(self):
+        self.flush()
+        if self._writer is None:
+            return
+        self._writer.close()
+        if self._fmt == "arrow":
+            self._sink.close()
+
+
+def flatten_laureate(doc, tables):
+    laureate_id = _text(doc.get("id"))
+    row = {field: _text(doc.get(field)) for field in LAUREATE_FIELDS}
+    row["_id"] = _text(doc["_id"])
+    tables["laureates"].append(row)
+
+    for prize_index, prize in enumerate(doc.get("prizes", [])):
+        tables["laureate_prizes"].append(dict(
+            {field: _text(prize.get(field)) for field in ("year", "category", "share", "motivation")},
+            laureate_id=laureate_id, prize_index=prize_index))
+        for affiliation_index, affiliation in enumerate(prize.get("affiliations", [])):
+            # Unaffiliated prizes hold an empty list instead of an affiliation document
+            if isinstance(affiliation, dict):
+                tables["affiliations"].append(dict(
+                    {field: _text(affiliation.get(field)) for field in ("name", "city", "country")},
+                    laureate_id=laureate_id, prize_index=prize_index, affiliation_index=affiliation_index))
+
+
+def flatten_prize(doc, tables):
+    laureates = doc.get("laureates", [])
+    tables["prizes"].append({
+        "_id": _text(doc["_id"]), "year": _text(doc.get("year")), "category": _text(doc.get("category")),
+        "overallMotivation": _text(doc.get("overallMotivation")), "n_laureates": len(laureates)})
+    for laureate in laureates:
+        tables["prize_laureates"].append({
+            "year": _text(doc.get("year")), "category": _text(doc.get("category")),
+            "laureate_id": _text(laureate.get("id")),
+            **{field: _text(laureate.get(field)) for field in ("firstname", "surname", "share", "motivation")}})
+
+
+FLATTENERS = {"laureates": flatten_laureate, "prizes": flatten_prize}
+
+
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {"parts": 0, "watermarks": {}}
+    with open(path) as fp:
+        return json_util.loads(fp.read())
+
+
+def export_snapshot(mongo_client, directory, fmt="parquet", row_group_size=64000, incremental=False,
+                    changed_field=SYNCED_AT_FIELD, batch_size=None):
+    """
+    Export both collections to columnar files under `directory` and return the number
+    of rows written per table.
+    """
+    db = mongo_client["nobel"]
+    manifest = load_manifest(directory) if incremental else {"parts": 0, "watermarks": {}}
+    part = manifest["parts"]
+    extension = "parquet" if fmt == "parquet" else "arrow"
+
+    tables = {}
+    for name, schema in SCHEMAS.items():
+        folder = os.path.join(directory, name)
+        os.makedirs(folder, exist_ok=True)
+        if not incremental:
+            # A full export replaces the previous snapshot
+            for file_name in os.listdir(folder):
+                os.remove(os.path.join(folder, file_name))
+        path = os.path.join(directory, name, "part-{:05d}.{}".format(part, extension))
+        tables[name] = TableWriter(path, schema, fmt, row_group_size)
+
+    try:
+        for collection_name, flatten in FLATTENERS.items():
+            criteria = {}
+            watermark = manifest["watermarks"].get(collection_name)
+            if incremental and watermark is not None:
+                criteria = {changed_field: {"$gt": watermark}}
+
+            projection = PROJECTIONS[collection_name] + [changed_field]
+            cursor = db[collection_name].find(criteria, projection,
+                                              batch_size=batch_size or config.batch_size)
+            for doc in cursor:
+                flatten(doc, tables)
+                value = doc.get(changed_field)
+                if value is not None and (watermark is None or value > watermark):
+                    watermark = value
+            manifest["watermarks"][collection_name] = watermark
+    finally:
+        for writer in tables.values():
+            writer.close()
+
+    if not incremental or any(writer.rows_written for writer in tables.values()):
+        manifest["parts"] = part + 1
+    with open(os.path.join(directory, MANIFEST), "w") as fp:
+        fp.write(json_util.dumps(manifest))
+    return {name: writer.rows_written for name, writer in tables.items()}
+
+
+def _read_part(path, columns=None):
+    if path.endswith(".arrow"):
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        return table.select(columns) if columns else table
+    return pq.read_table(path, columns=columns, memory_map=True)
+
+
+def _keys(table, columns):
+    keys = [table[column] for column in columns]
+    return keys[0] if len(keys) == 1 else pc.binary_join_element_wise(*keys, "\x00")
+
+
+def read_table(directory, name):
+    """
+    Read an exported table, memory-mapping the files. Each part replaces the rows of
+    the documents it exported: the rows of a natural key come from the newest part
+    that exported its document.
+    """
+    parent, parent_columns, columns = TABLE_KEYS[name]
+    folder, parent_folder = os.path.join(directory, name), os.path.join(directory, parent)
+    file_names = sorted(set(os.listdir(folder)) | set(os.listdir(parent_folder)), reverse=True)
+
+    parts, newer_keys = [], None
+    for file_name in file_names:
+        path = os.path.join(folder, file_name)
+        if os.path.exists(path):
+            part = _read_part(path)
+            if newer_keys is not None:
+                part = part.filter(pc.invert(pc.is_in(_keys(part, columns), value_set=newer_keys)))
+            parts.append(part)
+        parent_path = os.path.join(parent_folder, file_name)
+        if os.path.exists(parent_path):
+            keys = pc.unique(_keys(_read_part(parent_path, list(parent_columns)), parent_columns))
+            newer_keys = keys if newer_keys is None else pa.concat_arrays([newer_keys, keys])
+    if not parts:
+        return SCHEMAS[name].empty_table()
+    return pa.concat_tables(reversed(parts))
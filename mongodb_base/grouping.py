@@ -0,0 +1,87 @@
+"""
+Single-round-trip grouping helpers: per-key counts computed in one aggregation
+instead of one query per key.
+"""
+
+
+def grouped_counts_pipeline(key, match=None, unwind=(), expr=None, distinct_by=None, top_n=None):
+    """
+    Build the aggregation pipeline behind grouped_counts.
+
+        1. Filters documents with `match`,
+        2. Unwinds each array field path in `unwind`, in order,
+        3. Keeps the unwound documents satisfying the aggregation expression `expr`,
+        4. Counts each `key` value once per distinct `distinct_by` value (or once per
+           unwound document when `distinct_by` is None), and
+        5. Sorts by decreasing count (ties by key), keeping the first `top_n`.
+    """
+    pipeline = []
+    if match:
+        pipeline.append({"$match": match})
+    pipeline += [{"$unwind": "$" + path} for path in unwind]
+    if expr is not None:
+        pipeline.append({"$match": {"$expr": expr}})
+
+    if distinct_by is not None:
+        pipeline += [
+            {"$group": {"_id": {"key": "$" + key, "by": "$" + distinct_by}}},
+            {"$group": {"_id": "$_id.key", "count": {"$sum": 1}}},
+        ]
+    else:
+        pipeline.append({"$group": {"_id": "$" + key, "count": {"$sum": 1}}})
+
+    pipeline.append({"$sort": {"count": -1, "_id": 1}})
+    if top_n is not None:
+        pipeline.append({"$limit": top_n})
+    return pipeline
+
+
+def grouped_counts(collection, key, match=None, unwind=(), expr=None, distinct_by=None, top_n=None):
+    """
+    Return a list of (key value, count) pairs, most common first, from a single
+    aggregation. See grouped_counts_pipeline for the meaning of the arguments.
+    """
+    pipeline = grouped_counts_pipeline(key, match, unwind, expr, distinct_by, top_n)
+    return [(doc["_id"], doc["count"]) for doc in collection.aggregate(pipeline)]
+
+
+def first_per_group_pipeline(group_field, sort_field, direction=-1, fields=None, match=None):
+    """
+    Build the aggregation pipeline behind first_per_group.
+
+    The $sort on (group_field, sort_field) followed by a $group taking only $first
+    values of named fields is the shape the server can answer from a compound
+    (group_field, sort_field) index with a DISTINCT_SCAN, reading one index entry
+    per group instead of every document. That needs an index that is not multikey
+    and a `match` the index bounds answer entirely; with a filter on other fields,
+    an index leading with them (then group_field, sort_field) still provides the
+    sort, but the scan reads every matching entry.
+    """
+    fields = fields or [sort_field]
+    pipeline = []
+    if match:
+        pipeline.append({"$match": match})
+    pipeline += [
+        {"$sort": {group_field: 1, sort_field: direction}},
+        {"$group": dict({"_id": "$" + group_field},
+                        **{field.replace(".", "_"): {"$first": "$" + field} for field in fields})},
+        {"$sort": {"_id": 1}},
+    ]
+    return pipeline
+
+
+def first_per_group(collection, group_field, sort_field, direction=-1, fields=None, match=None):
+    """
+    Return the first document of each `group_field` group when ordered by `sort_field`
+    (descending by default, i.e. the latest), in one aggregation.
+
+    Each result holds the group value under `group_field` and the requested `fields`
+    (by default just `sort_field`; dots in field paths become underscores), ordered
+    by group value.
+    """
+    pipeline = first_per_group_pipeline(group_field, sort_field, direction, fields, match)
+    results = []
+    for doc in collection.aggregate(pipeline):
+        doc[group_field] = doc.pop("_id")
+        results.append(doc)
+    return results
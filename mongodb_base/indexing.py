@@ -1,4 +1,8 @@
-from collections import Counter
+from mongodb_base.advisor import QuerySpec, explain, winning_plan_stages
+from mongodb_base.grouping import first_per_group, first_per_group_pipeline, grouped_counts
+
+# The single-laureate filter of creating_index, and the index it leads
+SINGLE_LAUREATE = {"laureates.share": "1"}
 
 
 def creating_index(mongo_client):
@@ -7,25 +11,36 @@ def creating_index(mongo_client):
     report the most recent year that a single laureate -- rather than several -- received
     a prize in that category. As part of this task, you will ensure an index that speeds
     up finding prizes by category and then sorting results by decreasing year.
+
+    The index leads with the filtered field, so the plan is an IXSCAN with bounds
+    laureates.share ["1", "1"] that also yields the (category, year) order: no
+    in-memory SORT and no prize read that fails the filter. It is not a DISTINCT_SCAN:
+    laureates.share is an array path, which makes the index multikey, and the
+    planner only turns a $sort + $group/$first into a DISTINCT_SCAN on a non-multikey
+    index. creating_index_plan() returns the stages of the winning plan.
     """
     db = mongo_client["nobel"]
 
-    # Specify an index model for compound sorting
-    index_model = [("category", 1), ("year", -1)]
+    # Specify an index model for compound sorting, after the equality filter
+    index_model = [("laureates.share", 1), ("category", 1), ("year", -1)]
     db.prizes.create_index(index_model)
 
-    # Collect the last single-laureate year for each category
+    # Collect the last single-laureate year for each category in one aggregation
     report = ""
-    for category in sorted(db.prizes.distinct("category")):
-        doc = db.prizes.find_one(
-            {"category": category, "laureates.share": "1"},
-            sort=[("year", -1)]
-        )
+    for doc in first_per_group(db.prizes, "category", "year", match=SINGLE_LAUREATE):
         report += "{category}: {year}\n".format(**doc)
 
     print(report)
 
 
+def creating_index_plan(db):
+    """
+    Stages of the winning plan of creating_index's aggregation, from explain().
+    """
+    pipeline = first_per_group_pipeline("category", "year", match=SINGLE_LAUREATE)
+    return winning_plan_stages(explain(db, QuerySpec("creating_index", "prizes", pipeline=pipeline)))
+
+
 def born_affiliated(mongo_client):
     """
     Some countries are, for one or more laureates, both their country of birth ("bornCountry")
@@ -37,15 +52,23 @@ def born_affiliated(mongo_client):
     # Ensure an index on country of birth
     db.laureates.create_index([("bornCountry", 1)])
 
-    # Collect a count of laureates for each country of birth
-    # Dictionary comprehension
-    n_born_and_affiliated = {
-        country: db.laureates.count_documents({
-            "bornCountry": country,
-            "prizes.affiliations.country": country
-        })
-        for country in db.laureates.distinct("bornCountry")
-    }
-
-    five_most_common = Counter(n_born_and_affiliated).most_common(5)
-    print(five_most_common)
\ No newline at end of file
+    # Count, in one aggregation, the laureates affiliated with their country of birth
+    # for at least one prize, and keep the five most common countries
+    five_most_common = born_affiliated_counts(db, top_n=5)
+    print(five_most_common)
+
+
+def born_affiliated_counts(db, top_n=None):
+    """
+    Count laureates by country of birth, considering only laureates with at least one
+    prize affiliation in that country. Each laureate is counted once.
+    """
+    return grouped_counts(
+        db.laureates,
+        key="bornCountry",
+        match={"bornCountry": {"$ne": None}},
+        unwind=["prizes", "prizes.affiliations"],
+        expr={"$eq": ["$bornCountry", "$prizes.affiliations.country"]},
+        distinct_by="_id",
+        top_n=top_n,
+    )
@@ -0,0 +1,278 @@
+"""
+Command-level instrumentation built on pymongo.monitoring.
+
+Each command is attributed to the outermost mongodb_base function on the stack
+(the report function rather than the helpers it went through), and per function
+we keep a latency histogram, documents and bytes returned. Commands
+slower than a threshold are written to the "mongodb_base.slow_queries" logger as
+one JSON object per line. A PoolProfiler adds, per function, the connection
+checkouts and the time spent waiting for them, and counts pool clears per server.
+
+Listeners only apply to clients created after install(), so install the
+profiler before calling client.get_client():
+
+    profiler = install(slow_threshold_ms=50)
+    with profile_run(profiler):
+        filter_operators(get_client())
+"""
+import contextlib
+import json
+import logging
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+import bson
+from bson import json_util
+from pymongo import monitoring
+
+slow_query_log = logging.getLogger("mongodb_base.slow_queries")
+
+# Upper bounds (milliseconds) of the latency histogram buckets
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf"))
+
+# Modules that issue commands on behalf of other functions: the command wrappers
+# (cache, client) and the runners that call the report functions (benchmarks)
+_SKIPPED_MODULES = ("mongodb_base.instrumentation", "mongodb_base.cache", "mongodb_base.client",
+                    "mongodb_base.benchmarks")
+
+
+def calling_function():
+    """
+    Name ("module.function") of the outermost mongodb_base function on the current
+    thread's stack, so that commands issued through helpers (pipelines.aggregate,
+    grouping.grouped_counts, ...) are attributed to the report function calling them.
+    Wrappers and runners are skipped unless nothing else is on the stack; "<unknown>"
+    if the command did not come from this package.
+    """
+    caller = fallback = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("mongodb_base.") and module != "mongodb_base.instrumentation":
+            name = "{}.{}".format(module.split(".", 1)[1], frame.f_code.co_name)
+            if module.startswith(_SKIPPED_MODULES):
+                fallback = name
+            else:
+                caller = name
+        frame = frame.f_back
+    return caller or fallback or "<unknown>"
+
+
+def documents_returned(reply):
+    # Number of documents or values carried by a command reply
+    if "cursor" in reply:
+        cursor = reply["cursor"]
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if "values" in reply:
+        return len(reply["values"])
+    if "n" in reply:
+        return 1
+    return 0
+
+
+class FunctionStats:
+    __slots__ = ("calls", "errors", "total_ms", "max_ms", "documents", "reply_bytes", "histogram",
+                 "checkouts", "checkout_failures", "wait_ms", "max_wait_ms")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.documents = 0
+        self.reply_bytes = 0
+        self.histogram = Counter()
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def record(self, duration_ms):
+        self.calls += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.histogram[next(bound for bound in BUCKETS_MS if duration_ms <= bound)] += 1
+
+    def percentile(self, q):
+        # Upper bound of the histogram bucket holding the q-th percentile
+        target = q / 100 * self.calls
+        seen = 0
+        for bound in BUCKETS_MS:
+            seen += self.histogram[bound]
+            if seen >= target:
+                return bound
+        return BUCKETS_MS[-1]
+
+
+class CommandProfiler(monitoring.CommandListener):
+    """
+    Command listener collecting per-function statistics and logging slow commands.
+    """
+
+    def __init__(self, slow_threshold_ms=100):
+        self.slow_threshold_ms = slow_threshold_ms
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.stats = defaultdict(FunctionStats)
+        self.pool_clears = Counter()
+
+    def reset(self):
+        with self._lock:
+            self._in_flight.clear()
+            self.stats.clear()
+            self.pool_clears.clear()
+
+    def record_checkout(self, function, wait_ms, failed=False):
+        with self._lock:
+            stats = self.stats[function]
+            stats.checkouts += 1
+            stats.checkout_failures += failed
+            stats.wait_ms += wait_ms
+            stats.max_wait_ms = max(stats.max_wait_ms, wait_ms)
+
+    def record_pool_clear(self, address):
+        with self._lock:
+            self.pool_clears["{}:{}".format(*address)] += 1
+
+    def started(self, event):
+        # Started events are published on the thread that runs the command
+        command = event.command
+        summary = {key: command[key] for key in ("filter", "query", "pipeline", "key", "sort")
+                   if key in command}
+        with self._lock:
+            self._in_flight[(event.connection_id, event.request_id)] = (
+                calling_function(), command.get(event.command_name), summary)
+
+    def _finish(self, event):
+        with self._lock:
+            return self._in_flight.pop((event.connection_id, event.request_id),
+                                       ("<unknown>", None, {}))
+
+    def succeeded(self, event):
+        function, collection, summary = self._finish(event)
+        duration_ms = event.duration_micros / 1000
+        reply_bytes = len(bson.encode(event.reply))
+        with self._lock:
+            stats = self.stats[function]
+            stats.record(duration_ms)
+            stats.documents += documents_returned(event.reply)
+            stats.reply_bytes += reply_bytes
+        if duration_ms >= self.slow_threshold_ms:
+            self._log_slow(event, function, collection, summary, duration_ms, reply_bytes=reply_bytes)
+
+    def failed(self, event):
+        function, collection, summary = self._finish(event)
+        duration_ms = event.duration_micros / 1000
+        with self._lock:
+            stats = self.stats[function]
+            stats.record(duration_ms)
+            stats.errors += 1
+        if duration_ms >= self.slow_threshold_ms:
+            self._log_slow(event, function, collection, summary, duration_ms, error=str(event.failure))
+
+    def _log_slow(self, event, function, collection, summary, duration_ms, **extra):
+        record = dict(function=function, command=event.command_name, database=event.database_name,
+                      collection=collection, duration_ms=round(duration_ms, 3), **extra)
+        record.update(summary)
+        slow_query_log.warning(json_util.dumps(record))
+
+    def table(self):
+        """
+        Per-function profile rows, most expensive first.
+        """
+        with self._lock:
+            rows = [
+                {"function": function, "calls": stats.calls, "errors": stats.errors,
+                 "total_ms": stats.total_ms, "mean_ms": stats.total_ms / stats.calls,
+                 "p50_ms": stats.percentile(50), "p95_ms": stats.percentile(95),
+                 "max_ms": stats.max_ms, "documents": stats.documents,
+                 "reply_bytes": stats.reply_bytes, "checkouts": stats.checkouts,
+                 "checkout_failures": stats.checkout_failures, "wait_ms": stats.wait_ms,
+                 "max_wait_ms": stats.max_wait_ms}
+                for function, stats in self.stats.items() if stats.calls
+            ]
+        return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+
+class PoolProfiler(monitoring.ConnectionPoolListener):
+    """
+    Connection pool listener adding checkout waits and failures to the per-function
+    statistics of a CommandProfiler, and counting pool clears per server.
+    """
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self._started = threading.local()
+
+    def _wait_ms(self):
+        return 1000 * (time.perf_counter() - getattr(self._started, "time", time.perf_counter()))
+
+    def connection_check_out_started(self, event):
+        # Check-out events are published on the thread doing the check-out
+        self._started.time = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        self.profiler.record_checkout(calling_function(), self._wait_ms())
+
+    def connection_check_out_failed(self, event):
+        self.profiler.record_checkout(calling_function(), self._wait_ms(), failed=True)
+
+    def pool_cleared(self, event):
+        self.profiler.record_pool_clear(event.address)
+
+    # The remaining pool events carry nothing per function
+    def pool_created(self, event): pass
+
+    def pool_ready(self, event): pass
+
+    def pool_closed(self, event): pass
+
+    def connection_created(self, event): pass
+
+    def connection_ready(self, event): pass
+
+    def connection_closed(self, event): pass
+
+    def connection_checked_in(self, event): pass
+
+
+def install(slow_threshold_ms=100):
+    """
+    Register a CommandProfiler, and a PoolProfiler feeding it, for every client
+    created from now on and return the CommandProfiler.
+    """
+    profiler = CommandProfiler(slow_threshold_ms)
+    monitoring.register(profiler)
+    monitoring.register(PoolProfiler(profiler))
+    return profiler
+
+
+def format_table(rows):
+    header = "{:<45} {:>6} {:>4} {:>10} {:>8} {:>7} {:>7} {:>9} {:>8} {:>11} {:>9} {:>9}".format(
+        "function", "calls", "err", "total ms", "mean ms", "p50<=", "p95<=", "max ms", "docs", "bytes",
+        "checkouts", "wait ms")
+    lines = [header, "-" * len(header)]
+    for row in rows:
+        lines.append("{function:<45} {calls:>6} {errors:>4} {total_ms:>10.1f} {mean_ms:>8.2f} "
+                     "{p50_ms:>7g} {p95_ms:>7g} {max_ms:>9.2f} {documents:>8} {reply_bytes:>11} "
+                     "{checkouts:>9} {wait_ms:>9.2f}".format(**row))
+    return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def profile_run(profiler, out=None, as_json=False):
+    """
+    Reset `profiler`, run the block, then write the per-function profile of the
+    commands issued inside it to `out` (stdout by default).
+    """
+    profiler.reset()
+    try:
+        yield profiler
+    finally:
+        rows = profiler.table()
+        out = out or sys.stdout
+        out.write((json.dumps(rows, indent=2) if as_json else format_table(rows)) + "\n")
+        if profiler.pool_clears and not as_json:
+            out.write("pool clears: {}\n".format(dict(profiler.pool_clears)))
@@ -0,0 +1,144 @@
+"""
+Join strategies for the prizes -> laureates join of aggregation_pipeline5.
+
+    "lookup"  server-side: an index on laureates.id and a $lookup that returns only
+              bornCountry, so each unwound prize laureate costs one index probe
+              instead of a collection scan.
+    "hash"    client-side: the (category, laureate id) pairs of all prizes are read
+              once, the bios are fetched in batched $in chunks into a cache kept
+              until the laureates' data version changes, and the join runs in a dict.
+
+choose_strategy() prefers the hash join while the laureates fit in the cache and
+the server-side lookup beyond that; compare_join_strategies in
+mongodb_base.benchmarks measures both at several scales.
+"""
+import threading
+
+from mongodb_base.versioning import data_version
+
+# Largest laureates collection joined client-side by choose_strategy()
+HASH_JOIN_MAX_LAUREATES = 50000
+CHUNK_SIZE = 1000
+
+
+def ensure_join_indexes(mongo_client):
+    db = mongo_client["nobel"]
+    for name, info in db.laureates.index_information().items():
+        # Any index on id will do, such as the unique one built by mongodb_base.sync
+        if [tuple(key) for key in info["key"]] == [("id", 1)]:
+            return name
+    return db.laureates.create_index([("id", 1)])
+
+
+def born_countries_lookup_pipeline():
+    """
+    aggregation_pipeline5 with a $lookup that projects only bornCountry; the
+    localField/foreignField form with a sub-pipeline (MongoDB 5.0+) probes the index
+    on laureates.id.
+    """
+    return [
+        {"$project": {"_id": 0, "category": 1, "laureates.id": 1}},
+        {"$unwind": "$laureates"},
+        {"$lookup": {
+            "from": "laureates", "localField": "laureates.id", "foreignField": "id",
+            "pipeline": [{"$project": {"_id": 0, "bornCountry": 1}}],
+            "as": "laureate_bios"}},
+        {"$unwind": "$laureate_bios"},
+        {"$group": {"_id": "$category", "bornCountries": {"$addToSet": "$laureate_bios.bornCountry"}}},
+        {"$project": {"nBornCountries": {"$size": "$bornCountries"}}},
+        {"$sort": {"nBornCountries": -1}},
+    ]
+
+
+class BioCache:
+    """
+    Laureate id -> countries of birth (one per laureate document with that id), per
+    database, dropped whenever that database's laureates data version changes.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        # database name -> (laureates data version, bios)
+        self._entries = {}
+        self.fetches = 0
+
+    def get(self, db, ids):
+        """
+        Countries of birth of the laureates in `ids`, fetching the uncached ones.
+        """
+        version = data_version(db, "laureates")
+        with self._lock:
+            entry = self._entries.get(db.name)
+            if entry is None or entry[0] != version:
+                entry = self._entries[db.name] = (version, {})
+            bios = entry[1]
+            missing = sorted(set(ids) - bios.keys())
+
+        fetched = {laureate_id: [] for laureate_id in missing}
+        for start in range(0, len(missing), self.chunk_size):
+            chunk = missing[start:start + self.chunk_size]
+            for doc in db.laureates.find({"id": {"$in": chunk}}, {"_id": 0, "id": 1, "bornCountry": 1}):
+                fetched[doc["id"]].append(doc.get("bornCountry"))
+            self.fetches += 1
+
+        with self._lock:
+            bios.update(fetched)
+            return {laureate_id: bios.get(laureate_id, []) for laureate_id in ids}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+bio_cache = BioCache()
+
+
+def born_countries_hash_join(db, cache=None):
+    """
+    aggregation_pipeline5 as a client-side hash join; returns the same documents.
+    """
+    cache = cache or bio_cache
+    pairs = [(prize["category"], laureate["id"])
+             for prize in db.prizes.find({}, {"_id": 0, "category": 1, "laureates.id": 1})
+             for laureate in prize.get("laureates", []) if "id" in laureate]
+    bios = cache.get(db, {laureate_id for _, laureate_id in pairs})
+
+    by_category = {}
+    for category, laureate_id in pairs:
+        # A laureate without a bio drops out of the $unwind; $addToSet skips missing values
+        if bios[laureate_id]:
+            countries = by_category.setdefault(category, set())
+            countries.update(country for country in bios[laureate_id] if country is not None)
+    return sorted(({"_id": category, "nBornCountries": len(countries)}
+                   for category, countries in by_category.items()),
+                  key=lambda doc: doc["nBornCountries"], reverse=True)
+
+
+def choose_strategy(db, max_cached_laureates=HASH_JOIN_MAX_LAUREATES):
+    """
+    "hash" while the laureates fit in the bio cache, "lookup" otherwise.
+    """
+    return "hash" if db.laureates.estimated_document_count() <= max_cached_laureates else "lookup"
+
+
+def born_countries(mongo_client, strategy="auto", cache=None):
+    """
+    Number of distinct countries of birth of the laureates of each prize category.
+    """
+    db = mongo_client["nobel"]
+    if strategy == "auto":
+        strategy = choose_strategy(db)
+    if strategy == "hash":
+        return born_countries_hash_join(db, cache)
+    if strategy == "lookup":
+        ensure_join_indexes(mongo_client)
+        return list(db.prizes.aggregate(born_countries_lookup_pipeline()))
+    raise ValueError("Unknown join strategy: {}".format(strategy))
+
+
+def aggregation_pipeline5_joined(mongo_client, strategy="auto"):
+    """
+    agg_pipelines.aggregation_pipeline5 through the join layer.
+    """
+    for doc in born_countries(mongo_client, strategy): print(doc)
@@ -0,0 +1,132 @@
+"""
+Lazy raw-BSON access mode for wide documents.
+
+Collections opened with lazy_collection() return LazyDocument records instead of
+dicts. A LazyDocument holds the document's BSON bytes and decodes them on the
+first read of one of its fields, one level at a time: subdocuments - including
+those inside arrays - come back as LazyDocuments wrapping their own bytes, so
+reading prize["laureates"][0]["surname"] never builds the motivations,
+affiliations or other nested values that are not read.
+
+(The top level is decoded in one call to the C decoder rather than field by
+field: walking the element offsets in Python costs more than decoding every
+scalar of the level.)
+
+LazyDocument is a RawBSONDocument and a read-only Mapping, so code written for
+dicts (itemgetter, .get, `in`, ==, printing) works on it unchanged.
+"""
+from collections.abc import Mapping
+
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+
+class LazyDocument(RawBSONDocument):
+    """
+    A read-only BSON document decoded one level at a time, on first read.
+    """
+
+    __slots__ = ("_raw", "_options", "_fields")
+
+    def __init__(self, bson_bytes, codec_options=None):
+        # RawBSONDocument.__init__ is skipped: its codec and size checks cost more
+        # than decoding a small document, and the server has validated the bytes
+        self._raw = bson_bytes
+        self._options = codec_options or LAZY_CODEC_OPTIONS
+        self._fields = None
+
+    @property
+    def raw(self):
+        return self._raw
+
+    def _decoded(self):
+        if self._fields is None:
+            # bson.decode() would hand back an undecoded LazyDocument, as the codec's
+            # document_class applies to the top level too; a RawBSONDocument decodes
+            # one level and builds nested documents with the codec's document_class
+            self._fields = dict(RawBSONDocument(self._raw, self._options).items())
+        return self._fields
+
+    def __getitem__(self, name):
+        return self._decoded()[name]
+
+    def __contains__(self, name):
+        return name in self._decoded()
+
+    def __iter__(self):
+        return iter(self._decoded())
+
+    def __len__(self):
+        return len(self._decoded())
+
+    def items(self):
+        return self._decoded().items()
+
+    def is_decoded(self):
+        return self._fields is not None
+
+    def __eq__(self, other):
+        if isinstance(other, RawBSONDocument):
+            return bytes(self.raw) == bytes(other.raw)
+        # Equal to the dict a regular cursor would have returned
+        if isinstance(other, Mapping):
+            return dict(self.items()) == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return None, {"_raw": bytes(self._raw), "_options": self._options, "_fields": None}
+
+    def __repr__(self):
+        # Like the dict a regular cursor would have returned
+        return repr(dict(self.items()))
+
+
+LAZY_CODEC_OPTIONS = CodecOptions(document_class=LazyDocument)
+
+
+def lazy_collection(db, name):
+    """
+    `db[name]` returning LazyDocument records.
+    """
+    return db.get_collection(name, codec_options=LAZY_CODEC_OPTIONS)
+
+
+def check_doc_structure_lazy(mongo_client):
+    """
+    create_db.check_doc_structure with lazy records.
+    """
+    db = mongo_client["nobel"]
+
+    # Retrieve sample prize and laureate documents
+    prize = lazy_collection(db, "prizes").find_one()
+    laureate = lazy_collection(db, "laureates").find_one()
+
+    # Print the sample prize and laureate documents
+    print(prize)
+    print(laureate)
+    print(type(laureate))
+
+
+def filter_operators_lazy(mongo_client):
+    """
+    The first query of query_db.filter_operators (a laureate with at least three
+    prizes) returning a lazy record.
+    """
+    db = mongo_client["nobel"]
+    doc = lazy_collection(db, "laureates").find_one({"prizes.2": {"$exists": True}})
+    print(doc)
+    return doc
+
+
+def sort_projection_lazy(mongo_client):
+    """
+    query_db.sort_projection with lazy records; query_db.all_laureates_sorted reads
+    only the year and the laureates' surnames of each prize.
+    """
+    db = mongo_client["nobel"]
+    return lazy_collection(db, "prizes").find(
+        filter={"category": "physics"},
+        projection=["year", "laureates.firstname", "laureates.surname"],
+        sort=[("year", 1)])
@@ -0,0 +1,350 @@
+"""
+Compact client-side model of the Nobel documents, for workers that keep many
+prizes or laureates in memory.
+
+Prize, Laureate and Affiliation are __slots__ records. Categories, countries,
+cities, genders and affiliation names are interned; years, shares and laureate
+ids are stored as integers, unless they are not canonical integer strings (such
+as "02"), which are kept as strings. Each class is a read-only Mapping over the
+document keys it models, giving back the original string form of the integer
+coded values, so helpers written for dicts (query_db.all_laureates,
+itemgetter("surname"), doc["year"]) run on it unchanged. Keys a document does
+not have are missing from its record too; keys not modelled (such as _id or
+the derived search fields) are dropped.
+
+RecordTable is the bulk alternative: a struct-of-arrays container holding
+every field of a record class in one typed array column (strings as codes into
+a shared pool), loaded straight from a cursor. Indexing or iterating it yields
+lightweight row views with the same Mapping interface.
+"""
+import sys
+from array import array
+from collections.abc import Mapping
+from itertools import groupby
+from operator import itemgetter
+
+from mongodb_base import query_db
+from mongodb_base.domains import domain_values
+
+# Column sentinels for a missing integer value and for a value kept as a string
+_MISSING = -2 ** 63
+_RAW = _MISSING + 1
+
+
+def encode_int(value):
+    # The integer form of a canonical integer string ("1901", "2"); any other value
+    # ("02", "1/2") is kept as it is, so that it reads back unchanged
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return value
+    return number if str(number) == value else value
+
+
+def _encode(key, kind, value):
+    if value is None:
+        return None
+    if kind == "int":
+        return encode_int(value)
+    if kind == "interned":
+        return sys.intern(value)
+    if kind == "str":
+        return value
+    # Unaffiliated prizes hold a list with one empty list: kept as an empty tuple
+    return tuple(() if doc == [] else kind.from_document(doc) for doc in value)
+
+
+class Record(Mapping):
+    """
+    A Mapping over the slots of a record. FIELDS maps each document key to its slot
+    and kind: "str", "interned", "int" or, for arrays of subdocuments, a Record class.
+    """
+
+    __slots__ = ()
+    FIELDS = {}
+
+    @classmethod
+    def from_document(cls, doc):
+        record = cls.__new__(cls)
+        for key, (slot, kind) in cls.FIELDS.items():
+            setattr(record, slot, _encode(key, kind, doc.get(key)))
+        return record
+
+    def __getitem__(self, key):
+        slot, kind = self.FIELDS[key]
+        value = getattr(self, slot)
+        if value is None:
+            raise KeyError(key)
+        return str(value) if kind == "int" else value
+
+    def __iter__(self):
+        return (key for key, (slot, _) in self.FIELDS.items() if getattr(self, slot) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, dict(self))
+
+
+class Affiliation(Record):
+    __slots__ = ("name", "city", "country")
+    FIELDS = {
+        "name": ("name", "interned"),
+        "city": ("city", "interned"),
+        "country": ("country", "interned"),
+    }
+
+
+class Prize(Record):
+    """
+    A prize document, or one of the prizes of a laureate document (with the
+    laureate's share, motivation and affiliations instead of laureates).
+    """
+
+    __slots__ = ("year", "category", "overall_motivation", "laureates", "share", "motivation", "affiliations")
+
+
+class Laureate(Record):
+    """
+    A laureate document, or one of the laureates of a prize document (with the
+    laureate's share and motivation instead of prizes).
+    """
+
+    __slots__ = ("id", "firstname", "surname", "gender", "born", "died", "born_country", "born_city",
+                 "died_country", "died_city", "share", "motivation", "prizes")
+
+
+Prize.FIELDS = {
+    "year": ("year", "int"),
+    "category": ("category", "interned"),
+    "overallMotivation": ("overall_motivation", "str"),
+    "laureates": ("laureates", Laureate),
+    "share": ("share", "int"),
+    "motivation": ("motivation", "str"),
+    "affiliations": ("affiliations", Affiliation),
+}
+Laureate.FIELDS = {
+    "id": ("id", "int"),
+    "firstname": ("firstname", "str"),
+    "surname": ("surname", "str"),
+    "gender": ("gender", "interned"),
+    "born": ("born", "str"),
+    "died": ("died", "str"),
+    "bornCountry": ("born_country", "interned"),
+    "bornCity": ("born_city", "interned"),
+    "diedCountry": ("died_country", "interned"),
+    "diedCity": ("died_city", "interned"),
+    "share": ("share", "int"),
+    "motivation": ("motivation", "str"),
+    "prizes": ("prizes", Prize),
+}
+
+
+def projection(record_class, prefix="", _outer=()):
+    # Projection of the document fields a record class models
+    fields = {}
+    for key, (_, kind) in record_class.FIELDS.items():
+        if not isinstance(kind, type):
+            fields[prefix + key] = 1
+        elif kind not in _outer + (record_class,):
+            # Prize and Laureate nest each other only one level deep
+            fields.update(projection(kind, prefix + key + ".", _outer + (record_class,)))
+    return fields
+
+
+class StringPool:
+    """
+    Strings stored once and referred to by integer code.
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def code(self, value):
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def value(self, code):
+        return None if code < 0 else self.values[code]
+
+
+class RecordTable:
+    """
+    Struct-of-arrays storage of the records of one Record class: an array per
+    field, and for arrays of subdocuments a child table plus the offsets of each
+    row's children. Integer values that do not fit their column are kept in the
+    pool, by row, in `raw_codes`.
+    """
+
+    def __init__(self, record_class, pool=None):
+        self.record_class = record_class
+        self.pool = pool or StringPool()
+        self.columns = {key: array("q" if kind == "int" else "i")
+                        for key, (_, kind) in record_class.FIELDS.items() if not isinstance(kind, type)}
+        # int column -> {row: pool code} of the values stored as _RAW
+        self.raw_codes = {key: {} for key, (_, kind) in record_class.FIELDS.items() if kind == "int"}
+        # Created on first use (Prize and Laureate nest each other): the child table,
+        # the child offsets of every row and whether each row has the array at all
+        self.children = {}
+        self.offsets = {}
+        self.present = {}
+        # Rows standing for an empty list in the array (see _encode)
+        self.empty_lists = array("b")
+        self.n_rows = 0
+
+    def append(self, doc):
+        self.empty_lists.append(doc == [])
+        if doc == []:
+            doc = {}
+        for key, (_, kind) in self.record_class.FIELDS.items():
+            value = doc.get(key)
+            if isinstance(kind, type):
+                if value is not None and key not in self.children:
+                    self.children[key] = RecordTable(kind, self.pool)
+                    self.offsets[key] = array("q", [0] * (self.n_rows + 1))
+                    self.present[key] = array("b", bytes(self.n_rows))
+                if key in self.children:
+                    child = self.children[key]
+                    for subdoc in value or ():
+                        child.append(subdoc)
+                    self.offsets[key].append(child.n_rows)
+                    self.present[key].append(value is not None)
+            elif kind == "int":
+                number = None if value is None else encode_int(value)
+                if number is None:
+                    self.columns[key].append(_MISSING)
+                elif isinstance(number, int) and _RAW < number < 2 ** 63:
+                    self.columns[key].append(number)
+                else:
+                    self.columns[key].append(_RAW)
+                    self.raw_codes[key][self.n_rows] = self.pool.code(value)
+            else:
+                self.columns[key].append(self.pool.code(value))
+        self.n_rows += 1
+
+    def extend(self, documents):
+        for doc in documents:
+            self.append(doc)
+        return self
+
+    def value(self, key, row):
+        """
+        The document value of `key` in `row`, or None when the row does not have it.
+        """
+        if isinstance(self.record_class.FIELDS[key][1], type):
+            if key not in self.children or not self.present[key][row]:
+                return None
+            offsets = self.offsets[key]
+            child = self.children[key]
+            return [[] if child.empty_lists[child_row] else RowView(child, child_row)
+                    for child_row in range(offsets[row], offsets[row + 1])]
+        code = self.columns[key][row]
+        if self.record_class.FIELDS[key][1] == "int":
+            if code == _RAW:
+                return self.pool.value(self.raw_codes[key][row])
+            return None if code == _MISSING else str(code)
+        return self.pool.value(code)
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getitem__(self, row):
+        if not -self.n_rows <= row < self.n_rows:
+            raise IndexError(row)
+        return RowView(self, row % self.n_rows)
+
+    def __iter__(self):
+        return (RowView(self, row) for row in range(self.n_rows))
+
+
+class RowView(Mapping):
+    """
+    One row of a RecordTable, read as its document.
+    """
+
+    __slots__ = ("table", "row")
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def __getitem__(self, key):
+        if key not in self.table.record_class.FIELDS:
+            raise KeyError(key)
+        value = self.table.value(key, self.row)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return (key for key in self.table.record_class.FIELDS if self.table.value(key, self.row) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def load_records(cursor, record_class):
+    return [record_class.from_document(doc) for doc in cursor]
+
+
+def load_table(cursor, record_class):
+    return RecordTable(record_class).extend(cursor)
+
+
+def prize_table(mongo_client, criteria=None, sort=None):
+    db = mongo_client["nobel"]
+    return load_table(db.prizes.find(criteria or {}, projection(Prize), sort=sort), Prize)
+
+
+def laureate_table(mongo_client, criteria=None, sort=None):
+    db = mongo_client["nobel"]
+    return load_table(db.laureates.find(criteria or {}, projection(Laureate), sort=sort), Laureate)
+
+
+def sort_projection_model(mongo_client):
+    """
+    query_db.sort_projection loaded into a RecordTable; pass it to
+    query_db.all_laureates_sorted.
+    """
+    return prize_table(mongo_client, {"category": "physics"}, sort=[("year", 1)])
+
+
+def mongodb_projections_model(mongo_client, table=None):
+    """
+    query_db.mongodb_projections over a laureate table (by default, the laureates
+    the original query selects).
+    """
+    if table is None:
+        table = laureate_table(mongo_client, {"firstname": {"$regex": "^G"}, "surname": {"$regex": "^S"}})
+    full_names = [doc["firstname"] + " " + doc["surname"] for doc in table]
+    print(full_names)
+
+
+def aggregation_pipeline2_model(mongo_client, table=None):
+    """
+    agg_pipelines.aggregation_pipeline2 over a prize table (by default, all prizes).
+    """
+    db = mongo_client["nobel"]
+    original_categories = set(domain_values(db, "original_categories"))
+    table = prize_table(mongo_client) if table is None else table
+
+    docs = sorted((doc for doc in table if doc.get("category") in original_categories),
+                  key=lambda doc: int(doc["year"]), reverse=True)
+    for key, group in groupby(docs, key=itemgetter("year")):
+        missing = original_categories - {doc["category"] for doc in group}
+        if missing:
+            print("{year}: {missing}".format(year=key, missing=", ".join(sorted(missing))))
+
+
+def all_laureates_sorted_model(mongo_client):
+    query_db.all_laureates_sorted(sort_projection_model(mongo_client))
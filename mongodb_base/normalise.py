@@ -0,0 +1,113 @@
+"""
+Ingest-time type normalisation.
+
+The API stores years, shares and dates as strings. Normalised documents keep
+those strings untouched (so every existing query still works) and gain typed
+companions that compare numerically and support tight index bounds:
+
+    year  -> yearInt        (int)
+    share -> shareInt       (int, the prize is split 1/shareInt)
+             shareFraction  (Decimal128 of 1/shareInt)
+    born  -> bornDate       (datetime)
+    died  -> diedDate       (datetime)
+
+Dates are recorded with the precision the API knows: "1900-00-00" becomes
+1900-01-01 and "0000-00-00" (unknown, or still alive) gets no typed date.
+"""
+from datetime import datetime
+from decimal import Decimal, localcontext
+
+from bson.decimal128 import Decimal128, create_decimal128_context
+from pymongo import ReplaceOne
+
+from mongodb_base.versioning import bump_data_version
+
+_DECIMAL128 = create_decimal128_context()
+
+
+def parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_date(value):
+    """
+    Parse an API date ("YYYY-MM-DD", with 00 for unknown parts) into a datetime,
+    or None when the year is unknown or the date is invalid ("1900-02-30").
+    """
+    try:
+        year, month, day = (int(part) for part in value.split("-"))
+        return datetime(year, month or 1, day or 1) if year else None
+    except (AttributeError, ValueError):
+        return None
+
+
+def share_fraction(share):
+    with localcontext(_DECIMAL128) as context:
+        return Decimal128(context.divide(Decimal(1), Decimal(share)))
+
+
+def _normalise_share(holder):
+    share = parse_int(holder.get("share"))
+    if share:
+        holder["shareInt"] = share
+        holder["shareFraction"] = share_fraction(share)
+
+
+def _normalise_year(holder):
+    year = parse_int(holder.get("year"))
+    if year is not None:
+        holder["yearInt"] = year
+
+
+def normalise_prize(doc):
+    _normalise_year(doc)
+    for laureate in doc.get("laureates", []):
+        _normalise_share(laureate)
+    return doc
+
+
+def normalise_laureate(doc):
+    for field in ("born", "died"):
+        date = parse_date(doc.get(field))
+        if date is not None:
+            doc[field + "Date"] = date
+    for prize in doc.get("prizes", []):
+        _normalise_year(prize)
+        _normalise_share(prize)
+    return doc
+
+
+NORMALISERS = {"prizes": normalise_prize, "laureates": normalise_laureate}
+
+
+def normalise_documents(collection_name, documents):
+    """
+    Lazily normalise a stream of API documents of one collection.
+    """
+    normalise = NORMALISERS[collection_name]
+    return (normalise(doc) for doc in documents)
+
+
+def normalise_collections(mongo_client, batch_size=1000):
+    """
+    Add the typed fields to documents already in the database, in batched replaces.
+    Returns the number of documents rewritten per collection.
+    """
+    db = mongo_client["nobel"]
+
+    counts = {}
+    for collection_name, normalise in NORMALISERS.items():
+        collection = db[collection_name]
+        requests, counts[collection_name] = [], 0
+        for doc in collection.find({}, batch_size=batch_size):
+            requests.append(ReplaceOne({"_id": doc["_id"]}, normalise(doc)))
+            if len(requests) == batch_size:
+                counts[collection_name] += collection.bulk_write(requests, ordered=False).modified_count
+                requests = []
+        if requests:
+            counts[collection_name] += collection.bulk_write(requests, ordered=False).modified_count
+        bump_data_version(db, collection_name)
+    return counts
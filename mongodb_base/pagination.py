@@ -0,0 +1,132 @@
+"""
+Keyset (seek) pagination for the particle laureates listing in query_db.
+
+Instead of skipping over earlier pages, each page starts right after the last
+(first prize year, surname, _id) tuple seen, so every page costs the same
+whatever its depth.
+
+An ascending sort on the array field "prizes.year" orders laureates by their
+smallest prize year, but an index on it is multikey and a seek predicate on it
+cannot be turned into tight index bounds. Each laureate therefore carries its
+smallest prize year as the scalar PAGE_YEAR_FIELD, added at ingest by
+page_documents() (or to documents already stored by build_page_fields()), and
+pages sort and seek on that instead, in the same order.
+"""
+import base64
+from itertools import islice
+
+from bson import json_util
+
+from mongodb_base.versioning import bump_data_version
+
+PAGE_YEAR_FIELD = "firstPrizeYear"
+PARTICLE_FILTER = {"prizes.motivation": {"$regex": "particle"}}
+PARTICLE_PROJECTION = ["firstname", "surname", "prizes"]
+PARTICLE_SORT = [(PAGE_YEAR_FIELD, 1), ("surname", 1), ("_id", 1)]
+
+
+def first_prize_year(doc):
+    years = [prize["year"] for prize in doc.get("prizes", []) if "year" in prize]
+    return min(years) if years else None
+
+
+def page_documents(collection_name, documents):
+    """
+    Lazily add the first prize year to a stream of API documents; only laureates carry it.
+    """
+    for doc in documents:
+        if collection_name == "laureates":
+            doc[PAGE_YEAR_FIELD] = first_prize_year(doc)
+        yield doc
+
+
+def build_page_fields(mongo_client):
+    """
+    (Re)compute the first prize year of the laureates already in the database, in
+    one server-side update, and return the number of documents updated.
+    """
+    db = mongo_client["nobel"]
+    result = db.laureates.update_many({}, [{"$set": {PAGE_YEAR_FIELD: {"$min": "$prizes.year"}}}])
+    bump_data_version(db, "laureates")
+    return result.modified_count
+
+
+def ensure_particle_index(mongo_client):
+    # Compound index on scalar fields matching the page sort order (and so the seek predicate)
+    db = mongo_client["nobel"]
+    return db.laureates.create_index(PARTICLE_SORT)
+
+
+def encode_token(doc):
+    """
+    Build the opaque cursor token for the page that follows `doc`.
+    """
+    key = [first_prize_year(doc), doc.get("surname"), doc["_id"]]
+    return base64.urlsafe_b64encode(json_util.dumps(key).encode()).decode()
+
+
+def decode_token(token):
+    return json_util.loads(base64.urlsafe_b64decode(token.encode()).decode())
+
+
+def _after(field, value):
+    # Missing and null values sort first, so everything non-null comes after them
+    if value is None:
+        return {field: {"$ne": None}}
+    return {field: {"$gt": value}}
+
+
+def seek_filter(token):
+    """
+    Filter for the documents sorting strictly after the key stored in `token`; every
+    branch is a range on a prefix of the page index.
+    """
+    year, surname, last_id = decode_token(token)
+    return {"$or": [
+        _after(PAGE_YEAR_FIELD, year),
+        dict({PAGE_YEAR_FIELD: year}, **_after("surname", surname)),
+        {PAGE_YEAR_FIELD: year, "surname": surname, "_id": {"$gt": last_id}},
+    ]}
+
+
+def get_particle_laureates_page(mongo_client, page_size=3, token=None):
+    """
+    Retrieve one page of particle laureates, ordered as in get_particle_laureates.
+
+    Returns the page and the token for the next one (None after the last page).
+    """
+    db = mongo_client["nobel"]
+
+    if page_size < 1 or not isinstance(page_size, int):
+        raise ValueError("Page size must be a natural number.")
+
+    criteria = dict(PARTICLE_FILTER)
+    if token is not None:
+        criteria = {"$and": [criteria, seek_filter(token)]}
+
+    page = list(
+        db.laureates.find(criteria, PARTICLE_PROJECTION)
+            .sort(PARTICLE_SORT)
+            .limit(page_size)
+    )
+    next_token = encode_token(page[-1]) if len(page) == page_size else None
+    return page, next_token
+
+
+def iter_particle_laureate_pages(mongo_client, page_size=3):
+    """
+    Bulk mode: stream every page from a single server cursor, fetching one page
+    per batch.
+    """
+    db = mongo_client["nobel"]
+
+    cursor = (
+        db.laureates.find(PARTICLE_FILTER, PARTICLE_PROJECTION, batch_size=page_size)
+            .sort(PARTICLE_SORT)
+    )
+    with cursor:
+        while True:
+            page = list(islice(cursor, page_size))
+            if not page:
+                return
+            yield page
@@ -0,0 +1,229 @@
+"""
+Partitioned parallel scans of a whole collection.
+
+A collection is split into contiguous ranges of one field (_id, or year for the
+prizes), and each range is read through its own cursor on a thread or process
+pool, so BSON decoding is spread over several cores instead of one:
+
+    Partition boundaries come from $bucketAuto over the field, or - when that is
+    too costly on a large collection - from the quantiles of a $sample, as the
+    server's splitVector does from the index.
+
+scan() maps every partition to a partial result and folds the partials together
+with a reducer. ordered_scan() yields the documents of all partitions in one
+global sort order, for consumers such as itertools.groupby that rely on it.
+
+The process pool starts its workers with "spawn"; each opens its own client
+from mongodb_base.config, and mappers must be picklable (module-level functions).
+"""
+import heapq
+import multiprocessing
+import os
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import reduce
+from itertools import groupby
+from operator import itemgetter
+
+from mongodb_base import config
+from mongodb_base.client import get_client
+from mongodb_base.domains import domain_values
+
+SAMPLE_SIZE = 1000
+
+# Documents with lower <= field < upper; a None bound is open
+Partition = namedtuple("Partition", ["field", "lower", "upper"])
+
+
+def partition_filter(partition):
+    """
+    Criteria selecting the documents of a partition. The first partition uses
+    $not/$gte so that documents missing the field, or holding values of another
+    type, are scanned exactly once.
+    """
+    field, lower, upper = partition
+    if lower is None and upper is None:
+        return {}
+    if lower is None:
+        return {field: {"$not": {"$gte": upper}}}
+    if upper is None:
+        return {field: {"$gte": lower}}
+    return {field: {"$gte": lower, "$lt": upper}}
+
+
+def bucket_auto_boundaries(db, collection, field, n_partitions, criteria=None):
+    # Inner boundaries of n roughly equal $bucketAuto buckets over the field
+    pipeline = [{"$match": criteria}] if criteria else []
+    pipeline += [{"$bucketAuto": {"groupBy": "$" + field, "buckets": n_partitions}}]
+    return [bucket["_id"]["min"] for bucket in db[collection].aggregate(pipeline)][1:]
+
+
+def sampled_boundaries(db, collection, field, n_partitions, criteria=None, sample_size=SAMPLE_SIZE):
+    # Inner boundaries at the quantiles of a random sample of the field's values
+    pipeline = [{"$match": criteria}] if criteria else []
+    pipeline += [{"$sample": {"size": sample_size}}, {"$project": {"_id": 0, "value": "$" + field}}]
+    values = sorted({doc["value"] for doc in db[collection].aggregate(pipeline) if doc.get("value") is not None})
+    return [values[len(values) * i // n_partitions] for i in range(1, n_partitions)] if values else []
+
+
+BOUNDARY_METHODS = {
+    "bucket_auto": bucket_auto_boundaries,
+    "sample": sampled_boundaries,
+}
+
+
+def partitions(db, collection, field="_id", n_partitions=None, method="bucket_auto", criteria=None):
+    """
+    Split a collection into `n_partitions` (default: one per CPU) contiguous ranges
+    of `field`, in ascending order.
+    """
+    n_partitions = n_partitions or os.cpu_count() or 1
+    if n_partitions < 2:
+        return [Partition(field, None, None)]
+    if method not in BOUNDARY_METHODS:
+        raise ValueError("Unknown boundary method: {}".format(method))
+    boundaries = sorted(set(BOUNDARY_METHODS[method](db, collection, field, n_partitions, criteria)))
+    bounds = [None] + boundaries + [None]
+    return [Partition(field, lower, upper) for lower, upper in zip(bounds, bounds[1:])]
+
+
+def _read_partition(db, collection, partition, criteria, projection, sort, batch_size):
+    condition = partition_filter(partition)
+    criteria = {"$and": [criteria, condition]} if criteria and condition else criteria or condition
+    return db[collection].find(criteria, projection, sort=sort, batch_size=batch_size or config.batch_size)
+
+
+def _scan_partition(mongo_client, collection, partition, mapper, criteria, projection, sort, batch_size):
+    db = (mongo_client or get_client())["nobel"]
+    return mapper(_read_partition(db, collection, partition, criteria, projection, sort, batch_size))
+
+
+def _executor(kind, max_workers):
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=max_workers)
+    if kind == "process":
+        # A forked child would inherit the parent's client, which is not fork-safe
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+    raise ValueError("Unknown executor: {}".format(kind))
+
+
+def _map_partitions(mongo_client, collection, mapper, parts, executor, max_workers, criteria, projection,
+                    sort, batch_size):
+    # mapper(cursor) of every partition, in partition order, with at most
+    # `max_workers` partitions in flight
+    # Worker processes cannot share the parent's client and open their own
+    worker_client = mongo_client if executor == "thread" else None
+    max_workers = max_workers or min(len(parts), os.cpu_count() or 1)
+    with _executor(executor, max_workers) as pool:
+        in_flight = deque()
+        for partition in parts:
+            in_flight.append(pool.submit(_scan_partition, worker_client, collection, partition, mapper,
+                                         criteria, projection, sort, batch_size))
+            if len(in_flight) >= max_workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def scan(mongo_client, collection, mapper, reducer, initial, field="_id", n_partitions=None,
+         method="bucket_auto", executor="thread", max_workers=None, criteria=None, projection=None,
+         batch_size=None):
+    """
+    Read `collection` (or the documents matching `criteria`) partition by partition in
+    parallel, call mapper(cursor) on each partition and fold the partial results into
+    `initial` with reducer(accumulated, partial), in partition order.
+    """
+    db = mongo_client["nobel"]
+    parts = partitions(db, collection, field, n_partitions, method, criteria)
+    partials = _map_partitions(mongo_client, collection, mapper, parts, executor, max_workers, criteria,
+                               projection, None, batch_size)
+    return reduce(reducer, partials, initial)
+
+
+def sort_key(sort):
+    """
+    Key function ordering documents as `sort` (a list of (field, direction) pairs
+    over top-level fields, all in the same direction) does.
+    """
+    return lambda doc: tuple(doc.get(field) for field, _ in sort)
+
+
+def ordered_merge(runs, sort):
+    """
+    Merge runs of documents, each already ordered by `sort`, into one ordered stream.
+    """
+    directions = {direction for _, direction in sort}
+    if len(directions) != 1:
+        raise ValueError("ordered_merge needs one direction for all sort fields: {}".format(sort))
+    return heapq.merge(*runs, key=sort_key(sort), reverse=directions == {-1})
+
+
+def ordered_scan(mongo_client, collection, sort, field=None, n_partitions=None, method="bucket_auto",
+                 executor="thread", max_workers=None, criteria=None, projection=None, batch_size=None):
+    """
+    Documents of `collection` in the global order of `sort`, read in parallel.
+
+    Partitioned on the leading sort field (the default), each partition is sorted by
+    the server and the partitions are concatenated in key order, with up to
+    `max_workers` partitions read ahead. Partitioned on another field, the sorted
+    partitions are read in full and combined with ordered_merge().
+    """
+    db = mongo_client["nobel"]
+    field = field or sort[0][0]
+    parts = partitions(db, collection, field, n_partitions, method, criteria)
+    if sort[0][0] == field and sort[0][1] == -1:
+        parts = parts[::-1]
+
+    runs = _map_partitions(mongo_client, collection, list, parts, executor, max_workers, criteria,
+                           projection, sort, batch_size)
+    if sort[0][0] == field:
+        for run in runs:
+            yield from run
+    else:
+        yield from ordered_merge(list(runs), sort)
+
+
+def _share_totals(prizes):
+    # (year, category, total share) of each prize of a partition
+    return [(prize.get("year"), prize.get("category"),
+             sum(1 / float(laureate["share"]) for laureate in prize.get("laureates", [])))
+            for prize in prizes]
+
+
+def data_validation_parallel(mongo_client, n_partitions=None, executor="thread"):
+    """
+    query_db.data_validation over a parallel scan of the prizes, by year range.
+    """
+    totals = scan(mongo_client, "prizes", _share_totals, lambda acc, partial: acc + partial, [],
+                  field="year", n_partitions=n_partitions, executor=executor,
+                  projection={"_id": 0, "year": 1, "category": 1, "laureates.share": 1})
+    for _, _, total_share in totals:
+        print(total_share)
+    return totals
+
+
+def gap_years_parallel(mongo_client, n_partitions=None, executor="thread"):
+    """
+    query_db.gap_years with the prizes read in parallel, by year range, in the same order.
+    """
+    db = mongo_client["nobel"]
+    print(domain_values(db, "original_categories"))
+    for doc in ordered_scan(mongo_client, "prizes", [("year", -1), ("category", 1)], n_partitions=n_partitions,
+                            executor=executor, projection={"year": 1, "category": 1, "_id": 0}):
+        print(doc)
+
+
+def aggregation_pipeline2_parallel(mongo_client, n_partitions=None, executor="thread"):
+    """
+    agg_pipelines.aggregation_pipeline2 with the prizes read in parallel, by year range.
+    """
+    db = mongo_client["nobel"]
+    original_categories = set(domain_values(db, "original_categories"))
+
+    cursor = ordered_scan(mongo_client, "prizes", [("year", -1)], n_partitions=n_partitions, executor=executor,
+                          criteria={"category": {"$in": sorted(original_categories)}},
+                          projection={"_id": 0, "category": 1, "year": 1})
+    for key, group in groupby(cursor, key=itemgetter("year")):
+        missing = original_categories - {doc["category"] for doc in group}
+        if missing:
+            print("{year}: {missing}".format(year=key, missing=", ".join(sorted(missing))))
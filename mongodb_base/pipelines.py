@@ -0,0 +1,632 @@
+"""
+Pipeline builder with rewrite rules, bind parameters and compiled-pipeline caching.
+
+Pipelines are built stage by stage and may hold Param placeholders where the
+hand-written versions embed literals (e.g. the result of a distinct() call):
+
+    pipeline = (Pipeline("laureates")
+                .project({"bornCountry": 1, "prizes.affiliations.country": 1})
+                .unwind("prizes")
+                .match({"prizes.affiliations.country": {"$in": Param("countries")}})
+                .count("n"))
+    compiled = pipeline.compile()
+    db.laureates.aggregate(compiled.bind(countries=[...]))
+
+compile() applies the rewrite rules until none fires:
+
+    match_pushdown    move a $match before $project/$addFields/$sort/$lookup/$unwind
+                      stages it does not depend on; a $match on an unwound path
+                      leaves a weaker copy before the $unwind as a pre-filter
+    merge_matches     combine adjacent $match stages
+    merge_projects    combine adjacent inclusion-only $project stages
+    prune_fields      project only the fields the pipeline reads, right after the
+                      leading $match, when a $group/$count discards the documents
+
+verify() explains the pipeline before and after every rewrite and reports the
+documents and keys examined and documents passed between stages, and
+compiled(name) caches the compiled pipelines of COMPILED_PIPELINES.
+"""
+import functools
+from collections import OrderedDict
+
+from bson import json_util
+
+from mongodb_base.domains import domain_values
+
+MAX_REWRITES = 50
+
+# Stages after which no document field of the input is visible any more
+_BARRIERS = ("$group", "$count", "$bucket", "$bucketAuto", "$facet", "$replaceRoot", "$replaceWith")
+_POSITIVE_OPERATORS = {"$eq", "$in", "$gt", "$gte", "$lt", "$lte", "$regex", "$options"}
+
+
+class Param:
+    """
+    Placeholder for a value supplied when a compiled pipeline is bound.
+    """
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return "Param({!r})".format(self.name)
+
+    def __eq__(self, other):
+        return isinstance(other, Param) and other.name == self.name
+
+    def __hash__(self):
+        return hash(("Param", self.name))
+
+
+def bind(node, values):
+    """
+    Copy of `node` with every Param replaced by its value.
+    """
+    if isinstance(node, Param):
+        if node.name not in values:
+            raise KeyError("Unbound pipeline parameter: {}".format(node.name))
+        return values[node.name]
+    if isinstance(node, dict):
+        return node.__class__((key, bind(value, values)) for key, value in node.items())
+    if isinstance(node, list):
+        return [bind(item, values) for item in node]
+    return node
+
+
+def parameters(node):
+    if isinstance(node, Param):
+        return {node.name}
+    if isinstance(node, dict):
+        return set().union(*(parameters(value) for value in node.values()))
+    if isinstance(node, list):
+        return set().union(*(parameters(item) for item in node))
+    return set()
+
+
+def _dumps(node):
+    return json_util.dumps(bind(node, _ParamNames()), sort_keys=True)
+
+
+class _ParamNames(dict):
+    # Bind every parameter to its own name, for fingerprints of stages
+    def __contains__(self, key):
+        return True
+
+    def __missing__(self, key):
+        return "<{}>".format(key)
+
+
+# --- field dependencies -----------------------------------------------------
+
+def _under(path, prefix):
+    return path == prefix or path.startswith(prefix + ".")
+
+
+def _overlaps(path, other):
+    return _under(path, other) or _under(other, path)
+
+
+def expression_fields(expression):
+    """
+    Field paths read by an aggregation expression; "$$ROOT" is reported as "$$ROOT".
+    """
+    if isinstance(expression, str):
+        if expression.startswith("$$"):
+            variable = expression[2:].split(".", 1)
+            return {"$$ROOT"} if variable[0] in ("ROOT", "CURRENT") else set()
+        return {expression[1:]} if expression.startswith("$") else set()
+    if isinstance(expression, dict):
+        return set().union(set(), *(expression_fields(value) for value in expression.values()))
+    if isinstance(expression, list):
+        return set().union(set(), *(expression_fields(item) for item in expression))
+    return set()
+
+
+def match_fields(criteria):
+    """
+    Field paths tested by a $match filter.
+    """
+    fields = set()
+    for key, condition in criteria.items():
+        if key in ("$and", "$or", "$nor"):
+            for clause in condition:
+                fields |= match_fields(clause)
+        elif key == "$expr":
+            fields |= expression_fields(condition)
+        elif key.startswith("$"):
+            # $text, $where, ...: depends on the whole document
+            fields.add("$$ROOT")
+        else:
+            fields.add(key)
+    return fields
+
+
+def _is_inclusion(value):
+    return value in (1, True)
+
+
+def _is_exclusion(value):
+    return value in (0, False)
+
+
+def project_outputs(spec):
+    """
+    (included paths, computed paths) of a $project stage; None for exclusion projections.
+    """
+    if any(_is_exclusion(value) for key, value in spec.items() if key != "_id"):
+        return None
+    included = {key for key, value in spec.items() if _is_inclusion(value)}
+    if not _is_exclusion(spec.get("_id", 1)):
+        included.add("_id")
+    computed = {key for key, value in spec.items() if not _is_inclusion(value) and not _is_exclusion(value)}
+    return included, computed
+
+
+def stage_reads(stage):
+    """
+    (field paths a stage reads, paths only unwound) or None for unknown stages.
+    """
+    (name, spec), = stage.items()
+    if name == "$match":
+        return match_fields(spec), set()
+    if name == "$project":
+        return set().union(*(expression_fields(value) for key, value in spec.items()
+                             if not _is_inclusion(value) and not _is_exclusion(value))), set()
+    if name in ("$addFields", "$set", "$group"):
+        return expression_fields(spec), set()
+    if name == "$unwind":
+        path = spec["path"] if isinstance(spec, dict) else spec
+        return set(), {path[1:]}
+    if name == "$sort":
+        return set(spec), set()
+    if name == "$lookup":
+        return ({spec["localField"]} if "localField" in spec else set()) | expression_fields(spec.get("let", {})), set()
+    if name in ("$limit", "$skip", "$count"):
+        return set(), set()
+    return None
+
+
+# --- rewrite rules ------------------------------------------------------------
+
+def _merge_criteria(first, second):
+    if first == second:
+        return dict(first)
+    if first.keys() & second.keys() or "$and" in first or "$and" in second:
+        return {"$and": [first, second]}
+    merged = dict(first)
+    merged.update(second)
+    return merged
+
+
+def _positive(condition):
+    # Conditions on an element that its array must also satisfy (by that element)
+    if isinstance(condition, dict):
+        if not condition or not set(condition) <= _POSITIVE_OPERATORS:
+            return False
+        values = condition.get("$in", [])
+        return (isinstance(values, Param) or None not in values) and condition.get("$eq", 0) is not None
+    return condition is not None and not isinstance(condition, (list, dict))
+
+
+def _prefilter_condition(key, path, condition):
+    """
+    A condition on `key` that documents passing `condition` after an $unwind of `path`
+    also satisfy before it, or None.
+    """
+    if not _under(key, path) or _positive(condition):
+        return condition
+    if condition == {"$ne": None} or condition == {"$exists": True}:
+        # A non-null field in the unwound element is a field present in the array
+        return {"$exists": True}
+    if isinstance(condition, dict) and set(condition) == {"$elemMatch"} and key != path:
+        return condition
+    return None
+
+
+def _can_precede(criteria, stage):
+    """
+    Whether a $match on `criteria` returns the same documents before `stage`.
+    """
+    fields = match_fields(criteria)
+    if "$$ROOT" in fields:
+        return False
+    (name, spec), = stage.items()
+    if name == "$sort":
+        return True
+    if name in ("$addFields", "$set"):
+        return not any(_overlaps(field, key) for field in fields for key in spec)
+    if name == "$project":
+        outputs = project_outputs(spec)
+        if outputs is None:
+            return not any(_overlaps(field, key) for field in fields for key in spec if key != "_id")
+        included, computed = outputs
+        return (not any(_overlaps(field, key) for field in fields for key in computed)
+                and all(any(_under(field, key) for key in included) for field in fields))
+    if name == "$lookup":
+        return not any(_overlaps(field, spec["as"]) for field in fields)
+    if name == "$unwind":
+        path = (spec["path"] if isinstance(spec, dict) else spec)[1:]
+        index_field = spec.get("includeArrayIndex") if isinstance(spec, dict) else None
+        return not any(_overlaps(field, path) or field == index_field for field in fields)
+    return False
+
+
+def match_pushdown(stages, state):
+    for i in range(1, len(stages)):
+        if "$match" not in stages[i]:
+            continue
+        criteria, previous = stages[i]["$match"], stages[i - 1]
+        if "$match" in previous:
+            continue
+        if _can_precede(criteria, previous):
+            return stages[:i - 1] + [stages[i], previous] + stages[i + 1:]
+        if "$unwind" in previous and not any(key.startswith("$") for key in criteria):
+            unwind = previous["$unwind"]
+            path = (unwind["path"] if isinstance(unwind, dict) else unwind)[1:]
+            prefilter = {key: _prefilter_condition(key, path, condition) for key, condition in criteria.items()}
+            prefilter = {key: condition for key, condition in prefilter.items() if condition is not None}
+            fingerprint = (_dumps(prefilter), path)
+            if prefilter and fingerprint not in state.setdefault("prefilters", set()):
+                state["prefilters"].add(fingerprint)
+                return stages[:i - 1] + [{"$match": prefilter}] + stages[i - 1:]
+    return None
+
+
+def merge_matches(stages, state):
+    for i in range(1, len(stages)):
+        if "$match" in stages[i] and "$match" in stages[i - 1]:
+            merged = {"$match": _merge_criteria(stages[i - 1]["$match"], stages[i]["$match"])}
+            return stages[:i - 1] + [merged] + stages[i + 1:]
+    return None
+
+
+def _pure_inclusion(spec):
+    return (any(key != "_id" for key in spec)
+            and all(_is_inclusion(value) or (key == "_id" and _is_exclusion(value)) for key, value in spec.items()))
+
+
+def merge_projects(stages, state):
+    for i in range(1, len(stages)):
+        first, second = stages[i - 1].get("$project"), stages[i].get("$project")
+        if first is None or second is None or not (_pure_inclusion(first) and _pure_inclusion(second)):
+            continue
+        first_keys = [key for key in first if key != "_id"]
+        merged = OrderedDict()
+        for key in second:
+            if key == "_id":
+                continue
+            for kept in first_keys:
+                if _under(key, kept):
+                    merged[key] = 1
+                elif _under(kept, key):
+                    merged[kept] = 1
+        if not merged:
+            continue
+        if _is_exclusion(first.get("_id", 1)) or _is_exclusion(second.get("_id", 1)):
+            merged["_id"] = 0
+        return stages[:i - 1] + [{"$project": dict(merged)}] + stages[i + 1:]
+    return None
+
+
+def required_fields(stages):
+    """
+    Source field paths the stages before the first barrier read, or None when the
+    whole document may be needed.
+    """
+    strong, weak, produced = set(), set(), set()
+    for stage in stages:
+        name = next(iter(stage))
+        if name in _BARRIERS or (name == "$project" and project_outputs(stage[name]) is not None):
+            reads = stage_reads(stage) if name in ("$group", "$count", "$project") else None
+            if reads is None:
+                return None
+            if name == "$project":
+                included, _ = project_outputs(stage[name])
+                reads = (reads[0] | included, reads[1])
+            strong |= {field for field in reads[0] if not any(_under(field, out) for out in produced)}
+            break
+        reads = stage_reads(stage)
+        if reads is None:
+            return None
+        strong |= {field for field in reads[0] if not any(_under(field, out) for out in produced)}
+        weak |= {field for field in reads[1] if not any(_under(field, out) for out in produced)}
+        if name in ("$addFields", "$set"):
+            produced |= set(stage[name])
+        elif name == "$lookup":
+            produced.add(stage[name]["as"])
+    else:
+        return None
+    if "$$ROOT" in strong:
+        return None
+
+    # Keep the shortest paths; an unwound array is needed whole only if none of its subfields is
+    fields = {field for field in strong if not any(_under(field, other) and field != other for other in strong)}
+    fields |= {path for path in weak if not any(_overlaps(path, field) for field in fields)}
+    return fields
+
+
+def prune_fields(stages, state):
+    start = 0
+    while start < len(stages) and "$match" in stages[start]:
+        start += 1
+    if start == len(stages) or "$project" in stages[start] or next(iter(stages[start])) in _BARRIERS:
+        return None
+    fields = required_fields(stages[start:])
+    if not fields:
+        return None
+    projection = {field: 1 for field in sorted(fields)}
+    if "_id" not in fields:
+        projection["_id"] = 0
+    return stages[:start] + [{"$project": projection}] + stages[start:]
+
+
+REWRITE_RULES = [
+    ("match_pushdown", match_pushdown),
+    ("merge_matches", merge_matches),
+    ("merge_projects", merge_projects),
+    ("prune_fields", prune_fields),
+]
+
+
+def optimise(stages, rules=None):
+    """
+    Apply the rewrite rules until none fires. Returns (stages, [(rule name, stages)]).
+    """
+    state, steps = {}, []
+    for _ in range(MAX_REWRITES):
+        for name, rule in rules or REWRITE_RULES:
+            rewritten = rule(stages, state)
+            if rewritten is not None:
+                stages = rewritten
+                steps.append((name, stages))
+                break
+        else:
+            break
+    return stages, steps
+
+
+# --- builder and compiled pipelines -------------------------------------------
+
+class Pipeline:
+    """
+    Fluent builder of an aggregation pipeline over one collection.
+    """
+
+    def __init__(self, collection, stages=None):
+        self.collection = collection
+        self.stages = list(stages or [])
+
+    def stage(self, name, spec):
+        if not name.startswith("$"):
+            raise ValueError("Stage names start with '$': {}".format(name))
+        self.stages.append({name: spec})
+        return self
+
+    def match(self, criteria):
+        return self.stage("$match", criteria)
+
+    def project(self, spec):
+        return self.stage("$project", spec)
+
+    def add_fields(self, spec):
+        return self.stage("$addFields", spec)
+
+    def unwind(self, path, preserve_empty=False):
+        path = path if path.startswith("$") else "$" + path
+        return self.stage("$unwind", {"path": path, "preserveNullAndEmptyArrays": True} if preserve_empty else path)
+
+    def lookup(self, source, local_field, foreign_field, as_field, pipeline=None):
+        spec = {"from": source, "localField": local_field, "foreignField": foreign_field, "as": as_field}
+        if pipeline is not None:
+            spec["pipeline"] = pipeline
+        return self.stage("$lookup", spec)
+
+    def group(self, key, **accumulators):
+        return self.stage("$group", dict({"_id": key}, **accumulators))
+
+    def sort(self, keys):
+        return self.stage("$sort", OrderedDict(keys))
+
+    def limit(self, n):
+        return self.stage("$limit", n)
+
+    def count(self, field):
+        return self.stage("$count", field)
+
+    def compile(self, optimise_stages=True):
+        return CompiledPipeline(self.collection, self.stages, optimise_stages)
+
+
+class CompiledPipeline:
+    """
+    An optimised pipeline with its rewrite history, bound to parameters per run.
+    """
+
+    def __init__(self, collection, stages, optimise_stages=True):
+        self.collection = collection
+        self.original = list(stages)
+        self.stages, self.steps = optimise(self.original) if optimise_stages else (self.original, [])
+        self.parameters = parameters(self.original)
+
+    @property
+    def rewrites(self):
+        return [name for name, _ in self.steps]
+
+    def bind(self, **values):
+        missing = self.parameters - values.keys()
+        if missing:
+            raise KeyError("Unbound pipeline parameters: {}".format(", ".join(sorted(missing))))
+        return bind(self.stages, values)
+
+    def aggregate(self, db, **values):
+        return db[self.collection].aggregate(self.bind(**values))
+
+
+def stage_documents(explain_output):
+    """
+    Documents passed between the stages of an explained aggregation.
+    """
+    return sum(stage.get("nReturned", 0) for stage in explain_output.get("stages", []))
+
+
+def _explain_work(db, collection, stages):
+    # Imported here: the advisor builds its catalogue from COMPILED_PIPELINES
+    from mongodb_base.advisor import execution_summary
+
+    output = db.command("explain", {"aggregate": collection, "pipeline": stages, "cursor": {}},
+                        verbosity="executionStats")
+    summary = execution_summary(output)
+    return {"docs_examined": summary["docs_examined"], "keys_examined": summary["keys_examined"],
+            "stage_documents": stage_documents(output)}
+
+
+def verify(mongo_client, compiled_pipeline, **values):
+    """
+    Explain the original pipeline and the pipeline after each rewrite, and check the
+    rewritten pipeline returns the same documents. Returns the report.
+    """
+    db = mongo_client["nobel"]
+    collection = compiled_pipeline.collection
+
+    original = bind(compiled_pipeline.original, values)
+    before = _explain_work(db, collection, original)
+    steps = [dict(rule=name, **_explain_work(db, collection, bind(stages, values)))
+             for name, stages in compiled_pipeline.steps]
+    after = steps[-1] if steps else dict(rule=None, **before)
+
+    def result(stages):
+        return sorted(json_util.dumps(doc, sort_keys=True) for doc in db[collection].aggregate(stages))
+
+    report = {
+        "before": before,
+        "steps": steps,
+        "saved": {key: before[key] - after[key] for key in before},
+        "same_result": result(original) == result(compiled_pipeline.bind(**values)),
+    }
+    for step in steps:
+        print("{rule}: docs examined {docs_examined}, keys examined {keys_examined}, "
+              "stage documents {stage_documents}".format(**step))
+    print("saved: {}, same result: {}".format(report["saved"], report["same_result"]))
+    return report
+
+
+# --- the agg_pipelines reports ----------------------------------------------------
+# The one definition of each report's pipeline: agg_pipelines, streaming and views
+# all run compiled(name)
+
+_AFFILIATION_COUNTRY = "prizes.affiliations.country"
+
+
+def _laureate_countries_pipeline():
+    return (Pipeline("laureates")
+            .match({"gender": {"$ne": "org"}})
+            .project({"_id": 0, "bornCountry": 1, _AFFILIATION_COUNTRY: 1})
+            .limit(Param("limit")))
+
+
+def _original_categories_pipeline():
+    return (Pipeline("prizes")
+            .match({"category": {"$in": Param("categories")}})
+            .project({"category": 1, "year": 1})
+            .sort([("year", -1)]))
+
+
+def _org_prizes_pipeline():
+    return (Pipeline("laureates")
+            .match({"gender": "org"})
+            .project({"n_prizes": {"$size": "$prizes"}})
+            .group(None, n_prizes_total={"$sum": "$n_prizes"}))
+
+
+def _gap_years_pipeline():
+    # One document per year with missing original categories: {"_id": year, "missing": [...]};
+    # the leading $match, which an index on category can serve, leaves out later categories
+    # (economics) before anything is grouped
+    return (Pipeline("prizes")
+            .match({"category": {"$in": Param("categories")}})
+            .project({"category": 1, "year": 1})
+            .group("$year", categories={"$addToSet": "$category"})
+            .project({"missing": {"$setDifference": [Param("categories"), "$categories"]}})
+            .match({"missing.0": {"$exists": True}})
+            .sort([("_id", -1)]))
+
+
+def _affiliation_born_pipeline():
+    # Prize affiliations in (True) or outside (False) the laureate's country of birth. The
+    # leading $match keeps laureates with some affiliation country (unaffiliated prizes hold
+    # [[]]) before anything is unwound; the one after the $unwinds keeps a single affiliation
+    # country per document
+    return (Pipeline("laureates")
+            .match({_AFFILIATION_COUNTRY: {"$exists": True}})
+            .unwind("prizes")
+            .unwind("prizes.affiliations")
+            .match({_AFFILIATION_COUNTRY: {"$ne": None}})
+            .project({"affilCountrySameAsBorn": {"$gte": [{"$indexOfBytes": [
+                "$" + _AFFILIATION_COUNTRY, "$bornCountry"]}, 0]}})
+            .group("$affilCountrySameAsBorn", count={"$sum": 1}))
+
+
+def _born_countries_pipeline():
+    # Distinct countries of birth of each category's laureates, through a $lookup
+    return (Pipeline("prizes")
+            .unwind("laureates")
+            .lookup("laureates", "laureates.id", "id", "laureate_bios")
+            .unwind("laureate_bios")
+            .project({"category": 1, "bornCountry": "$laureate_bios.bornCountry"})
+            .group("$category", bornCountries={"$addToSet": "$bornCountry"})
+            .project({"category": 1, "nBornCountries": {"$size": "$bornCountries"}})
+            .sort([("nBornCountries", -1)]))
+
+
+def _awarded_elsewhere_pipeline(affiliated_only=False):
+    # Prizes of people without an affiliation in their country of birth; `affiliated_only`
+    # leaves out prizes without any affiliation country
+    pipeline = (Pipeline("laureates")
+                .match({"gender": {"$ne": "org"}})
+                .project({"bornCountry": 1, _AFFILIATION_COUNTRY: 1})
+                .unwind("prizes"))
+    if affiliated_only:
+        pipeline.match({"prizes.affiliations": {"$elemMatch": {"country": {"$ne": None}}}})
+    return (pipeline
+            .add_fields({"bornCountryInAffiliations": {"$in": ["$bornCountry", "$" + _AFFILIATION_COUNTRY]}})
+            .match({"bornCountryInAffiliations": False})
+            .count("awardedElsewhere"))
+
+
+COMPILED_PIPELINES = {
+    "aggregation_pipeline": _laureate_countries_pipeline,
+    "aggregation_pipeline2": _original_categories_pipeline,
+    "aggregation_pipeline3": _org_prizes_pipeline,
+    "gap_years_aggregated": _gap_years_pipeline,
+    "aggregation_pipeline4": _affiliation_born_pipeline,
+    "aggregation_pipeline5": _born_countries_pipeline,
+    "aggregation_pipeline6": _awarded_elsewhere_pipeline,
+    "aggregation_pipeline7": functools.partial(_awarded_elsewhere_pipeline, affiliated_only=True),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def compiled(name):
+    """
+    The compiled (optimised) pipeline of one of the agg_pipelines reports, built once.
+    """
+    return COMPILED_PIPELINES[name]().compile()
+
+
+def verify_all(mongo_client, parameter_values=None):
+    """
+    verify() every compiled report; `parameter_values` maps a report name to the
+    values of its parameters (by default taken from the value domains).
+    """
+    if parameter_values is None:
+        categories = domain_values(mongo_client["nobel"], "original_categories")
+        parameter_values = {"aggregation_pipeline": {"limit": 3},
+                            "aggregation_pipeline2": {"categories": categories},
+                            "gap_years_aggregated": {"categories": categories}}
+
+    report = {}
+    for name in COMPILED_PIPELINES:
+        print("{} ({})".format(name, ", ".join(compiled(name).rewrites) or "no rewrites"))
+        report[name] = verify(mongo_client, compiled(name), **parameter_values.get(name, {}))
+    return report
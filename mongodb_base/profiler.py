@@ -0,0 +1,237 @@
+"""
+Schema and field-statistics profiler.
+
+A single find_one() shows the fields of one document; profile() reads a $sample
+of a collection (or all of it) and reports, per dotted field path:
+
+    presence      share of the profiled documents that have the path
+    types         BSON types of the values found there, array elements included
+    arrayLengths  min/max/mean and histogram of the lengths of array values
+    distinct      approximate number of distinct scalar values (HyperLogLog)
+
+Arrays are transparent in paths, as in queries: the country of an affiliation
+of a laureate's prize is "prizes.affiliations.country".
+
+profile_collections() profiles several collections in parallel. Profiles are
+stored in the "schema_profiles" collection with the data version they were
+computed at and reused until that version moves on (see mongodb_base.versioning).
+Full scans can be split further into partitions read in parallel (see
+mongodb_base.parallel).
+"""
+import hashlib
+import math
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from mongodb_base import config, parallel
+from mongodb_base.versioning import data_version
+
+PROFILES_COLLECTION = "schema_profiles"
+SAMPLE_SIZE = 1000
+
+
+class HyperLogLog:
+    """
+    Distinct-count sketch of 2 ** precision registers (relative error about
+    1.04 / sqrt(2 ** precision), 1.6% at the default).
+    """
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        digest = hashlib.blake2b(repr((type(value).__name__, value)).encode("utf-8"), digest_size=8).digest()
+        bits = int.from_bytes(digest, "big")
+        index = bits >> (64 - self.precision)
+        rest = bits & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction: linear counting
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class FieldStats:
+    """
+    Running statistics of the field paths of a stream of documents; partial
+    statistics (of partitions, say) combine with merge().
+    """
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.documents = 0
+        self.presence = Counter()
+        self.types = {}
+        self.array_lengths = {}
+        self.sketches = {}
+
+    def _value(self, path, value, seen):
+        self.types.setdefault(path, Counter())[_type_name(value)] += 1
+        if isinstance(value, dict):
+            for key, item in value.items():
+                seen.add(path + "." + key)
+                self._value(path + "." + key, item, seen)
+        elif isinstance(value, list):
+            self.array_lengths.setdefault(path, Counter())[len(value)] += 1
+            for item in value:
+                self._value(path, item, seen)
+        else:
+            if path not in self.sketches:
+                self.sketches[path] = HyperLogLog(self.precision)
+            self.sketches[path].add(value)
+
+    def add(self, doc):
+        # Paths present in this document, counted once however many values they hold
+        seen = set(doc)
+        for key, value in doc.items():
+            self._value(key, value, seen)
+        self.presence.update(seen)
+        self.documents += 1
+
+    def merge(self, other):
+        self.documents += other.documents
+        self.presence.update(other.presence)
+        for path, types in other.types.items():
+            self.types.setdefault(path, Counter()).update(types)
+        for path, lengths in other.array_lengths.items():
+            self.array_lengths.setdefault(path, Counter()).update(lengths)
+        for path, sketch in other.sketches.items():
+            if path in self.sketches:
+                self.sketches[path].merge(sketch)
+            else:
+                self.sketches[path] = sketch
+        return self
+
+    def fields(self):
+        """
+        Per-path statistics, sorted by path.
+        """
+        fields = []
+        for path in sorted(self.types):
+            field = {
+                "path": path,
+                "presence": self.presence[path] / self.documents if self.documents else 0.0,
+                "types": dict(self.types[path].most_common()),
+                "distinct": self.sketches[path].count() if path in self.sketches else None,
+            }
+            lengths = self.array_lengths.get(path)
+            if lengths:
+                n_arrays = sum(lengths.values())
+                field["arrayLengths"] = {
+                    "min": min(lengths), "max": max(lengths),
+                    "mean": sum(length * n for length, n in lengths.items()) / n_arrays,
+                    # Keys are strings so that the profile can be stored as a document
+                    "histogram": {str(length): n for length, n in sorted(lengths.items())},
+                }
+            fields.append(field)
+        return fields
+
+
+_TYPE_NAMES = {dict: "object", list: "array", str: "string", bool: "bool", int: "int", float: "double",
+               type(None): "null"}
+
+
+def _type_name(value):
+    return _TYPE_NAMES.get(type(value)) or type(value).__name__
+
+
+def _profile_documents(documents, precision=12):
+    stats = FieldStats(precision)
+    for doc in documents:
+        stats.add(doc)
+    return stats
+
+
+def _profile_partition(documents):
+    # parallel.scan mapper; module-level so that process pools can pickle it
+    return _profile_documents(documents)
+
+
+def compute_profile(mongo_client, collection_name, sample_size=SAMPLE_SIZE, full_scan=False, n_partitions=1,
+                    executor="thread"):
+    """
+    Profile one collection from a $sample of `sample_size` documents, or from all
+    of its documents with `full_scan` (over `n_partitions` partitions read in parallel).
+    """
+    db = mongo_client["nobel"]
+    version = data_version(db, collection_name)
+    start = time.perf_counter()
+    if not full_scan:
+        stats = _profile_documents(db[collection_name].aggregate([{"$sample": {"size": sample_size}}]))
+    elif n_partitions > 1:
+        stats = parallel.scan(mongo_client, collection_name, _profile_partition, FieldStats.merge, FieldStats(),
+                              n_partitions=n_partitions, executor=executor)
+    else:
+        stats = _profile_documents(db[collection_name].find({}, batch_size=config.batch_size))
+
+    return {
+        "_id": profile_id(collection_name, sample_size, full_scan),
+        "collection": collection_name,
+        "mode": "full" if full_scan else "sample",
+        "documents": stats.documents,
+        "estimatedTotal": db[collection_name].estimated_document_count(),
+        "dataVersion": version,
+        "profiledAt": time.time(),
+        "durationMs": (time.perf_counter() - start) * 1000,
+        "fields": stats.fields(),
+    }
+
+
+def profile_id(collection_name, sample_size=SAMPLE_SIZE, full_scan=False):
+    return "{}:{}".format(collection_name, "full" if full_scan else "sample{}".format(sample_size))
+
+
+def profile(mongo_client, collection_name, sample_size=SAMPLE_SIZE, full_scan=False, n_partitions=1,
+            executor="thread", refresh=False):
+    """
+    The profile of a collection, from the profiles collection while it matches the
+    collection's data version and computed (and stored) otherwise.
+    """
+    db = mongo_client["nobel"]
+    if not refresh:
+        stored = db[PROFILES_COLLECTION].find_one({"_id": profile_id(collection_name, sample_size, full_scan)})
+        if stored is not None and stored["dataVersion"] == data_version(db, collection_name):
+            return stored
+    result = compute_profile(mongo_client, collection_name, sample_size, full_scan, n_partitions, executor)
+    db[PROFILES_COLLECTION].replace_one({"_id": result["_id"]}, result, upsert=True)
+    return result
+
+
+def profile_collections(mongo_client, collection_names=("prizes", "laureates"), max_workers=None, **options):
+    """
+    Profile several collections in parallel; `options` are passed on to profile().
+    """
+    with ThreadPoolExecutor(max_workers=max_workers or len(collection_names)) as executor:
+        futures = {name: executor.submit(profile, mongo_client, name, **options) for name in collection_names}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def document_structure(mongo_client, collection_name="laureates", **options):
+    """
+    Print the field paths of a collection with their presence, types, array lengths
+    and approximate distinct counts.
+    """
+    result = profile(mongo_client, collection_name, **options)
+    print("{collection}: {documents} of ~{estimatedTotal} documents ({mode})".format(**result))
+    for field in result["fields"]:
+        line = "  {path}: {presence:.1%} {types}".format(**field)
+        if field["distinct"] is not None:
+            line += ", ~{distinct} distinct".format(**field)
+        if "arrayLengths" in field:
+            line += ", length {min}-{max} (mean {mean:.2f})".format(**field["arrayLengths"])
+        print(line)
+    return result
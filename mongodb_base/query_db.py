@@ -2,6 +2,9 @@ from bson import Regex
 from operator import itemgetter
 from pprint import pprint
 
+from mongodb_base.pagination import get_particle_laureates_page
+from mongodb_base.validation import dumps_report, validate
+
 
 def filter_non_operator(mongo_client):
     db = mongo_client["nobel"]
@@ -227,10 +230,18 @@ def mongodb_projections(mongo_client):
     print(full_names)
 
 
-def data_validation(mongo_client):
+def data_validation(mongo_client, server_side=False, tolerance=1e-6):
     """
     check that for each prize, all the shares of all the laureates add up to 1!
+
+    With server_side=True the reciprocal sums are computed in an aggregation and only
+    the prizes that fail the check are reported (see mongodb_base.validation).
     """
+    if server_side:
+        report = validate(mongo_client, rules=["share_totals"], tolerance=tolerance)
+        print(dumps_report(report))
+        return report
+
     db = mongo_client["nobel"]
 
     # Save documents, projecting out laureates share
@@ -359,9 +370,15 @@ def get_particle_laureates(mongo_client, page_number=1, page_size=3):
     return particle_laureates
 
 
-def get_particle_pages():
+def get_particle_pages(mongo_client):
     """
     """
-    # Collect and save the first nine pages
-    pages = [get_particle_laureates(page_number=page) for page in range(1, 9)]
+    # Collect and save the first eight pages, each one seeking past the last laureate
+    # of the page before instead of skipping over all earlier pages
+    pages, token = [], None
+    for _ in range(8):
+        page, token = get_particle_laureates_page(mongo_client, token=token)
+        pages.append(page)
+        if token is None:
+            break
     pprint(pages[0])
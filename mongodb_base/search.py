@@ -0,0 +1,238 @@
+"""
+Index-backed prefix and substring search over laureate names, countries and
+prize motivations.
+
+Unanchored regexes (Regex("Germany"), {"$regex": "particle"}) cannot use index
+bounds, so every laureate is scanned. Each laureate instead carries a derived
+`search` sub-document, written at ingest or by build_search_fields():
+
+    search.firstname, search.surname, search.bornCountry   lower-cased values
+    search.bornCountryGrams, search.motivationGrams        lower-cased trigrams
+    search.motivationTokens                                lower-cased words
+
+A prefix search is an anchored regex on the lower-cased field (an index range
+scan), and a substring search requires all trigrams of the substring ($all over a
+multikey index). A whole-word search of the motivations is an equality match on
+the word in search.motivationTokens. All recheck the original regex on the fetched documents, so
+results are exactly those of the regex queries in query_db.
+"""
+import re
+
+from bson import Regex
+from pymongo import UpdateOne
+
+from mongodb_base.advisor import QuerySpec, execution_summary, explain, winning_plan_stages
+from mongodb_base.versioning import bump_data_version
+
+GRAM_SIZE = 3
+
+SEARCH_INDEXES = [
+    [("search.firstname", 1), ("search.surname", 1)],
+    [("search.bornCountry", 1)],
+    [("search.bornCountryGrams", 1)],
+    [("search.motivationGrams", 1)],
+    [("search.motivationTokens", 1)],
+]
+
+
+def fold(value):
+    return (value or "").lower()
+
+
+def tokens(text):
+    return sorted(set(re.findall(r"\w+", fold(text))))
+
+
+def ngrams(text, n=GRAM_SIZE):
+    text = fold(text)
+    return sorted({text[i:i + n] for i in range(len(text) - n + 1)})
+
+
+def search_fields(doc):
+    """
+    Derived search fields of a laureate document.
+    """
+    motivations = [prize.get("motivation", "") for prize in doc.get("prizes", [])]
+    return {
+        "firstname": fold(doc.get("firstname")),
+        "surname": fold(doc.get("surname")),
+        "bornCountry": fold(doc.get("bornCountry")),
+        "bornCountryGrams": ngrams(doc.get("bornCountry")),
+        "motivationGrams": sorted({gram for motivation in motivations for gram in ngrams(motivation)}),
+        "motivationTokens": tokens(" ".join(motivations)),
+    }
+
+
+def search_documents(collection_name, documents):
+    """
+    Lazily add the search fields to a stream of API documents; only laureates carry them.
+    """
+    for doc in documents:
+        if collection_name == "laureates":
+            doc["search"] = search_fields(doc)
+        yield doc
+
+
+def build_search_fields(mongo_client, batch_size=1000):
+    """
+    (Re)compute the search fields of the laureates already in the database and
+    return the number of documents updated.
+    """
+    db = mongo_client["nobel"]
+    projection = ["firstname", "surname", "bornCountry", "prizes.motivation"]
+
+    requests, n_modified = [], 0
+    for doc in db.laureates.find({}, projection, batch_size=batch_size):
+        requests.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"search": search_fields(doc)}}))
+        if len(requests) == batch_size:
+            n_modified += db.laureates.bulk_write(requests, ordered=False).modified_count
+            requests = []
+    if requests:
+        n_modified += db.laureates.bulk_write(requests, ordered=False).modified_count
+    bump_data_version(db, "laureates")
+    return n_modified
+
+
+def ensure_search_indexes(mongo_client):
+    db = mongo_client["nobel"]
+    return [db.laureates.create_index(keys) for keys in SEARCH_INDEXES]
+
+
+def prefix_filter(field, prefix):
+    """
+    Filter for values of `field` starting with `prefix` (case-sensitive), bounded by the
+    lower-cased search field.
+    """
+    return {"search." + field: Regex("^" + re.escape(fold(prefix))),
+            field: Regex("^" + re.escape(prefix))}
+
+
+def substring_filter(field, substring, pattern=None, grams_field=None):
+    """
+    Filter for values of `field` containing `substring`, bounded by the trigram index.
+    `pattern` is the regex rechecked on the original field (by default the substring
+    itself); `grams_field` names the trigram field when it is not "<field>Grams".
+    """
+    grams_field = grams_field or field.rsplit(".", 1)[-1] + "Grams"
+    criteria = {field: Regex(pattern or re.escape(substring))}
+    grams = ngrams(substring)
+    if grams:
+        # Substrings shorter than a trigram cannot be narrowed down by the index
+        criteria["search." + grams_field] = {"$all": grams}
+    return criteria
+
+
+def motivation_filter(substring):
+    return substring_filter("prizes.motivation", substring, grams_field="motivationGrams")
+
+
+def motivation_word_filter(word):
+    """
+    Filter for motivations containing `word` as a whole word (in any case), bounded by
+    the motivation token index.
+    """
+    return {"search.motivationTokens": fold(word),
+            "prizes.motivation": Regex(r"\b" + re.escape(word) + r"\b", "i")}
+
+
+def mongodb_regex_search(mongo_client):
+    """
+    query_db.mongodb_regex over the search indexes.
+    """
+    db = mongo_client["nobel"]
+    count = db.laureates.count_documents(dict(prefix_filter("firstname", "G"), **prefix_filter("surname", "S")))
+    print(count)
+
+    # "Germany" anywhere in "bornCountry"
+    print(set(db.laureates.distinct("bornCountry", substring_filter("bornCountry", "Germany"))))
+
+    # "bornCountry" starting with "Germany"
+    print(set(db.laureates.distinct("bornCountry", prefix_filter("bornCountry", "Germany"))))
+
+    # "bornCountry" starting with "Germany (now"
+    print(set(db.laureates.distinct("bornCountry", prefix_filter("bornCountry", "Germany (now"))))
+
+    # "bornCountry" ending with "now Germany)"
+    criteria = substring_filter("bornCountry", "now Germany)", pattern=re.escape("now Germany)") + "$")
+    print(set(db.laureates.distinct("bornCountry", criteria)))
+
+
+def mongodb_projections_search(mongo_client):
+    """
+    query_db.mongodb_projections over the search indexes.
+    """
+    db = mongo_client["nobel"]
+    docs = db.laureates.find(
+        filter=dict(prefix_filter("firstname", "G"), **prefix_filter("surname", "S")),
+        projection=["firstname", "surname"])
+    full_names = [doc["firstname"] + " " + doc["surname"] for doc in docs]
+    print(full_names)
+
+
+def get_particle_laureates_search(mongo_client, page_number=1, page_size=3):
+    """
+    query_db.get_particle_laureates over the motivation trigram index.
+    """
+    db = mongo_client["nobel"]
+
+    if page_number < 1 or not isinstance(page_number, int):
+        raise ValueError("Pages are natural numbers (starting from 1).")
+    return list(
+        db.laureates.find(motivation_filter("particle"), ["firstname", "surname", "prizes"])
+        .sort([("prizes.year", 1), ("surname", 1)])
+        .skip(page_size * (page_number - 1))
+        .limit(page_size)
+    )
+
+
+def get_motivation_word_laureates_search(mongo_client, word, page_number=1, page_size=3):
+    """
+    get_particle_laureates_search for a whole word, over the motivation token index.
+    """
+    db = mongo_client["nobel"]
+
+    if page_number < 1 or not isinstance(page_number, int):
+        raise ValueError("Pages are natural numbers (starting from 1).")
+    return list(
+        db.laureates.find(motivation_word_filter(word), ["firstname", "surname", "prizes"])
+        .sort([("prizes.year", 1), ("surname", 1)])
+        .skip(page_size * (page_number - 1))
+        .limit(page_size)
+    )
+
+
+# (regex query, search-backed query) pairs reported by explain_search
+SEARCH_COMPARISONS = [
+    (QuerySpec("mongodb_regex.g_s", "laureates", {"firstname": Regex("^G"), "surname": Regex("^S")}),
+     QuerySpec("mongodb_regex_search.g_s", "laureates",
+               dict(prefix_filter("firstname", "G"), **prefix_filter("surname", "S")))),
+    (QuerySpec("mongodb_regex.germany", "laureates", {"bornCountry": Regex("Germany")}),
+     QuerySpec("mongodb_regex_search.germany", "laureates", substring_filter("bornCountry", "Germany"))),
+    (QuerySpec("get_particle_laureates", "laureates", {"prizes.motivation": {"$regex": "particle"}},
+               sort=[("prizes.year", 1), ("surname", 1)]),
+     QuerySpec("get_particle_laureates_search", "laureates", motivation_filter("particle"),
+               sort=[("prizes.year", 1), ("surname", 1)])),
+    (QuerySpec("get_particle_laureates.word", "laureates", {"prizes.motivation": {"$regex": r"\bparticle\b"}},
+               sort=[("prizes.year", 1), ("surname", 1)]),
+     QuerySpec("get_motivation_word_laureates_search", "laureates", motivation_word_filter("particle"),
+               sort=[("prizes.year", 1), ("surname", 1)])),
+]
+
+
+def explain_search(mongo_client, comparisons=None):
+    """
+    Explain each regex query next to its search-backed variant and report the winning
+    plan stages and documents examined of both.
+    """
+    db = mongo_client["nobel"]
+
+    report = []
+    for original, searched in comparisons or SEARCH_COMPARISONS:
+        for spec in (original, searched):
+            output = explain(db, spec)
+            entry = {"name": spec.name, "stages": winning_plan_stages(output)}
+            entry.update(execution_summary(output))
+            report.append(entry)
+            print("{name}: {stages} docs examined {docs_examined}, keys examined {keys_examined}, "
+                  "returned {n_returned}".format(**entry))
+    return report
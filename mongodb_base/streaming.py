@@ -0,0 +1,236 @@
+"""
+Streaming counterparts of the query_db and agg_pipelines reports.
+
+Each iter_* function is a generator yielding the report's rows lazily from a
+cursor fetched `batch_size` documents at a time (config.batch_size by default).
+Projections carry only the fields a row is built from and limits run on the
+server. Rows can be written to a sink without ever holding the result in memory:
+
+    with JsonLinesSink("gap_years.jsonl") as sink:
+        drain(iter_gap_years(get_client()), sink)
+"""
+import csv
+from itertools import groupby
+from operator import itemgetter
+
+from bson import json_util
+
+from mongodb_base import config
+from mongodb_base.domains import domain_values
+from mongodb_base.pagination import PARTICLE_FILTER, PARTICLE_PROJECTION, PARTICLE_SORT
+from mongodb_base.pipelines import compiled
+from mongodb_base.query_db import all_laureates
+
+
+def _batch_size(batch_size):
+    return batch_size or config.batch_size
+
+
+def _aggregate(mongo_client, name, batch_size=None, **values):
+    # Cursor over a compiled agg_pipelines report
+    pipeline = compiled(name)
+    return mongo_client["nobel"][pipeline.collection].aggregate(pipeline.bind(**values),
+                                                                batchSize=_batch_size(batch_size))
+
+
+# --- query_db -------------------------------------------------------------------
+
+def iter_mongodb_projections(mongo_client, batch_size=None):
+    # Full names of laureates with first name starting with "G" and surname with "S"
+    db = mongo_client["nobel"]
+    cursor = db.laureates.find({"firstname": {"$regex": "^G"}, "surname": {"$regex": "^S"}},
+                               {"_id": 0, "firstname": 1, "surname": 1}, batch_size=_batch_size(batch_size))
+    for doc in cursor:
+        yield {"full_name": doc["firstname"] + " " + doc["surname"]}
+
+
+def iter_data_validation(mongo_client, batch_size=None):
+    # Total share of each prize
+    db = mongo_client["nobel"]
+    cursor = db.prizes.find({}, {"_id": 0, "year": 1, "category": 1, "laureates.share": 1},
+                            batch_size=_batch_size(batch_size))
+    for prize in cursor:
+        yield {"year": prize.get("year"), "category": prize.get("category"),
+               "total_share": sum(1 / float(laureate["share"]) for laureate in prize.get("laureates", []))}
+
+
+def iter_mongodb_sorting(mongo_client, limit=5, batch_size=None):
+    db = mongo_client["nobel"]
+    yield from db.laureates.find(
+        {"born": {"$gte": "1900"}, "prizes.year": {"$gte": "1954"}},
+        {"born": 1, "prizes.year": 1, "_id": 0},
+        sort=[("prizes.year", 1), ("born", -1)], limit=limit, batch_size=_batch_size(batch_size))
+
+
+def iter_sort_projection(mongo_client, batch_size=None):
+    # Physics prizes by year with the names of their laureates (see all_laureates_sorted)
+    db = mongo_client["nobel"]
+    cursor = db.prizes.find({"category": "physics"}, {"_id": 0, "year": 1, "laureates.surname": 1},
+                            sort=[("year", 1)], batch_size=_batch_size(batch_size))
+    for doc in cursor:
+        yield {"year": doc["year"], "names": all_laureates(doc)}
+
+
+def iter_gap_years(mongo_client, batch_size=None):
+    db = mongo_client["nobel"]
+    yield from db.prizes.find({}, {"year": 1, "category": 1, "_id": 0},
+                              sort=[("year", -1), ("category", 1)], batch_size=_batch_size(batch_size))
+
+
+def iter_filter_projection_sort_limit(mongo_client, limit=5, batch_size=None):
+    db = mongo_client["nobel"]
+    yield from db.prizes.find({"laureates.share": "4"}, ["category", "year", "laureates.motivation"],
+                              sort=[("year", 1)], limit=limit, batch_size=_batch_size(batch_size))
+
+
+def iter_particle_laureates(mongo_client, limit=None, batch_size=None):
+    # All particle laureates in page order, however many pages they span
+    db = mongo_client["nobel"]
+    yield from db.laureates.find(PARTICLE_FILTER, PARTICLE_PROJECTION, sort=PARTICLE_SORT,
+                                 limit=limit or 0, batch_size=_batch_size(batch_size))
+
+
+# --- agg_pipelines --------------------------------------------------------------
+
+def iter_aggregation_pipeline(mongo_client, limit=3, batch_size=None):
+    yield from _aggregate(mongo_client, "aggregation_pipeline", batch_size, limit=limit)
+
+
+def iter_aggregation_pipeline2(mongo_client, batch_size=None):
+    # Years with missing original categories, newest first
+    categories = domain_values(mongo_client["nobel"], "original_categories")
+    cursor = _aggregate(mongo_client, "aggregation_pipeline2", batch_size, categories=categories)
+    for year, group in groupby(cursor, key=itemgetter("year")):
+        missing = set(categories) - {doc["category"] for doc in group}
+        if missing:
+            yield {"year": year, "missing": sorted(missing)}
+
+
+def iter_aggregation_pipeline3(mongo_client, batch_size=None):
+    yield from _aggregate(mongo_client, "aggregation_pipeline3", batch_size)
+
+
+def iter_gap_years_aggregated(mongo_client, batch_size=None):
+    categories = domain_values(mongo_client["nobel"], "original_categories")
+    for doc in _aggregate(mongo_client, "gap_years_aggregated", batch_size, categories=categories):
+        yield {"year": doc["_id"], "missing": sorted(doc["missing"])}
+
+
+def iter_aggregation_pipeline4(mongo_client, batch_size=None):
+    yield from _aggregate(mongo_client, "aggregation_pipeline4", batch_size)
+
+
+def iter_aggregation_pipeline5(mongo_client, batch_size=None):
+    yield from _aggregate(mongo_client, "aggregation_pipeline5", batch_size)
+
+
+def iter_aggregation_pipeline6(mongo_client, batch_size=None):
+    yield from _aggregate(mongo_client, "aggregation_pipeline6", batch_size)
+
+
+def iter_aggregation_pipeline7(mongo_client, batch_size=None):
+    yield from _aggregate(mongo_client, "aggregation_pipeline7", batch_size)
+
+
+STREAMING_COUNTERPARTS = {
+    "mongodb_projections": iter_mongodb_projections,
+    "data_validation": iter_data_validation,
+    "mongodb_sorting": iter_mongodb_sorting,
+    "sort_projection": iter_sort_projection,
+    "gap_years": iter_gap_years,
+    "filter_projection_sort_limit": iter_filter_projection_sort_limit,
+    "get_particle_laureates": iter_particle_laureates,
+    "aggregation_pipeline": iter_aggregation_pipeline,
+    "aggregation_pipeline2": iter_aggregation_pipeline2,
+    "aggregation_pipeline3": iter_aggregation_pipeline3,
+    "gap_years_aggregated": iter_gap_years_aggregated,
+    "aggregation_pipeline4": iter_aggregation_pipeline4,
+    "aggregation_pipeline5": iter_aggregation_pipeline5,
+    "aggregation_pipeline6": iter_aggregation_pipeline6,
+    "aggregation_pipeline7": iter_aggregation_pipeline7,
+}
+
+
+# --- sinks ----------------------------------------------------------------------
+
+class _FileSink:
+    # Write to an open text file, or to a path opened (and closed) by the sink
+    def __init__(self, target):
+        self._owned = isinstance(target, str)
+        self._fp = open(target, "w", newline="") if self._owned else target
+        self.rows = 0
+
+    def close(self):
+        if self._owned:
+            self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class JsonLinesSink(_FileSink):
+    """
+    One extended-JSON document per line.
+    """
+
+    def write(self, row):
+        self._fp.write(json_util.dumps(row) + "\n")
+        self.rows += 1
+
+
+class CsvSink(_FileSink):
+    """
+    CSV with a header row; columns are `fields` or the keys of the first row, and
+    nested values are written as JSON.
+    """
+
+    def __init__(self, target, fields=None):
+        super().__init__(target)
+        self.fields = fields
+        self._writer = None
+
+    def write(self, row):
+        if self._writer is None:
+            self.fields = self.fields or list(row)
+            self._writer = csv.DictWriter(self._fp, self.fields, extrasaction="ignore")
+            self._writer.writeheader()
+        self._writer.writerow({field: json_util.dumps(value) if isinstance(value, (dict, list)) else value
+                               for field, value in row.items()})
+        self.rows += 1
+
+
+class CallbackSink:
+    """
+    Hand each row to `callback`.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.rows = 0
+
+    def write(self, row):
+        self.callback(row)
+        self.rows += 1
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def drain(rows, sink):
+    """
+    Write every row of a stream to `sink` and return the number of rows written.
+    """
+    n_rows = 0
+    for row in rows:
+        sink.write(row)
+        n_rows += 1
+    return n_rows
@@ -0,0 +1,346 @@
+"""
+Incremental sync of the Nobel collections with the API.
+
+Instead of re-inserting both payloads on every run, sync_collections():
+
+    * fetches each payload with a conditional request (If-None-Match /
+      If-Modified-Since) against a local gzip-compressed response cache, so an
+      unchanged payload costs one 304 and, if the collection has not changed
+      locally since the last sync, no database work at all;
+    * diffs the payload against the stored documents by natural key ("id" for
+      laureates, (year, category) for prizes) and a hash of each API document
+      kept in SOURCE_HASH_FIELD;
+    * writes only the differences, as batched upserts and deletes, after removing
+      duplicate documents left behind by earlier full reloads, stamping every
+      written document with the sync time in SYNCED_AT_FIELD, and ensures unique
+      indexes on the natural keys.
+
+Replacements carry the derived fields of mongodb_base.normalise and
+mongodb_base.search when asked to, and by default whenever the collection
+already has them: the enrichments each sync applied are recorded with the
+cached payload, and the stored documents are checked for the derived fields
+themselves.
+
+`source` replaces the live API: a URL template like API_URL (for instance the
+local stand-in started by serve_fixtures()), or a fixture directory holding
+prize.json and laureate.json.
+"""
+import datetime
+import email.utils
+import gzip
+import hashlib
+import json
+import os
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+
+import requests
+from pymongo import DeleteOne, ReplaceOne
+
+from mongodb_base import config
+from mongodb_base.create_db import API_URL
+from mongodb_base.domains import refresh_domains
+from mongodb_base.normalise import normalise_documents
+from mongodb_base.pagination import page_documents
+from mongodb_base.search import search_documents
+from mongodb_base.versioning import bump_data_version, data_version
+
+NATURAL_KEYS = {
+    "laureates": ("id",),
+    "prizes": ("year", "category"),
+}
+SOURCE_HASH_FIELD = "sourceHash"
+# Time of the sync that last inserted or updated a document (see mongodb_base.export)
+SYNCED_AT_FIELD = "syncedAt"
+# A derived field of each enrichment, per collection it applies to
+ENRICHMENT_FIELDS = {
+    "normalise": {"prizes": "yearInt", "laureates": "prizes.yearInt"},
+    "search": {"laureates": "search"},
+}
+
+
+def natural_key(collection_name, doc):
+    return tuple(doc.get(field) for field in NATURAL_KEYS[collection_name])
+
+
+def source_hash(doc):
+    # Hash of an API document as delivered, before any derived fields are added
+    return hashlib.sha1(json.dumps(doc, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Last payload of each collection, gzip-compressed, with the validators
+    (ETag, Last-Modified) it was served with and the data version it was synced at.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or config.sync_cache_dir
+
+    def _path(self, collection_name, suffix):
+        return os.path.join(self.directory, collection_name + suffix)
+
+    def meta(self, collection_name):
+        try:
+            with open(self._path(collection_name, ".meta.json")) as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            return {}
+
+    def update_meta(self, collection_name, **values):
+        os.makedirs(self.directory, exist_ok=True)
+        meta = dict(self.meta(collection_name), **values)
+        with open(self._path(collection_name, ".meta.json"), "w") as fp:
+            json.dump(meta, fp)
+        return meta
+
+    def body(self, collection_name):
+        with gzip.open(self._path(collection_name, ".json.gz"), "rb") as fp:
+            return fp.read()
+
+    def store(self, collection_name, body, **meta):
+        os.makedirs(self.directory, exist_ok=True)
+        with gzip.open(self._path(collection_name, ".json.gz"), "wb") as fp:
+            fp.write(body)
+        return self.update_meta(collection_name, **meta)
+
+
+def fetch(collection_name, source=None, cache=None, session=None):
+    """
+    The API documents of one collection and the fetch status: "fetched", or
+    "not_modified" when the server answered a conditional request with 304 and
+    the cached payload was used, or "fixture" for a fixture directory.
+    """
+    source = source or API_URL
+    cache = cache or ResponseCache()
+
+    if not source.startswith(("http://", "https://")):
+        with open(os.path.join(source, collection_name[:-1] + ".json"), "rb") as fp:
+            return json.loads(fp.read())[collection_name], "fixture"
+
+    meta = cache.meta(collection_name)
+    headers = {"Accept-Encoding": "gzip"}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("lastModified"):
+        headers["If-Modified-Since"] = meta["lastModified"]
+
+    response = (session or requests).get(source.format(collection_name[:-1]), headers=headers)
+    if response.status_code == 304:
+        return json.loads(cache.body(collection_name))[collection_name], "not_modified"
+    response.raise_for_status()
+    cache.store(collection_name, response.content, etag=response.headers.get("ETag"),
+                lastModified=response.headers.get("Last-Modified"))
+    return response.json()[collection_name], "fetched"
+
+
+def ensure_natural_key_indexes(mongo_client):
+    """
+    Unique indexes on the natural keys; a non-unique index on the same keys (such
+    as the one joins.ensure_join_indexes creates) is replaced.
+    """
+    db = mongo_client["nobel"]
+    names = {}
+    for collection_name, fields in NATURAL_KEYS.items():
+        keys = [(field, 1) for field in fields]
+        for name, info in db[collection_name].index_information().items():
+            if [tuple(key) for key in info["key"]] == keys and not info.get("unique"):
+                db[collection_name].drop_index(name)
+        names[collection_name] = db[collection_name].create_index(keys, unique=True)
+    return names
+
+
+def _batches(operations, batch_size):
+    operations = iter(operations)
+    while True:
+        batch = list(islice(operations, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def enrichments(db, collection_name, meta):
+    """
+    The enrichments the stored documents of a collection carry: those the last sync
+    applied and those whose derived fields a stored document has (such as after
+    normalise_collections() or build_search_fields()).
+    """
+    recorded = meta.get("enrichments", {})
+    return {name: bool(recorded.get(name)) or collection_name in fields
+            and db[collection_name].find_one({fields[collection_name]: {"$exists": True}}, {"_id": 1}) is not None
+            for name, fields in ENRICHMENT_FIELDS.items()}
+
+
+def diff(collection_name, stored, documents):
+    """
+    Compare the API documents with the stored (_id, natural key, source hash)
+    entries. Returns the documents to upsert (new or changed) with the filter that
+    selects them (the _id of the stored document kept for the key, or the natural key
+    for new documents), the _ids to delete (documents gone from the API and
+    duplicates of a natural key) and counts.
+    """
+    stored_by_key, duplicates = {}, []
+    for doc in stored:
+        key = natural_key(collection_name, doc)
+        if key in stored_by_key:
+            duplicates.append(doc["_id"])
+        else:
+            stored_by_key[key] = doc
+
+    # The last occurrence of a key in the payload wins
+    incoming = {natural_key(collection_name, doc): doc for doc in documents}
+
+    upserts, n_inserted, n_unchanged = [], 0, 0
+    for key, doc in incoming.items():
+        digest = source_hash(doc)
+        current = stored_by_key.get(key)
+        if current is None:
+            n_inserted += 1
+        elif current.get(SOURCE_HASH_FIELD) == digest:
+            n_unchanged += 1
+            continue
+        if current is not None:
+            criteria = {"_id": current["_id"]}
+        else:
+            criteria = dict(zip(NATURAL_KEYS[collection_name], key))
+        upserts.append((criteria, dict(doc, **{SOURCE_HASH_FIELD: digest})))
+
+    gone = [doc["_id"] for key, doc in stored_by_key.items() if key not in incoming]
+    counts = {"inserted": n_inserted, "updated": len(upserts) - n_inserted, "unchanged": n_unchanged,
+              "deleted": len(gone), "duplicates": len(duplicates)}
+    return upserts, duplicates + gone, counts
+
+
+def sync_collection(mongo_client, collection_name, source=None, cache=None, batch_size=1000, normalise=None,
+                    search=None, views=None, force=False, session=None):
+    """
+    Bring one collection in line with its API payload; returns the fetch status, the
+    number of documents inserted, updated, deleted, left unchanged and removed as
+    duplicates, and the number of write operations. `normalise` and `search` default
+    to the enrichments the collection already carries.
+    """
+    db = mongo_client["nobel"]
+    cache = cache or ResponseCache()
+    collection = db[collection_name]
+
+    documents, status = fetch(collection_name, source, cache, session)
+    meta = cache.meta(collection_name)
+    if status == "not_modified" and not force and meta.get("dataVersion") == data_version(db, collection_name):
+        return {"status": status}
+
+    applied = enrichments(db, collection_name, meta)
+    normalise = applied.get("normalise", False) if normalise is None else normalise
+    search = applied.get("search", False) if search is None else search
+
+    fields = dict.fromkeys(NATURAL_KEYS[collection_name], 1)
+    stored = list(collection.find({}, dict(fields, **{SOURCE_HASH_FIELD: 1})))
+    upserts, deletes, counts = diff(collection_name, stored, documents)
+
+    filters = [criteria for criteria, _ in upserts]
+    replacements = [doc for _, doc in upserts]
+    if views is not None:
+        if deletes or counts["updated"]:
+            # The partitions deleted or replaced documents belonged to are unknown here
+            views.record(collection_name, None)
+        replacements = views.track(collection_name, replacements)
+    if normalise:
+        replacements = normalise_documents(collection_name, replacements)
+    if search:
+        replacements = search_documents(collection_name, replacements)
+    replacements = page_documents(collection_name, replacements)
+    synced_at = datetime.datetime.now(datetime.timezone.utc)
+    replacements = [dict(doc, **{SYNCED_AT_FIELD: synced_at}) for doc in replacements]
+
+    # Deletes go first, in bulks of their own: an unordered bulk may apply them after
+    # the replacements
+    deletions = [DeleteOne({"_id": _id}) for _id in deletes]
+    replaces = [ReplaceOne(criteria, doc, upsert=True) for criteria, doc in zip(filters, replacements)]
+    for batch in _batches(deletions, batch_size):
+        collection.bulk_write(batch, ordered=False)
+    for batch in _batches(replaces, batch_size):
+        collection.bulk_write(batch, ordered=False)
+
+    operations = deletions + replaces
+    if operations:
+        bump_data_version(db, collection_name)
+    cache.update_meta(collection_name, dataVersion=data_version(db, collection_name),
+                      enrichments={"normalise": bool(normalise), "search": bool(search)})
+    return dict(counts, status=status, written=len(operations))
+
+
+def sync_collections(mongo_client, source=None, cache_dir=None, batch_size=1000, normalise=None, search=None,
+                     views=None, force=False):
+    """
+    Incremental counterpart of create_db.create_db_collections; see the module
+    docstring. Returns the sync report of each collection.
+    """
+    cache = ResponseCache(cache_dir)
+    report = {}
+    with requests.Session() as session:
+        for collection_name in ['prizes', 'laureates']:
+            report[collection_name] = sync_collection(
+                mongo_client, collection_name, source, cache, batch_size, normalise, search, views, force, session)
+            print("{}: {}".format(collection_name, report[collection_name]))
+    # Duplicates are gone now, so the unique indexes can be built
+    ensure_natural_key_indexes(mongo_client)
+
+    if any(entry.get("written") for entry in report.values()):
+        refresh_domains(mongo_client)
+    if views is not None:
+        views.refresh_pending()
+    return report
+
+
+class _FixtureHandler(SimpleHTTPRequestHandler):
+    # Serves /v1/<name>.json from the fixture directory with ETag/Last-Modified
+    # validators, 304 answers to conditional requests and gzip content encoding
+
+    def do_GET(self):
+        path = os.path.join(self.directory, os.path.basename(self.path))
+        try:
+            with open(path, "rb") as fp:
+                body = fp.read()
+        except FileNotFoundError:
+            self.send_error(404)
+            return
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        last_modified = email.utils.formatdate(int(os.path.getmtime(path)), usegmt=True)
+
+        since = self.headers.get("If-Modified-Since")
+        unmodified = (self.headers.get("If-None-Match") == etag if self.headers.get("If-None-Match")
+                      else since is not None and email.utils.parsedate_to_datetime(since).timestamp()
+                      >= int(os.path.getmtime(path)))
+        if unmodified:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_fixtures(directory, port=0):
+    """
+    Start a local stand-in for the API serving prize.json and laureate.json from
+    `directory` on a background thread. Returns the server; its `url` attribute is
+    a URL template to pass as `source`, and shutdown() stops it.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), partial(_FixtureHandler, directory=directory))
+    server.url = "http://127.0.0.1:{}/v1/{{}}.json".format(server.server_address[1])
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,237 @@
+"""
+Deterministic synthetic Nobel data shaped like the nobelprize.org v1 API payloads.
+
+A scale of 1 produces roughly the size of the real dataset (one "edition" of
+prizes for 1901-2019). Larger scales add further editions that repeat the same
+years and categories with new laureates, so every query in the project keeps
+its selectivity while result sizes grow linearly with the scale.
+
+Synthetic data goes to a scratch database (config.bench_db_name), never to
+"nobel": ScratchClient points the code that reads mongo_client["nobel"] at it.
+"""
+import random
+
+from mongodb_base import config
+from mongodb_base.create_db import insert_batches
+from mongodb_base.domains import refresh_domains
+from mongodb_base.pagination import page_documents
+from mongodb_base.versioning import bump_data_version
+
+FIRST_YEAR = 1901
+LAST_YEAR = 2019
+CATEGORIES = ["chemistry", "literature", "medicine", "peace", "physics"]
+ECONOMICS_FIRST_YEAR = 1969
+
+FIRST_NAMES = [
+    "Albert", "Marie", "Niels", "Gerhard", "Gertrude", "Georg", "Max", "Ernest", "Dorothy",
+    "Enrico", "Linus", "Richard", "Barbara", "Hans", "Otto", "Gustav", "Rita", "Ada", "Wolfgang",
+    "Paul", "Frances", "Carl", "Emil", "Toni", "Kazuo", "Amartya", "Wangari", "Svante", "Jean",
+]
+SURNAMES = [
+    "Einstein", "Curie", "Bohr", "Herzberg", "Elion", "Stigler", "Planck", "Rutherford", "Hodgkin",
+    "Fermi", "Pauling", "Feynman", "McClintock", "Bethe", "Hahn", "Hertz", "Levi-Montalcini",
+    "Yonath", "Pauli", "Dirac", "Arnold", "Bosch", "Fischer", "Morrison", "Ishiguro", "Sen",
+    "Maathai", "Arrhenius", "Perrin", "Schmidt", "Smith", "Sato", "Garcia", "Novak",
+]
+ORGANISATIONS = [
+    "Institute of International Law", "International Committee of the Red Cross",
+    "Amnesty International", "United Nations Children's Fund", "Medecins Sans Frontieres",
+]
+# (country as recorded at birth, current country, country code)
+COUNTRIES = [
+    ("USA", "USA", "US"), ("Germany", "Germany", "DE"), ("Prussia (now Germany)", "Germany", "DE"),
+    ("United Kingdom", "United Kingdom", "GB"), ("France", "France", "FR"), ("Sweden", "Sweden", "SE"),
+    ("Austria", "Austria", "AT"), ("Austria-Hungary (now Czech Republic)", "Czech Republic", "CZ"),
+    ("Russia", "Russia", "RU"), ("Japan", "Japan", "JP"), ("Italy", "Italy", "IT"),
+    ("Netherlands", "Netherlands", "NL"), ("Switzerland", "Switzerland", "CH"),
+    ("Canada", "Canada", "CA"), ("India", "India", "IN"), ("Poland", "Poland", "PL"),
+    ("Germany (now Poland)", "Poland", "PL"), ("Mexico", "Mexico", "MX"), ("Denmark", "Denmark", "DK"),
+]
+COUNTRY_CODES = {country: code for _, country, code in COUNTRIES}
+CITIES = ["Berlin", "Paris", "London", "Stockholm", "Vienna", "New York, NY", "Tokyo", "Rome", "Zurich"]
+INSTITUTIONS = ["University", "Institute of Technology", "Research Institute", "Medical School"]
+MOTIVATION_TERMS = [
+    "the discovery of", "investigations of", "the theory of", "contributions to", "work on",
+    "particle physics", "elementary particles", "radioactivity", "enzymes", "quantum mechanics",
+    "peace", "poetry", "the structure of", "neutrinos", "antiparticles", "economic analysis",
+]
+# Share patterns by number of laureates of a prize
+SHARES = {1: [["1"]], 2: [["2", "2"]], 3: [["3", "3", "3"], ["2", "4", "4"]]}
+
+
+def _date(rng, year):
+    if rng.random() < 0.03:
+        # Partially known dates are recorded with zero month and day
+        return "{:04d}-00-00".format(year)
+    return "{:04d}-{:02d}-{:02d}".format(year, rng.randint(1, 12), rng.randint(1, 28))
+
+
+def _motivation(rng):
+    return '"for {} {}"'.format(rng.choice(MOTIVATION_TERMS), rng.choice(MOTIVATION_TERMS))
+
+
+def _person(rng, laureate_id, year):
+    born_country, died_country, code = rng.choice(COUNTRIES)
+    born_year = year - rng.randint(30, 80)
+    person = {
+        "id": str(laureate_id),
+        "firstname": rng.choice(FIRST_NAMES),
+        "surname": rng.choice(SURNAMES),
+        "born": _date(rng, born_year),
+        "died": "0000-00-00",
+        "bornCountry": born_country,
+        "bornCountryCode": code,
+        "bornCity": rng.choice(CITIES),
+        "gender": "female" if rng.random() < 0.1 else "male",
+        "prizes": [],
+    }
+    died_year = born_year + rng.randint(50, 100)
+    if died_year < 2020:
+        person["died"] = _date(rng, died_year)
+        person["diedCountry"] = died_country if rng.random() < 0.5 else rng.choice(COUNTRIES)[1]
+        person["diedCountryCode"] = COUNTRY_CODES[person["diedCountry"]]
+        person["diedCity"] = rng.choice(CITIES)
+    return person
+
+
+def _organisation(rng, laureate_id):
+    return {
+        "id": str(laureate_id),
+        "firstname": rng.choice(ORGANISATIONS),
+        "born": "0000-00-00",
+        "died": "0000-00-00",
+        "gender": "org",
+        "prizes": [],
+    }
+
+
+def _affiliations(rng, category, born_country):
+    if category in ("literature", "peace") or rng.random() < 0.05:
+        # Unaffiliated laureates carry a list holding one empty list
+        return [[]]
+    affiliations = []
+    for _ in range(rng.choice([1, 1, 1, 2])):
+        country = born_country if born_country and rng.random() < 0.5 else rng.choice(COUNTRIES)[1]
+        affiliations.append({
+            "name": "{} {}".format(rng.choice(CITIES).split(",")[0], rng.choice(INSTITUTIONS)),
+            "city": rng.choice(CITIES),
+            "country": country,
+        })
+    return affiliations
+
+
+def generate_edition(rng, first_id):
+    """
+    Generate one edition of prizes and laureates, with laureate ids starting at `first_id`.
+    """
+    prizes, laureates, people = [], [], []
+    next_id = first_id
+
+    for year in range(FIRST_YEAR, LAST_YEAR + 1):
+        categories = CATEGORIES + (["economics"] if year >= ECONOMICS_FIRST_YEAR else [])
+        for category in categories:
+            if rng.random() < 0.04:
+                # Not awarded this year
+                continue
+
+            prize = {"year": str(year), "category": category}
+            if category == "literature":
+                n_laureates = 1
+            elif category == "peace":
+                n_laureates = rng.choice([1, 1, 1, 1, 2, 3])
+            else:
+                n_laureates = rng.choice([1, 1, 2, 3])
+            shares = rng.choice(SHARES[n_laureates])
+            prize["laureates"] = []
+            for share in shares:
+                if people and rng.random() < 0.02:
+                    # A repeat winner
+                    laureate = rng.choice(people)
+                else:
+                    if category == "peace" and rng.random() < 0.25:
+                        laureate = _organisation(rng, next_id)
+                    else:
+                        laureate = _person(rng, next_id, year)
+                        people.append(laureate)
+                    laureates.append(laureate)
+                    next_id += 1
+
+                motivation = _motivation(rng)
+                laureate["prizes"].append({
+                    "year": str(year),
+                    "category": category,
+                    "share": share,
+                    "motivation": motivation,
+                    "affiliations": _affiliations(rng, category, laureate.get("bornCountry")),
+                })
+                entry = {"id": laureate["id"], "firstname": laureate["firstname"],
+                         "motivation": motivation, "share": share}
+                if "surname" in laureate:
+                    entry["surname"] = laureate["surname"]
+                prize["laureates"].append(entry)
+            prizes.append(prize)
+
+    return prizes, laureates
+
+
+def iter_editions(scale=1, seed=0):
+    """
+    Yield (prizes, laureates) for each of the `scale` editions, deterministically for a seed.
+    """
+    rng = random.Random(seed)
+    next_id = 1
+    for _ in range(scale):
+        prizes, laureates = generate_edition(rng, next_id)
+        next_id += len(laureates)
+        yield prizes, laureates
+
+
+def generate(scale=1, seed=0):
+    """
+    Return all synthetic (prizes, laureates) documents for a scale as two lists.
+    """
+    all_prizes, all_laureates = [], []
+    for prizes, laureates in iter_editions(scale, seed):
+        all_prizes += prizes
+        all_laureates += laureates
+    return all_prizes, all_laureates
+
+
+class ScratchClient:
+    """
+    MongoClient stand-in whose "nobel" database is the scratch database `db_name`.
+    """
+
+    def __init__(self, mongo_client, db_name=None):
+        self._client = mongo_client
+        self.db_name = db_name or config.bench_db_name
+
+    def __getitem__(self, name):
+        return self._client[self.db_name if name == "nobel" else name]
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def load_synthetic(mongo_client, scale=1, seed=0, db_name=None, drop=True, batch_size=1000):
+    """
+    Load synthetic data into the scratch database `db_name` (config.bench_db_name
+    by default) one edition at a time and return the document counts per collection.
+    """
+    db_name = db_name or config.bench_db_name
+    if db_name == "nobel":
+        raise ValueError("Synthetic data is never loaded into the nobel database")
+    db = mongo_client[db_name]
+    if drop:
+        db.prizes.drop()
+        db.laureates.drop()
+
+    counts = {"prizes": 0, "laureates": 0}
+    for prizes, laureates in iter_editions(scale, seed):
+        counts["prizes"] += insert_batches(db.prizes, prizes, batch_size)
+        counts["laureates"] += insert_batches(db.laureates, page_documents("laureates", laureates), batch_size)
+
+    for collection_name in counts:
+        bump_data_version(db, collection_name)
+    refresh_domains(ScratchClient(mongo_client, db_name))
+    return counts
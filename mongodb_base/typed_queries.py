@@ -0,0 +1,110 @@
+"""
+Variants of the query_db and agg_pipelines queries over the typed fields added by
+mongodb_base.normalise. Numbers and dates compare as such on the server, so range
+filters get tight index bounds and share/date arithmetic runs in the pipeline.
+"""
+from collections import OrderedDict
+from datetime import datetime
+
+TYPED_INDEXES = {
+    "laureates": [
+        [("bornDate", 1)],
+        [("gender", 1), ("prizes.yearInt", 1)],
+        [("prizes.category", 1), ("prizes.yearInt", 1), ("prizes.shareInt", 1)],
+    ],
+    "prizes": [
+        [("category", 1), ("yearInt", -1)],
+    ],
+}
+
+
+def ensure_typed_indexes(mongo_client):
+    db = mongo_client["nobel"]
+    return {collection_name: [db[collection_name].create_index(keys) for keys in indexes]
+            for collection_name, indexes in TYPED_INDEXES.items()}
+
+
+def born_before_typed(mongo_client, year=1900):
+    """
+    Number of laureates with recorded dates of birth earlier than `year`.
+    """
+    db = mongo_client["nobel"]
+    count = db.laureates.count_documents({"bornDate": {"$lt": datetime(year, 1, 1)}})
+    print(count)
+    return count
+
+
+def comparision_operator_typed(mongo_client):
+    db = mongo_client["nobel"]
+
+    # Organization laureates with prizes won before / in or after 1945
+    n_before = db.laureates.count_documents({"gender": "org", "prizes.yearInt": {"$lt": 1945}})
+    n_in_or_after = db.laureates.count_documents({"gender": "org", "prizes.yearInt": {"$gte": 1945}})
+    ratio = n_in_or_after / (n_in_or_after + n_before)
+    print(ratio)
+    return ratio
+
+
+def element_match_ratio_typed(mongo_client):
+    """
+    Unshared/shared ratio of post-war prizes outside physics, chemistry and medicine.
+    """
+    db = mongo_client["nobel"]
+
+    def prizes_after_1945(share):
+        return {"prizes": {"$elemMatch": {
+            "category": {"$nin": ["physics", "chemistry", "medicine"]},
+            "shareInt": share,
+            "yearInt": {"$gte": 1945},
+        }}}
+
+    ratio = (db.laureates.count_documents(prizes_after_1945(1)) /
+             db.laureates.count_documents(prizes_after_1945({"$gt": 1})))
+    print(ratio)
+    return ratio
+
+
+def mongodb_sorting_typed(mongo_client, limit=5):
+    db = mongo_client["nobel"]
+
+    docs = db.laureates.find(
+        {"bornDate": {"$gte": datetime(1900, 1, 1)}, "prizes.yearInt": {"$gte": 1954}},
+        {"born": 1, "prizes.year": 1, "_id": 0},
+        sort=[("prizes.yearInt", 1), ("bornDate", -1)],
+        limit=limit)
+    for doc in docs:
+        print(doc)
+
+
+def data_validation_typed(mongo_client):
+    """
+    Total share of each prize, summed on the server from the Decimal128 share
+    fractions (1/3 three times sums to 0.99...9 to 34 digits, not a float near 1).
+    """
+    db = mongo_client["nobel"]
+
+    pipeline = [
+        {"$project": {"_id": 0, "year": 1, "category": 1, "total_share": {"$sum": "$laureates.shareFraction"}}},
+    ]
+    for doc in db.prizes.aggregate(pipeline):
+        print(doc["total_share"])
+
+
+def age_at_award_typed(mongo_client):
+    """
+    Average age of laureates in the year of their award, by prize category.
+    """
+    db = mongo_client["nobel"]
+
+    pipeline = [
+        {"$match": {"bornDate": {"$exists": True}}},
+        {"$project": {"bornDate": 1, "prizes.category": 1, "prizes.yearInt": 1}},
+        {"$unwind": "$prizes"},
+        {"$group": {"_id": "$prizes.category",
+                    "averageAge": {"$avg": {"$subtract": ["$prizes.yearInt", {"$year": "$bornDate"}]}}}},
+        {"$sort": OrderedDict([("_id", 1)])},
+    ]
+    results = list(db.laureates.aggregate(pipeline))
+    for doc in results:
+        print("{_id}: {averageAge:.1f}".format(**doc))
+    return results
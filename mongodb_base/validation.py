@@ -0,0 +1,113 @@
+"""
+Server-side integrity checks of the Nobel collections.
+
+Each rule is an aggregation that yields only the offending documents, so a check
+moves a handful of rows over the wire instead of the whole collection. Rules are
+ValidationRule entries of RULES; register_rule() adds further ones:
+
+    register_rule(ValidationRule("unknown_gender", "laureates", lambda **options: [
+        {"$match": {"gender": {"$nin": ["male", "female", "org"]}}},
+        {"$project": {"id": 1, "gender": 1}}]))
+
+validate() runs the rules and returns a compact report:
+
+    {"ok": false, "rules": {"share_totals": {"violations": 2, "examples": [...]}, ...}}
+"""
+from collections import namedtuple
+
+from bson import json_util
+
+# `pipeline` is a callable taking the validation options and returning the stages
+ValidationRule = namedtuple("ValidationRule", ["name", "collection", "pipeline", "description"])
+ValidationRule.__new__.__defaults__ = ("",)
+
+
+def share_totals_pipeline(tolerance=1e-6, **options):
+    """
+    Prizes whose laureates' shares (the prize is split 1/share) do not add up to 1.
+    """
+    reciprocal = {"$divide": [1, {"$ifNull": ["$$laureate.shareInt", {"$toDouble": "$$laureate.share"}]}]}
+    return [
+        # Prizes that were not awarded have no laureates to check
+        {"$match": {"laureates.0": {"$exists": True}}},
+        {"$project": {"_id": 0, "year": 1, "category": 1, "total_share": {"$sum": {"$map": {
+            "input": "$laureates", "as": "laureate", "in": reciprocal}}}}},
+        {"$match": {"$expr": {"$gt": [{"$abs": {"$subtract": ["$total_share", 1]}}, tolerance]}}},
+    ]
+
+
+def missing_laureates_pipeline(**options):
+    """
+    Laureates listed on a prize with no document of that id in `laureates`.
+    """
+    return [
+        {"$project": {"_id": 0, "year": 1, "category": 1, "laureates.id": 1}},
+        {"$unwind": "$laureates"},
+        {"$lookup": {"from": "laureates", "localField": "laureates.id", "foreignField": "id",
+                     "as": "matches"}},
+        {"$match": {"matches": {"$size": 0}}},
+        {"$project": {"year": 1, "category": 1, "laureate_id": "$laureates.id"}},
+    ]
+
+
+def duplicate_laureates_pipeline(**options):
+    """
+    Laureate ids held by more than one document.
+    """
+    return [
+        {"$group": {"_id": "$id", "n_documents": {"$sum": 1}}},
+        {"$match": {"n_documents": {"$gt": 1}}},
+        {"$project": {"_id": 0, "laureate_id": "$_id", "n_documents": 1}},
+    ]
+
+
+RULES = [
+    ValidationRule("share_totals", "prizes", share_totals_pipeline,
+                   "shares of a prize's laureates do not add up to 1"),
+    ValidationRule("missing_laureates", "prizes", missing_laureates_pipeline,
+                   "prize lists a laureate id missing from laureates"),
+    ValidationRule("duplicate_laureates", "laureates", duplicate_laureates_pipeline,
+                   "laureate id stored in more than one document"),
+]
+
+
+def register_rule(rule):
+    """
+    Add a rule to RULES, replacing any rule of the same name.
+    """
+    RULES[:] = [existing for existing in RULES if existing.name != rule.name] + [rule]
+    return rule
+
+
+def run_rule(db, rule, max_examples=10, **options):
+    """
+    Count the violations of one rule and fetch up to `max_examples` of them, in one
+    round trip.
+    """
+    pipeline = rule.pipeline(**options) + [
+        {"$facet": {"count": [{"$count": "n"}], "examples": [{"$limit": max_examples}]}}]
+    result = next(db[rule.collection].aggregate(pipeline))
+    violations = result["count"][0]["n"] if result["count"] else 0
+    return {"violations": violations, "examples": result["examples"]}
+
+
+def validate(mongo_client, rules=None, max_examples=10, **options):
+    """
+    Run the validation rules (all of RULES by default, or those named in `rules`) and
+    return the report. Options such as `tolerance` are passed on to every rule.
+    """
+    db = mongo_client["nobel"]
+    selected = [rule for rule in RULES if rules is None or rule.name in rules]
+
+    report = {"ok": True, "rules": {}}
+    for rule in selected:
+        report["rules"][rule.name] = run_rule(db, rule, max_examples, **options)
+        report["ok"] = report["ok"] and not report["rules"][rule.name]["violations"]
+    return report
+
+
+def dumps_report(report):
+    """
+    Compact JSON of a validation report.
+    """
+    return json_util.dumps(report, separators=(",", ":"))
@@ -0,0 +1,23 @@
+"""
+Per-collection data versions, bumped by the ingest path whenever a collection's
+contents change so that derived results (caches, views, ...) know they are stale.
+"""
+from pymongo import ReturnDocument
+
+VERSIONS_COLLECTION = "data_versions"
+
+
+def data_version(db, collection_name):
+    doc = db[VERSIONS_COLLECTION].find_one({"_id": collection_name})
+    return doc["version"] if doc else 0
+
+
+def bump_data_version(db, collection_name):
+    # Atomically increment (or create) the version and return the new value
+    doc = db[VERSIONS_COLLECTION].find_one_and_update(
+        {"_id": collection_name},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return doc["version"]
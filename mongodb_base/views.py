@@ -0,0 +1,290 @@
+"""
+Materialized views of the expensive aggregation reports.
+
+Each View's pipeline output is written into its own collection ("view_<name>")
+with $merge, so readers get a small keyed collection instead of running the
+pipeline. Views with a partition field (the source field that becomes the view's
+_id) are refreshed incrementally: only the partitions touched by changed source
+documents are recomputed, and stale rows of those partitions are removed. Views
+without one are recomputed in full.
+
+Changes reach a ViewRegistry in two ways:
+
+    * as an ingest hook: the loaders in create_db accept `views=registry`, pass
+      every document through registry.track() and call registry.refresh_pending();
+    * from a change stream (replica sets only): registry.watch() follows writes to
+      the source collections, resuming from the last stored token. On MongoDB 6.0+
+      it enables pre-images on them, so that updates and deletes only refresh the
+      partitions the documents belonged to; on older servers they force a full
+      refresh of the dependent views.
+
+Per view, the "view_metadata" collection records when and how it was last
+refreshed and the source data versions it reflects; staleness() compares those
+with the current versions (see mongodb_base.versioning).
+"""
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from pymongo.errors import OperationFailure
+
+from mongodb_base.domains import DOMAINS_COLLECTION, domain_values
+from mongodb_base.pipelines import compiled
+from mongodb_base.versioning import data_version
+
+METADATA_COLLECTION = "view_metadata"
+CHANGE_STREAM_ID = "$change_stream"
+REFRESH_FIELD = "_refresh"
+
+# `pipeline` builds the stages from the database; `partition_keys` maps each source
+# collection to a function returning the partitions a changed document belongs to
+View = namedtuple("View", ["name", "source", "pipeline", "depends_on", "partition_field", "partition_keys",
+                           "sort"])
+View.__new__.__defaults__ = (None, None, None)
+
+
+def _prize_categories(laureate):
+    return {prize["category"] for prize in laureate.get("prizes", []) if "category" in prize}
+
+
+def _gap_years_stages(db):
+    return compiled("gap_years_aggregated").bind(categories=domain_values(db, "original_categories"))
+
+
+VIEWS = [
+    # The original categories are read from the value domains, refreshed after the prizes
+    View("gap_years", "prizes", _gap_years_stages, ("prizes", DOMAINS_COLLECTION),
+         partition_field="year", partition_keys={"prizes": lambda prize: [prize.get("year")]},
+         sort=[("_id", -1)]),
+    View("born_countries", "prizes", lambda db: compiled("aggregation_pipeline5").bind(), ("prizes", "laureates"),
+         partition_field="category",
+         partition_keys={"prizes": lambda prize: [prize.get("category")], "laureates": _prize_categories},
+         sort=[("nBornCountries", -1)]),
+    # A two-row global rollup: every change touches both rows, so it is always refreshed in full
+    View("affiliation_born", "laureates", lambda db: compiled("aggregation_pipeline4").bind(), ("laureates",)),
+]
+
+
+def target_name(view):
+    return "view_" + view.name
+
+
+def _strip_sort(stages):
+    # A trailing $sort is pointless before $merge; readers sort the view instead
+    while stages and "$sort" in stages[-1]:
+        stages = stages[:-1]
+    return stages
+
+
+class ViewRegistry:
+    """
+    Refresh, track and read the materialized views of one client.
+    """
+
+    def __init__(self, mongo_client, views=None):
+        self.db = mongo_client["nobel"]
+        self.views = {view.name: view for view in (views or VIEWS)}
+        self._lock = threading.Lock()
+        # view name -> set of partitions to recompute, or None for a full refresh
+        self._pending = {}
+
+    def register(self, view):
+        self.views[view.name] = view
+        return view
+
+    def _mark(self, view, keys):
+        with self._lock:
+            if keys is None or view.partition_field is None:
+                self._pending[view.name] = None
+            elif self._pending.get(view.name, set()) is not None:
+                self._pending.setdefault(view.name, set()).update(key for key in keys if key is not None)
+
+    def record(self, collection_name, doc):
+        """
+        Note that `doc` of `collection_name` changed; None stands for an unknown document
+        (e.g. a delete without a pre-image) and forces a full refresh of dependent views.
+        """
+        for view in self.views.values():
+            if collection_name not in view.depends_on:
+                continue
+            if doc is None or not view.partition_keys or collection_name not in view.partition_keys:
+                self._mark(view, None)
+            else:
+                self._mark(view, view.partition_keys[collection_name](doc))
+
+    def track(self, collection_name, documents):
+        """
+        Ingest hook: pass `documents` through, recording the partitions they touch.
+        """
+        for doc in documents:
+            self.record(collection_name, doc)
+            yield doc
+
+    def refresh(self, name, keys=None, **metadata):
+        """
+        Recompute a view, in full or only for the partitions in `keys`, and return its
+        updated metadata.
+        """
+        view = self.views[name]
+        target = self.db[target_name(view)]
+        token = uuid.uuid4().hex
+        start = time.perf_counter()
+
+        stages = _strip_sort(view.pipeline(self.db))
+        if keys is not None:
+            stages = [{"$match": {view.partition_field: {"$in": sorted(keys)}}}] + stages
+        stages += [
+            {"$set": {REFRESH_FIELD: token}},
+            {"$merge": {"into": target.name, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+        ]
+        self.db[view.source].aggregate(stages)
+
+        # Rows of the recomputed partitions that the pipeline no longer produces
+        stale = {REFRESH_FIELD: {"$ne": token}}
+        if keys is not None:
+            stale["_id"] = {"$in": sorted(keys)}
+        target.delete_many(stale)
+
+        metadata.update({
+            "target": target.name,
+            "mode": "full" if keys is None else "incremental",
+            "nPartitions": None if keys is None else len(keys),
+            "refreshedAt": time.time(),
+            "durationMs": (time.perf_counter() - start) * 1000,
+            "sourceVersions": {collection_name: data_version(self.db, collection_name)
+                               for collection_name in view.depends_on},
+        })
+        self.db[METADATA_COLLECTION].update_one({"_id": name}, {"$set": metadata}, upsert=True)
+        return metadata
+
+    def refresh_all(self, stale_only=False):
+        return {name: self.refresh(name) for name in self.views
+                if not stale_only or self.staleness(name)["stale"]}
+
+    def refresh_pending(self, **metadata):
+        """
+        Refresh every view with recorded changes and return their metadata. A view's
+        changes stay pending until its refresh succeeds.
+        """
+        with self._lock:
+            pending = {name: keys if keys is None else set(keys) for name, keys in self._pending.items()}
+
+        refreshed = {}
+        for name, keys in pending.items():
+            if keys is None or keys:
+                refreshed[name] = self.refresh(name, keys, **metadata)
+            with self._lock:
+                # Changes recorded during the refresh stay pending
+                current = self._pending.get(name, set())
+                if current is None:
+                    remaining = None if keys is not None else set()
+                else:
+                    remaining = current - keys if keys is not None else set()
+                if remaining is None or remaining:
+                    self._pending[name] = remaining
+                else:
+                    self._pending.pop(name, None)
+        return refreshed
+
+    def staleness(self, name):
+        """
+        Compare the data versions a view was refreshed at with the current ones.
+        """
+        view = self.views[name]
+        meta = self.db[METADATA_COLLECTION].find_one({"_id": name}) or {}
+        recorded = meta.get("sourceVersions", {})
+        behind = {collection_name: data_version(self.db, collection_name) - recorded.get(collection_name, 0)
+                  for collection_name in view.depends_on}
+        return {
+            "view": name,
+            "stale": not meta or any(behind.values()) or name in self._pending,
+            "behind": behind,
+            "refreshedAt": meta.get("refreshedAt"),
+            "ageSeconds": time.time() - meta["refreshedAt"] if meta else None,
+            "mode": meta.get("mode"),
+        }
+
+    def read(self, name, criteria=None, refresh_if_stale=False):
+        """
+        Documents of a view, in the order of the report it materializes.
+        """
+        view = self.views[name]
+        if refresh_if_stale and self.staleness(name)["stale"]:
+            self.refresh_pending()
+            if self.staleness(name)["stale"]:
+                self.refresh(name)
+        return list(self.db[target_name(view)].find(criteria or {}, {REFRESH_FIELD: 0}, sort=view.sort))
+
+    def enable_pre_images(self, collection_names):
+        """
+        Turn on change stream pre-images for `collection_names` (MongoDB 6.0+) and
+        return whether they are available.
+        """
+        if self.db.client.server_info()["versionArray"][0] < 6:
+            return False
+        existing = set(self.db.list_collection_names())
+        try:
+            for collection_name in collection_names:
+                if collection_name in existing:
+                    self.db.command("collMod", collection_name, changeStreamPreAndPostImages={"enabled": True})
+        except OperationFailure:
+            # Not permitted (or not supported by the deployment): no pre-images
+            return False
+        return True
+
+    def watch(self, max_events=None, poll_interval=0.5):
+        """
+        Follow a change stream on the source collections and refresh the affected views
+        whenever the stream goes idle. Requires a replica set; resumes after the last
+        token stored in the metadata collection. Returns the number of events processed.
+        """
+        collections = sorted({name for view in self.views.values() for name in view.depends_on})
+        saved = self.db[METADATA_COLLECTION].find_one({"_id": CHANGE_STREAM_ID}) or {}
+        options = {"full_document_before_change": "whenAvailable"} if self.enable_pre_images(collections) else {}
+        n_events = 0
+
+        def flush(stream):
+            self.refresh_pending()
+            self.db[METADATA_COLLECTION].update_one(
+                {"_id": CHANGE_STREAM_ID}, {"$set": {"resumeToken": stream.resume_token}}, upsert=True)
+
+        with self.db.watch([{"$match": {"ns.coll": {"$in": collections}}}], full_document="updateLookup",
+                           resume_after=saved.get("resumeToken"), **options) as stream:
+            while max_events is None or n_events < max_events:
+                change = stream.try_next()
+                if change is None:
+                    if self._pending:
+                        flush(stream)
+                    time.sleep(poll_interval)
+                    continue
+                collection_name = change["ns"]["coll"]
+                before, after = change.get("fullDocumentBeforeChange"), change.get("fullDocument")
+                if before is None and change["operationType"] in ("update", "replace", "delete"):
+                    # The partitions the document used to belong to are unknown
+                    self.record(collection_name, None)
+                for doc in (before, after):
+                    if doc is not None:
+                        self.record(collection_name, doc)
+                n_events += 1
+            flush(stream)
+        return n_events
+
+
+def gap_years_aggregated_view(mongo_client, registry=None):
+    """
+    agg_pipelines.gap_years_aggregated read from its view.
+    """
+    registry = registry or ViewRegistry(mongo_client)
+    for doc in registry.read("gap_years"):
+        print("{year}: {missing}".format(year=doc["_id"], missing=", ".join(sorted(doc["missing"]))))
+
+
+def aggregation_pipeline4_view(mongo_client, registry=None):
+    registry = registry or ViewRegistry(mongo_client)
+    for doc in registry.read("affiliation_born"): print(doc)
+
+
+def aggregation_pipeline5_view(mongo_client, registry=None):
+    registry = registry or ViewRegistry(mongo_client)
+    for doc in registry.read("born_countries"): print(doc)